@@ -1,4 +1,5 @@
 from datetime import datetime, timedelta, date
+import html
 import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
@@ -7,10 +8,25 @@ from google.oauth2 import service_account
 import io
 from streamlit_autorefresh import st_autorefresh
 import streamlit.components.v1 as components
-import hashlib
+from gcs_store import SnapshotRefresher, blob_entry, read_manifest, read_partitions, read_snapshot, shared_parse, snapshot_status
+from ingest import GI_SCHEMA, apply_schema, filter_gi_frame, normalise_gi_frame, partition_by_zone, read_gi_workbook, select_partitions
+from history import HISTORY_WINDOWS, load_window, record_rollups
+from outbound import (
+    WINDOW_DAYS, WindowAggregate, describe_delta, fingerprint, ingest_snapshot, resolve_zones, sort_by_day, zone_group,
+    zone_group_title
+)
+from render_cache import cached
+from timing import begin_trace, end_trace, lap, span, timing_panel
 
 # ---------- CONFIG ----------
-st.set_page_config(layout="wide", page_title="Outbound Dashboard Aircon", page_icon="📊")
+# ?zone= in the URL shows another zone group (or list of zones) on this dashboard;
+# the title, background poller and timing trace all follow it
+zone_param = st.query_params.get('zone')
+zones = resolve_zones(zone_param, 'aircon')
+group = zone_group(zone_param, 'aircon')
+page_title = f"Outbound Dashboard {zone_group_title(group)}"
+st.set_page_config(layout="wide", page_title=page_title, page_icon="📊")
+trace = begin_trace(group)
 
 CONFIG = {
     "priority_map": {
@@ -55,24 +71,21 @@ BUCKET_NAME = "testbucket352"
 gcs_client = storage.Client(credentials=credentials, project=st.secrets["gcp_service_account"]["project_id"])
 bucket = gcs_client.bucket(BUCKET_NAME)
 
-def download_latest_excel(bucket):
-    blobs = list(bucket.list_blobs())
+def find_latest_excel(bucket):
+    """
+    Return the newest GI analysis file as a manifest entry. Reads the small
+    manifest published by Upload.py and only lists the bucket if it is missing.
+    """
+    entry = read_manifest(bucket, 'gi')
+    if entry and 'gianalysis' in entry['blob_name'].lower():
+        return entry
+    with span("list_blobs") as s:
+        blobs = list(bucket.list_blobs())
+        s["blobs"] = len(blobs)
     aircon_blobs = [b for b in blobs if 'gianalysis' in b.name.lower() and b.name.lower().endswith(('.xlsx', '.xls'))]
     if not aircon_blobs:
-        return None, None
-    latest_blob = max(aircon_blobs, key=lambda b: b.updated)
-    file_bytes = latest_blob.download_as_bytes()
-    return io.BytesIO(file_bytes), latest_blob.name
-
-# ---------- FETCH LATEST FILE ----------
-file_stream, file_name = download_latest_excel(bucket)
-if file_stream:
-    file_stream.seek(0)
-    st.sidebar.success(f"📥 Using latest file from GCS: {file_name}")
-    st.sidebar.info(f"🔄 Last refresh: {datetime.now().strftime('%H:%M:%S')}")
-else:
-    st.sidebar.error("❌ No Excel files found in GCS bucket.")
-    st.stop()
+        return None
+    return blob_entry(max(aircon_blobs, key=lambda b: b.updated))
 
 # ---------- GLOBAL STYLE OVERRIDES ----------
 st.markdown(
@@ -146,7 +159,7 @@ components.html(
         <div class="header-container">
             <div class="header-left">
                 <img src="https://raw.githubusercontent.com/sherman51/GI-GR-Data-analysis/main/SSW%20Logo.png" alt="Logo">
-                <h2>Outbound Dashboard Aircon</h2>
+                <h2>DASHBOARD_TITLE</h2>
             </div>
             <div id="clock">-- --- --:--:--</div>
         </div>
@@ -166,148 +179,196 @@ components.html(
         </script>
     </body>
     </html>
-    """,
+    """.replace("DASHBOARD_TITLE", html.escape(page_title)),
     height=85
 )
 
 # ---------- HELPER FUNCTIONS ----------
+valid_types = ["Back Order", "Disposal", "Goods Issue", "Forward Deploy"]
+
 def load_data(file):
+    # Parses every zone once and splits the rows by StorageZone, so the
+    # partitions can be shared with the other zone dashboards in this process
     try:
         file.seek(0)
-        df = pd.read_excel(file, skiprows=6, engine='openpyxl')
+        with span("parse") as s:
+            df = read_gi_workbook(file, types=valid_types)
+            s["rows"] = len(df)
     except Exception as e:
-        st.error(f"❌ Failed to read Excel file: {str(e)}")
-        st.stop()
+        raise ValueError(f"Failed to read Excel file: {str(e)}")
 
-    df.columns = df.columns.str.strip()
-    df.dropna(axis=1, how="all", inplace=True)
-    df.dropna(how="all", inplace=True)
+    with span("partition"):
+        return partition_by_zone(normalise_gi_frame(df))
 
-    for col in ['ExpDate', 'CreatedOn', 'ShippedOn']:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], format='%d/%b/%Y', errors='coerce')
+def download_and_parse(entry):
+    with span("download") as s:
+        file_bytes = bucket.blob(entry['blob_name'], generation=entry['generation']).download_as_bytes()
+        s["bytes"] = len(file_bytes)
+    return load_data(io.BytesIO(file_bytes))
 
-    df = df[df['ExpDate'].notna()].copy()
+def prepare_data(df):
     df['Order Type'] = df['Priority'].map(CONFIG['priority_map']).fillna(df['Priority'])
     df['Status'] = df['Status'].astype(str).str.strip()
+    df['Type'] = df['Type'].astype(str).str.strip()
     df['Order Status'] = df['Status'].map(CONFIG['status_map']).fillna('Open')
 
-    return df
+    # Categoricals and compact integers once, after the derived columns exist
+    return sort_by_day(apply_schema(df, GI_SCHEMA))
+
+def load_entry(entry, zones):
+    # Runs on the background refresher thread, only when GCS reports a new generation.
+    # Prefer this dashboard's zone partitions of the snapshot written by Upload.py,
+    # then a whole-file snapshot; otherwise parse the Excel file once per process.
+    snapshot = entry.get('snapshot')
+    if snapshot and snapshot.get('partitions') is not None:
+        partitions = read_partitions(bucket, snapshot, zones)
+        if partitions is not None:
+            with span("normalise"):
+                return prepare_data(filter_gi_frame(select_partitions(partitions, zones), types=valid_types))
+    elif snapshot:
+        df = read_snapshot(bucket, snapshot['blob_name'], snapshot['generation'])
+        if df is not None:
+            with span("normalise"):
+                return prepare_data(filter_gi_frame(df, zones=zones, types=valid_types))
+    partitions = shared_parse(entry, download_and_parse)
+    with span("normalise"):
+        return prepare_data(select_partitions(partitions, zones))
+
+@st.cache_resource
+def get_refresher(group, zones):
+    # One background poller per zone group per server process, shared by every wallboard session.
+    # Each new file is diffed against the previous one so only changed days are recomputed.
+    def derive(df, previous):
+        # Keep each file's daily rollups so Analytics can reach back past the newest file
+        with span("history") as s:
+            s["rows"] = record_rollups(df, zones)
+        return ingest_snapshot(df, previous, CONFIG)
+
+    return SnapshotRefresher(
+        lambda: find_latest_excel(bucket), lambda entry: load_entry(entry, zones),
+        derive=derive,
+        name=group
+    )
 
-# ---------- LOAD & FILTER DATA ----------
-df = load_data(file_stream)
+# ---------- FETCH LATEST SNAPSHOT ----------
+refresher = get_refresher(group, zones)
+snapshot = refresher.current()
+if snapshot is None:
+    if refresher.last_error:
+        st.sidebar.error(f"❌ Failed to load latest file: {refresher.last_error}")
+    else:
+        st.sidebar.error("❌ No Excel files found in GCS bucket.")
+    # Early exits are timed too, so p50/p95 cover every rerun
+    end_trace(trace)
+    timing_panel(st.sidebar, trace, refresher.last_load_trace)
+    st.stop()
 
-aircon_zones = ['aircon', 'controlled drug room', 'strong room']
-df = df[df['StorageZone'].astype(str).str.strip().str.lower().isin(aircon_zones)].copy()
+st.sidebar.success(f"📥 Using latest file from GCS: {snapshot.entry['blob_name']}")
+st.sidebar.info(f"🔄 Last refresh: {datetime.now().strftime('%H:%M:%S')}")
+st.sidebar.caption(f"Zones: {', '.join(zones)}")
+st.sidebar.caption(snapshot_status(refresher))
+if snapshot.aggregates.delta is not None:
+    st.sidebar.caption(describe_delta(snapshot.aggregates.delta))
+if refresher.last_error:
+    st.sidebar.warning(f"⚠️ Background refresh failed, showing last good data: {refresher.last_error}")
 
-valid_types = ["Back Order", "Disposal", "Goods Issue", "Forward Deploy"]
-df['Type'] = df['Type'].astype(str).str.strip()
-df = df[df['Type'].isin(valid_types)].copy()
+# ---------- LOAD & FILTER DATA ----------
+# Shared, in-memory frame: filter into new frames, never modify in place
+df = snapshot.frame
+aggregates = snapshot.aggregates
+lap("fetch")
 
 st.sidebar.metric("Total Records", df.shape[0])
 st.sidebar.metric("Unique GI Numbers", df['GINo'].nunique())
 
-data_hash = hashlib.md5(f"{df.shape[0]}_{df['GINo'].sum() if 'GINo' in df.columns else 0}_{refresh_count}".encode()).hexdigest()[:8]
-
 # ---------- DASHBOARD FUNCTIONS ----------
-def daily_completed_pie(df_today, dash_date, key_prefix=""):
-    df_active = df_today[df_today['Order Status'] != 'Cancelled']
-    total_orders = df_active.shape[0]
-    today = pd.Timestamp.today().normalize().date()
-
-    if dash_date == today:
-        completed_orders = df_active[df_active['Order Status'] == 'Shipped'].shape[0]
-        completed_label = "Completed"
-    else:
-        completed_orders = df_active['Order Status'].isin(['Packed', 'Shipped']).sum()
-        completed_label = "Completed (Packed)"
-
-    completed_pct = (completed_orders / total_orders * 100) if total_orders else 0
-
-    fig = go.Figure(go.Pie(
-        values=[completed_pct, 100 - completed_pct],
-        labels=[completed_label, "Outstanding"],
-        marker_colors=['mediumseagreen', 'lightgray'],
-        hole=0.6,
-        textinfo='none',
-        sort=False
-    ))
-    fig.update_layout(
-        width=149, height=149,
-        margin=dict(l=5, r=5, t=5, b=5),
-        showlegend=True,
-        legend=dict(orientation="v", yanchor="middle", y=0.5, xanchor="left", x=1.05, font=dict(size=10)),
-        annotations=[dict(text=f"{completed_pct:.1f}%", x=0.5, y=0.5, font_size=16, showarrow=False)]
-    )
-    st.plotly_chart(fig, use_container_width=True, key=f"{key_prefix}_completed_{data_hash}")
-
-def order_status_matrix(df_today, key_prefix=""):
-    df_status_table = df_today.groupby(["Order Type", "Order Status"]).size().unstack(fill_value=0)
-    df_status_table = df_status_table.reindex(
-        index=CONFIG['order_types'],
-        columns=CONFIG['status_segments'],
-        fill_value=0
-    )
-    df_status_table["Total"] = df_status_table.sum(axis=1)
-    total_row = df_status_table.sum(axis=0)
-    total_row.name = "Total"
-    df_status_table = pd.concat([df_status_table, total_row.to_frame().T])
-
-    def highlight_cell(val, row_name, col_name):
-        if col_name in ["Shipped", "Cancelled", "Total"]:
-            return ""
-        if val <= 0:
+def daily_completed_pie(panels, key_prefix=""):
+    completed_pct = panels['completed_pct']
+    completed_label = panels['completed_label']
+
+    def build():
+        fig = go.Figure(go.Pie(
+            values=[completed_pct, 100 - completed_pct],
+            labels=[completed_label, "Outstanding"],
+            marker_colors=['mediumseagreen', 'lightgray'],
+            hole=0.6,
+            textinfo='none',
+            sort=False
+        ))
+        fig.update_layout(
+            width=149, height=149,
+            margin=dict(l=5, r=5, t=5, b=5),
+            showlegend=True,
+            legend=dict(orientation="v", yanchor="middle", y=0.5, xanchor="left", x=1.05, font=dict(size=10)),
+            annotations=[dict(text=f"{completed_pct:.1f}%", x=0.5, y=0.5, font_size=16, showarrow=False)]
+        )
+        return fig
+
+    fig = cached("completed_pie", (completed_label, completed_pct), build)
+    st.plotly_chart(fig, use_container_width=True, key=f"{key_prefix}_completed_{fingerprint(completed_label, completed_pct)}")
+
+def order_status_matrix(panels, key_prefix=""):
+    df_status_table = panels['status_table']
+
+    def build():
+        def highlight_cell(val, row_name, col_name):
+            if col_name in ["Shipped", "Cancelled", "Total"]:
+                return ""
+            if val <= 0:
+                return ""
+            if row_name == "Ad-hoc Urgent":
+                return "background-color: #f8e5a1"
+            if row_name == "Ad-hoc Critical":
+                return "background-color: #f5a1a1"
+            if row_name == "Ad-hoc Normal":
+                return "background-color: #ADD8E6"
             return ""
-        if row_name == "Ad-hoc Urgent":
-            return "background-color: #f8e5a1"
-        if row_name == "Ad-hoc Critical":
-            return "background-color: #f5a1a1"
-        if row_name == "Ad-hoc Normal":
-            return "background-color: #ADD8E6"
-        return ""
-
-    def highlight_df(df):
-        styles = pd.DataFrame("", index=df.index, columns=df.columns)
-        for r in df.index:
-            if r == "Total":
-                continue
-            for c in df.columns:
-                styles.at[r, c] = highlight_cell(df.at[r, c], r, c)
-        return styles
-
-    styled_df = (
-        df_status_table.style
-            .apply(highlight_df, axis=None)
-            .set_table_styles([{
-                "selector": "th",
-                "props": [("padding", "6px 8px"), ("font-size", "11px"), ("font-weight", "600"),
-                          ("font-family", "'Segoe UI', sans-serif"), ("border", "1px solid #d1d5db"),
-                          ("text-align", "center"), ("background-color", "#f3f4f6"), ("color", "#374151"),
-                          ("width", "12.5%"), ("min-width", "65px")],
-            }, {
-                "selector": "td",
-                "props": [("padding", "5px 6px"), ("font-size", "11px"), ("font-family", "'Segoe UI', sans-serif"),
-                          ("border", "1px solid #e5e7eb"), ("text-align", "center"), ("color", "#1f2937"),
-                          ("width", "12.5%"), ("min-width", "65px")],
-            }, {
-                "selector": "th:first-child, td:first-child",
-                "props": [("width", "14%"), ("min-width", "100px"), ("text-align", "left"), ("padding-left", "10px")],
-            }, {
-                "selector": "table",
-                "props": [("border-collapse", "collapse"), ("width", "100%"), ("table-layout", "fixed"),
-                          ("margin", "0 auto"), ("box-shadow", "0 1px 3px rgba(0,0,0,0.1)"),
-                          ("border-radius", "8px"), ("overflow", "hidden"), ("font-family", "'Segoe UI', sans-serif")],
-            }, {
-                "selector": "tbody tr:hover",
-                "props": [("background-color", "#f9fafb")],
-            }, {
-                "selector": "tbody tr:last-child",
-                "props": [("font-weight", "600"), ("background-color", "#f3f4f6")],
-            }])
-            .format("{:.0f}")
-    )
 
-    html_code = styled_df.to_html()
+        def highlight_df(df):
+            styles = pd.DataFrame("", index=df.index, columns=df.columns)
+            for r in df.index:
+                if r == "Total":
+                    continue
+                for c in df.columns:
+                    styles.at[r, c] = highlight_cell(df.at[r, c], r, c)
+            return styles
+
+        styled_df = (
+            df_status_table.style
+                .apply(highlight_df, axis=None)
+                .set_table_styles([{
+                    "selector": "th",
+                    "props": [("padding", "6px 8px"), ("font-size", "11px"), ("font-weight", "600"),
+                              ("font-family", "'Segoe UI', sans-serif"), ("border", "1px solid #d1d5db"),
+                              ("text-align", "center"), ("background-color", "#f3f4f6"), ("color", "#374151"),
+                              ("width", "12.5%"), ("min-width", "65px")],
+                }, {
+                    "selector": "td",
+                    "props": [("padding", "5px 6px"), ("font-size", "11px"), ("font-family", "'Segoe UI', sans-serif"),
+                              ("border", "1px solid #e5e7eb"), ("text-align", "center"), ("color", "#1f2937"),
+                              ("width", "12.5%"), ("min-width", "65px")],
+                }, {
+                    "selector": "th:first-child, td:first-child",
+                    "props": [("width", "14%"), ("min-width", "100px"), ("text-align", "left"), ("padding-left", "10px")],
+                }, {
+                    "selector": "table",
+                    "props": [("border-collapse", "collapse"), ("width", "100%"), ("table-layout", "fixed"),
+                              ("margin", "0 auto"), ("box-shadow", "0 1px 3px rgba(0,0,0,0.1)"),
+                              ("border-radius", "8px"), ("overflow", "hidden"), ("font-family", "'Segoe UI', sans-serif")],
+                }, {
+                    "selector": "tbody tr:hover",
+                    "props": [("background-color", "#f9fafb")],
+                }, {
+                    "selector": "tbody tr:last-child",
+                    "props": [("font-weight", "600"), ("background-color", "#f3f4f6")],
+                }])
+                .format("{:.0f}")
+        )
+
+        html_code = styled_df.to_html()
+        return html_code
+
+    html_code = cached("status_matrix", df_status_table, build)
     with st.container():
         components.html(
             f"""
@@ -320,27 +381,26 @@ def order_status_matrix(df_today, key_prefix=""):
             scrolling=True
         )
 
-def expiry_date_summary(df, key_prefix=""):
-    recent_df = df[df['ExpDate'] >= pd.Timestamp.today() - pd.Timedelta(days=14)]
-    daily_summary = recent_df.groupby(recent_df['ExpDate'].dt.strftime("%d-%b"))['GINo'].count()
-    cancelled_summary = recent_df[recent_df['Status'] == '98-Cancelled'] \
-        .groupby(recent_df['ExpDate'].dt.strftime("%d-%b"))['GINo'].count()
-    dates = pd.date_range(end=datetime.today(), periods=14).strftime("%d-%b")
-    orders_received = [daily_summary.get(date, 0) for date in dates]
-    orders_cancelled = [cancelled_summary.get(date, 0) for date in dates]
-    fig = go.Figure(data=[
-        go.Bar(name='Orders Received', x=dates, y=orders_received, marker_color='lightgreen'),
-        go.Bar(name='Orders Cancelled', x=dates, y=orders_cancelled, marker_color='indianred')
-    ])
-    fig.update_layout(barmode='group', xaxis_title='Expiry Date', yaxis_title='Order Count')
-    st.plotly_chart(fig, use_container_width=True, key=f"{key_prefix}_expiry_{data_hash}")
-
-def order_volume_summary(df, key_prefix=""):
-    today = pd.Timestamp.today().normalize()
-    recent_df = df[(df['ExpDate'] >= today - pd.Timedelta(days=14)) & (df['ExpDate'] <= today)]
-    daily_counts = recent_df.groupby(recent_df['ExpDate'].dt.date)['GINo'].count()
+def expiry_date_summary(window, key_prefix=""):
+    daily = window.expiry()
+    dates = daily.index.strftime("%d-%b")
+    orders_received = daily['lines'].tolist()
+    orders_cancelled = daily['cancelled'].tolist()
+    def build():
+        fig = go.Figure(data=[
+            go.Bar(name='Orders Received', x=dates, y=orders_received, marker_color='lightgreen'),
+            go.Bar(name='Orders Cancelled', x=dates, y=orders_cancelled, marker_color='indianred')
+        ])
+        fig.update_layout(barmode='group', xaxis_title='Expiry Date', yaxis_title='Order Count')
+        return fig
+
+    fig = cached("expiry", (list(dates), orders_received, orders_cancelled), build)
+    st.plotly_chart(fig, use_container_width=True, key=f"{key_prefix}_expiry_{fingerprint(list(dates), orders_received, orders_cancelled)}")
+
+def order_volume_summary(window, key_prefix=""):
+    daily_counts = window.volume()
     if daily_counts.empty:
-        st.info("No orders found for the past 14 days.")
+        st.info(f"No orders found for the past {window.days} days.")
         return
     peak_day_vol = daily_counts.max()
     avg_vol = daily_counts.mean()
@@ -353,30 +413,37 @@ def order_volume_summary(df, key_prefix=""):
     with col3:
         st.markdown(f"<div class='metric-container'><div class='metric-value'>{low_day_vol}</div><div class='metric-label'>📉 Lowest Day Volume</div></div>", unsafe_allow_html=True)
 
-def performance_metrics(df, key_prefix=""):
-    today = pd.Timestamp.today().normalize()
-    recent_past_df = df[(df['ExpDate'] < today) & (df['ExpDate'] >= today - pd.Timedelta(days=14))]
-    total_expected = recent_past_df['ExpectedQTY'].sum()
-    total_shipped = recent_past_df['ShippedQTY'].sum()
-    total_variance = recent_past_df['VarianceQTY'].sum()
+def performance_metrics(window, key_prefix=""):
+    totals = window.past_totals()
+    total_expected = totals['ExpectedQTY']
+    total_shipped = totals['ShippedQTY']
+    total_variance = totals['VarianceQTY']
     missed = total_expected - total_shipped
     accuracy_pct = (total_shipped / total_expected * 100) if total_expected else 0
     backorder_pct = (total_variance / total_expected * 100) if total_expected else 0
     col1, col2 = st.columns(2)
     with col1:
-        fig1 = go.Figure(go.Pie(values=[backorder_pct, 100 - backorder_pct], hole=0.65,
-                                marker_colors=['#ff9999', '#e6e6e6'], textinfo='none'))
-        fig1.update_layout(showlegend=False, margin=dict(t=0, b=0, l=0, r=0), height=250,
-                           annotations=[dict(text=f"{backorder_pct:.1f}%", x=0.5, y=0.55, font_size=22, showarrow=False),
-                                        dict(text=f"{int(total_variance)} Variance", x=0.5, y=0.35, font_size=12, showarrow=False)])
-        st.plotly_chart(fig1, use_container_width=True, key=f"{key_prefix}_backorder_{data_hash}")
+        def build_backorder():
+            fig1 = go.Figure(go.Pie(values=[backorder_pct, 100 - backorder_pct], hole=0.65,
+                                    marker_colors=['#ff9999', '#e6e6e6'], textinfo='none'))
+            fig1.update_layout(showlegend=False, margin=dict(t=0, b=0, l=0, r=0), height=250,
+                               annotations=[dict(text=f"{backorder_pct:.1f}%", x=0.5, y=0.55, font_size=22, showarrow=False),
+                                            dict(text=f"{int(total_variance)} Variance", x=0.5, y=0.35, font_size=12, showarrow=False)])
+            return fig1
+
+        fig1 = cached("backorder_pie", (backorder_pct, total_variance), build_backorder)
+        st.plotly_chart(fig1, use_container_width=True, key=f"{key_prefix}_backorder_{fingerprint(backorder_pct, total_variance)}")
     with col2:
-        fig2 = go.Figure(go.Pie(values=[accuracy_pct, 100 - accuracy_pct], hole=0.65,
-                                marker_colors=['#7cd992', '#e6e6e6'], textinfo='none'))
-        fig2.update_layout(showlegend=False, margin=dict(t=0, b=0, l=0, r=0), height=250,
-                           annotations=[dict(text=f"{accuracy_pct:.1f}%", x=0.5, y=0.55, font_size=22, showarrow=False),
-                                        dict(text=f"{int(missed)} Missed", x=0.5, y=0.35, font_size=12, showarrow=False)])
-        st.plotly_chart(fig2, use_container_width=True, key=f"{key_prefix}_accuracy_{data_hash}")
+        def build_accuracy():
+            fig2 = go.Figure(go.Pie(values=[accuracy_pct, 100 - accuracy_pct], hole=0.65,
+                                    marker_colors=['#7cd992', '#e6e6e6'], textinfo='none'))
+            fig2.update_layout(showlegend=False, margin=dict(t=0, b=0, l=0, r=0), height=250,
+                               annotations=[dict(text=f"{accuracy_pct:.1f}%", x=0.5, y=0.55, font_size=22, showarrow=False),
+                                            dict(text=f"{int(missed)} Missed", x=0.5, y=0.35, font_size=12, showarrow=False)])
+            return fig2
+
+        fig2 = cached("accuracy_pie", (accuracy_pct, missed), build_accuracy)
+        st.plotly_chart(fig2, use_container_width=True, key=f"{key_prefix}_accuracy_{fingerprint(accuracy_pct, missed)}")
 
 # ---------- DATE LOGIC ----------
 date_list = []
@@ -386,12 +453,9 @@ today = datetime.today().date()
 
 while len(date_list) < 3 and days_checked < 20:
     weekday = current_date.weekday()
-    df_day = df[df['ExpDate'].dt.date == current_date]
 
-    if current_date != today:
-        df_day = df_day[df_day['Type'] != 'Forward Deploy']
-
-    order_count = df_day['GINo'].count()
+    # Counts come from the date index; Forward Deploy lines only count towards today
+    order_count = aggregates.dates.count(current_date, include_forward_deploy=current_date == today)
 
     if weekday == 6 or order_count == 0:
         current_date += timedelta(days=1)
@@ -408,6 +472,9 @@ tab1, tab2 = st.tabs(["📊 Daily Dashboard", "📈 Analytics"])
 with tab1:
     if len(date_list) == 0:
         st.warning("⚠️ No orders found in the next 20 days.")
+        # Early exits are timed too, so p50/p95 cover every rerun
+        end_trace(trace)
+        timing_panel(st.sidebar, trace, refresher.last_load_trace)
         st.stop()
 
     layout = []
@@ -421,7 +488,8 @@ with tab1:
     col_index = 0
     for i, dash_date in enumerate(date_list):
         with cols[col_index]:
-            df_day = df[df['ExpDate'].dt.date == dash_date]
+            with span("aggregate", day=str(dash_date)):
+                panels = aggregates.day(dash_date, today)
 
             st.markdown(
                 f"<h3 style='text-align:center; color:#4b5563; margin-bottom:8px; font-weight:bold;'>{dash_date.strftime('%d %b %Y')}</h3>",
@@ -436,7 +504,7 @@ with tab1:
                     f"""
                     <div style='background-color:#f9fafb;padding:8px 10px;border-radius:8px;text-align:center;
                                 font-size:14px;line-height:1.3;border:1px solid #e5e7eb;'>
-                        <div style='font-weight:600;font-size:18px;color:#111827;'>{df_day.shape[0]}</div>
+                        <div style='font-weight:600;font-size:18px;color:#111827;'>{panels['lines']}</div>
                         <div style='color:#6b7280;font-size:12px;'>📄 Order Lines</div>
                     </div>
                     """,
@@ -447,7 +515,7 @@ with tab1:
                     f"""
                     <div style='background-color:#f9fafb;padding:8px 10px;border-radius:8px;text-align:center;
                                 font-size:14px;line-height:1.3;border:1px solid #e5e7eb;'>
-                        <div style='font-weight:600;font-size:18px;color:#111827;'>{df_day['GINo'].nunique()}</div>
+                        <div style='font-weight:600;font-size:18px;color:#111827;'>{panels['gi_count']}</div>
                         <div style='color:#6b7280;font-size:12px;'>📦 No. of GIs</div>
                     </div>
                     """,
@@ -458,16 +526,7 @@ with tab1:
 
             top1, top2 = st.columns([1, 1.5])
             with top1:
-                today = pd.Timestamp.today().normalize().date()
-
-                if dash_date == today:
-                    critical_df = df_day[(df_day['Order Type'] == 'Ad-hoc Critical') &
-                                         (~df_day['Order Status'].isin(['Shipped', 'Cancelled']))]
-                else:
-                    critical_df = df_day[(df_day['Order Type'] == 'Ad-hoc Critical') &
-                                         (~df_day['Order Status'].isin(['Packed', 'Shipped', 'Cancelled']))]
-
-                critical_gis = critical_df['GINo'].unique().tolist() if not critical_df.empty else []
+                critical_gis = panels['critical_gis']
                 critical_text = "\n".join(map(str, critical_gis))
 
                 with st.expander(f"🚨 Critical Orders ({len(critical_gis)})", expanded=True):
@@ -484,18 +543,11 @@ with tab1:
                                 </button>
                             """, height=0)
                     st.text_area("GI Numbers:", value=critical_text if critical_text else "No critical orders",
-                                 height=100, key=f"{i}_critical_copy_text_{data_hash}", label_visibility="collapsed")
+                                 height=100, key=f"{i}_critical_copy_text_{fingerprint(critical_text)}", label_visibility="collapsed")
 
                 st.markdown("<div style='margin-top:12px;'></div>", unsafe_allow_html=True)
 
-                if dash_date == today:
-                    urgent_df = df_day[(df_day['Order Type'] == 'Ad-hoc Urgent') &
-                                       (~df_day['Order Status'].isin(['Shipped', 'Cancelled']))]
-                else:
-                    urgent_df = df_day[(df_day['Order Type'] == 'Ad-hoc Urgent') &
-                                       (~df_day['Order Status'].isin(['Packed', 'Shipped', 'Cancelled']))]
-
-                urgent_gis = urgent_df['GINo'].unique().tolist() if not urgent_df.empty else []
+                urgent_gis = panels['urgent_gis']
                 urgent_text = "\n".join(map(str, urgent_gis))
 
                 with st.expander(f"⚠️ Urgent Orders ({len(urgent_gis)})", expanded=True):
@@ -512,32 +564,15 @@ with tab1:
                                 </button>
                             """, height=0)
                     st.text_area("GI Numbers:", value=urgent_text if urgent_text else "No urgent orders",
-                                 height=170, key=f"{i}_urgent_copy_text_{data_hash}", label_visibility="collapsed")
+                                 height=170, key=f"{i}_urgent_copy_text_{fingerprint(urgent_text)}", label_visibility="collapsed")
 
             with top2:
                 st.markdown("<h5 style='text-align:center; margin-bottom:8px;'>✅ % Completion</h5>", unsafe_allow_html=True)
-                daily_completed_pie(df_day, dash_date, key_prefix=f"day{i}")
+                daily_completed_pie(panels, key_prefix=f"day{i}")
 
                 st.markdown("<div style='margin-top:12px;'></div>", unsafe_allow_html=True)
 
-                today = pd.Timestamp.today().normalize().date()
-
-                if dash_date == today:
-                    critical_urgent_outstanding = df_day[
-                        (df_day['Order Type'].isin(['Ad-hoc Critical', 'Ad-hoc Urgent'])) &
-                        (~df_day['Order Status'].isin(['Shipped', 'Cancelled']))
-                    ]
-                    others_outstanding = df_day[
-                        (~df_day['Order Type'].isin(['Ad-hoc Critical', 'Ad-hoc Urgent'])) &
-                        (~df_day['Order Status'].isin(['Packed', 'Shipped', 'Cancelled']))
-                    ]
-                    outstanding_df = pd.concat([critical_urgent_outstanding, others_outstanding])
-                else:
-                    outstanding_df = df_day[
-                        (~df_day['Order Status'].isin(['Packed', 'Shipped', 'Cancelled']))
-                    ]
-
-                outstanding_gis = outstanding_df['GINo'].unique().tolist() if not outstanding_df.empty else []
+                outstanding_gis = panels['outstanding_gis']
                 outstanding_text = "\n".join(map(str, outstanding_gis))
 
                 with st.expander(f"⏳ Outstanding Orders ({len(outstanding_gis)})", expanded=True):
@@ -554,10 +589,10 @@ with tab1:
                                 </button>
                             """, height=0)
                     st.text_area("GI Numbers:", value=outstanding_text if outstanding_text else "No outstanding orders",
-                                 height=170, key=f"{i}_outstanding_copy_text_{data_hash}", label_visibility="collapsed")
+                                 height=170, key=f"{i}_outstanding_copy_text_{fingerprint(outstanding_text)}", label_visibility="collapsed")
 
             st.markdown("<h5 style='margin-top:12px; margin-bottom:8px;'>📋 Order Status Table</h5>", unsafe_allow_html=True)
-            order_status_matrix(df_day, key_prefix=f"day{i}")
+            order_status_matrix(panels, key_prefix=f"day{i}")
 
         if i != len(date_list) - 1:
             with cols[col_index + 1]:
@@ -568,12 +603,27 @@ with tab1:
 
         col_index += 2
 
+lap("render_daily")
+
 with tab2:
+    # One window aggregate feeds all three charts: the last 14 days come from the
+    # current file, longer windows from the local history of daily rollups
+    window_days = st.selectbox("Window", HISTORY_WINDOWS, format_func=lambda d: f"Past {d} days",
+                               key="analytics_window")
+    with span("window", days=window_days):
+        if window_days == WINDOW_DAYS:
+            window = aggregates.window(today)
+        else:
+            window = WindowAggregate(load_window(zones, today, window_days))
     col1, col2 = st.columns(2)
     with col1:
-        st.markdown("### 📊 Order Lines (Past 14 Days)")
-        order_volume_summary(df, key_prefix="overall")
-        expiry_date_summary(df, key_prefix="overall")
+        st.markdown(f"### 📊 Order Lines (Past {window_days} Days)")
+        order_volume_summary(window, key_prefix="overall")
+        expiry_date_summary(window, key_prefix="overall")
     with col2:
         st.markdown("### 📈 Performance Metrics")
-        performance_metrics(df, key_prefix="overall")
+        performance_metrics(window, key_prefix="overall")
+
+lap("render_analytics")
+end_trace(trace)
+timing_panel(st.sidebar, trace, refresher.last_load_trace)
@@ -1,4 +1,5 @@
 from datetime import datetime, timedelta, date
+import html
 import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
@@ -7,10 +8,25 @@ from google.oauth2 import service_account
 import io
 from streamlit_autorefresh import st_autorefresh
 import streamlit.components.v1 as components
-import hashlib
+from gcs_store import SnapshotRefresher, blob_entry, read_manifest, read_partitions, read_snapshot, shared_parse, snapshot_status
+from ingest import GI_SCHEMA, apply_schema, filter_gi_frame, normalise_gi_frame, partition_by_zone, read_gi_workbook, select_partitions
+from history import HISTORY_WINDOWS, load_window, record_rollups
+from outbound import (
+    WINDOW_DAYS, WindowAggregate, describe_delta, fingerprint, ingest_snapshot, resolve_zones, sort_by_day, zone_group,
+    zone_group_title
+)
+from render_cache import cached
+from timing import begin_trace, end_trace, lap, span, timing_panel
 
 # ---------- CONFIG ----------
-st.set_page_config(layout="wide", page_title="Coldroom Dashboard Aircon", page_icon="📊")
+# ?zone= in the URL shows another zone group (or list of zones) on this dashboard;
+# the title, background poller and timing trace all follow it
+zone_param = st.query_params.get('zone')
+zones = resolve_zones(zone_param, 'coldroom')
+group = zone_group(zone_param, 'coldroom')
+page_title = f"Outbound Dashboard {zone_group_title(group)}"
+st.set_page_config(layout="wide", page_title=page_title, page_icon="📊")
+trace = begin_trace(group)
 
 CONFIG = {
     "priority_map": {
@@ -55,25 +71,22 @@ BUCKET_NAME = "testbucket352"
 gcs_client = storage.Client(credentials=credentials, project=st.secrets["gcp_service_account"]["project_id"])
 bucket = gcs_client.bucket(BUCKET_NAME)
 
-def download_latest_excel(bucket):
-    blobs = list(bucket.list_blobs())
+def find_latest_excel(bucket):
+    """
+    Return the newest GI analysis file as a manifest entry. Reads the small
+    manifest published by Upload.py and only lists the bucket if it is missing.
+    """
+    entry = read_manifest(bucket, 'gi')
+    if entry and 'gianalysis' in entry['blob_name'].lower():
+        return entry
+    with span("list_blobs") as s:
+        blobs = list(bucket.list_blobs())
+        s["blobs"] = len(blobs)
     aircon_blobs = [b for b in blobs if 'gianalysis' in b.name.lower() and b.name.lower().endswith(('.xlsx', '.xls'))]
     if not aircon_blobs:
-        return None, None
-    latest_blob = max(aircon_blobs, key=lambda b: b.updated)
-    file_bytes = latest_blob.download_as_bytes()
-    return io.BytesIO(file_bytes), latest_blob.name
-
-
-# ---------- FETCH LATEST FILE ----------
-file_stream, file_name = download_latest_excel(bucket)
-if file_stream:
-    file_stream.seek(0)  # Ensure we're at the start of the file
-    st.sidebar.success(f"📥 Using latest file from GCS: {file_name}")
-    st.sidebar.info(f"🔄 Last refresh: {datetime.now().strftime('%H:%M:%S')}")
-else:
-    st.sidebar.error("❌ No Excel files found in GCS bucket.")
-    st.stop()
+        return None
+    return blob_entry(max(aircon_blobs, key=lambda b: b.updated))
+
 
 # ---------- GLOBAL STYLE OVERRIDES ----------
 st.markdown(
@@ -267,7 +280,7 @@ components.html(
         <div class="header-container">
             <div class="header-left">
                 <img src="https://raw.githubusercontent.com/sherman51/GI-GR-Data-analysis/main/SSW%20Logo.png" alt="Logo">
-                <h2>Coldroom Dashboard Aircon</h2>
+                <h2>DASHBOARD_TITLE</h2>
             </div>
             <div id="clock">-- --- --:--:--</div>
         </div>
@@ -295,215 +308,250 @@ components.html(
         </script>
     </body>
     </html>
-    """,
+    """.replace("DASHBOARD_TITLE", html.escape(page_title)),
     height=85
 )
 
 
 # ---------- HELPER FUNCTIONS ----------
+valid_types = ["Back Order","Disposal", "Goods Issue", "Forward Deploy"]
+
 def load_data(file):
+    # Parses every zone once and splits the rows by StorageZone, so the
+    # partitions can be shared with the other zone dashboards in this process
     try:
         file.seek(0)
-        df = pd.read_excel(file, skiprows=6, engine='openpyxl')
+        with span("parse") as s:
+            df = read_gi_workbook(file, types=valid_types)
+            s["rows"] = len(df)
     except Exception as e:
-        st.error(f"❌ Failed to read Excel file: {str(e)}")
-        st.stop()
-
-    df.columns = df.columns.str.strip()
-    df.dropna(axis=1, how="all", inplace=True)
-    df.dropna(how="all", inplace=True)
+        raise ValueError(f"Failed to read Excel file: {str(e)}")
 
-    for col in ['ExpDate', 'CreatedOn', 'ShippedOn']:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], format='%d/%b/%Y', errors='coerce')
+    with span("partition"):
+        return partition_by_zone(normalise_gi_frame(df))
 
-    df = df[df['ExpDate'].notna()].copy()
+def download_and_parse(entry):
+    with span("download") as s:
+        file_bytes = bucket.blob(entry['blob_name'], generation=entry['generation']).download_as_bytes()
+        s["bytes"] = len(file_bytes)
+    return load_data(io.BytesIO(file_bytes))
 
+def prepare_data(df):
     df['Order Type'] = df['Priority'].map(CONFIG['priority_map']).fillna(df['Priority'])
     df['Status'] = df['Status'].astype(str).str.strip()
+    df['Type'] = df['Type'].astype(str).str.strip()
     df['Order Status'] = df['Status'].map(CONFIG['status_map']).fillna('Open')
 
-    return df
+    # Categoricals and compact integers once, after the derived columns exist
+    return sort_by_day(apply_schema(df, GI_SCHEMA))
+
+def load_entry(entry, zones):
+    # Runs on the background refresher thread, only when GCS reports a new generation.
+    # Prefer this dashboard's zone partitions of the snapshot written by Upload.py,
+    # then a whole-file snapshot; otherwise parse the Excel file once per process.
+    snapshot = entry.get('snapshot')
+    if snapshot and snapshot.get('partitions') is not None:
+        partitions = read_partitions(bucket, snapshot, zones)
+        if partitions is not None:
+            with span("normalise"):
+                return prepare_data(filter_gi_frame(select_partitions(partitions, zones), types=valid_types))
+    elif snapshot:
+        df = read_snapshot(bucket, snapshot['blob_name'], snapshot['generation'])
+        if df is not None:
+            with span("normalise"):
+                return prepare_data(filter_gi_frame(df, zones=zones, types=valid_types))
+    partitions = shared_parse(entry, download_and_parse)
+    with span("normalise"):
+        return prepare_data(select_partitions(partitions, zones))
+
+@st.cache_resource
+def get_refresher(group, zones):
+    # One background poller per zone group per server process, shared by every wallboard session.
+    # Each new file is diffed against the previous one so only changed days are recomputed.
+    def derive(df, previous):
+        # Keep each file's daily rollups so Analytics can reach back past the newest file
+        with span("history") as s:
+            s["rows"] = record_rollups(df, zones)
+        return ingest_snapshot(df, previous, CONFIG)
+
+    return SnapshotRefresher(
+        lambda: find_latest_excel(bucket), lambda entry: load_entry(entry, zones),
+        derive=derive,
+        name=group
+    )
 
-# Load data - create fresh copy
-df = load_data(file_stream)
+# ---------- FETCH LATEST SNAPSHOT ----------
+refresher = get_refresher(group, zones)
+snapshot = refresher.current()
+if snapshot is None:
+    if refresher.last_error:
+        st.sidebar.error(f"❌ Failed to load latest file: {refresher.last_error}")
+    else:
+        st.sidebar.error("❌ No Excel files found in GCS bucket.")
+    # Early exits are timed too, so p50/p95 cover every rerun
+    end_trace(trace)
+    timing_panel(st.sidebar, trace, refresher.last_load_trace)
+    st.stop()
 
-# Filter df - use .copy() to ensure clean filtering
-coldroom_zones = ['cold room', 'freezer']
-df = df[df['StorageZone'].astype(str).str.strip().str.lower().isin(coldroom_zones)].copy()
+st.sidebar.success(f"📥 Using latest file from GCS: {snapshot.entry['blob_name']}")
+st.sidebar.info(f"🔄 Last refresh: {datetime.now().strftime('%H:%M:%S')}")
+st.sidebar.caption(f"Zones: {', '.join(zones)}")
+st.sidebar.caption(snapshot_status(refresher))
+if snapshot.aggregates.delta is not None:
+    st.sidebar.caption(describe_delta(snapshot.aggregates.delta))
+if refresher.last_error:
+    st.sidebar.warning(f"⚠️ Background refresh failed, showing last good data: {refresher.last_error}")
 
-# Filter df by Type
-valid_types = ["Back Order","Disposal", "Goods Issue", "Forward Deploy"]
-df['Type'] = df['Type'].astype(str).str.strip()
-df = df[df['Type'].isin(valid_types)].copy()
+# Shared, in-memory frame: filter into new frames, never modify in place
+df = snapshot.frame
+aggregates = snapshot.aggregates
+lap("fetch")
 
 # Verify data freshness
 st.sidebar.metric("Total Records", df.shape[0])
 st.sidebar.metric("Unique GI Numbers", df['GINo'].nunique())
 
-# Create a data hash for keys - this will change when data changes
-data_hash = hashlib.md5(f"{df.shape[0]}_{df['GINo'].sum() if 'GINo' in df.columns else 0}_{refresh_count}".encode()).hexdigest()[:8]
-
 
 # ---------- DASHBOARD FUNCTIONS ----------
 # Daily completed pie
-def daily_completed_pie(df_today, dash_date, key_prefix=""):
-    # Exclude cancelled orders from the total count
-    df_active = df_today[df_today['Order Status'] != 'Cancelled']
-    total_orders = df_active.shape[0]
-
-    today = pd.Timestamp.today().normalize().date()
-    
-    # Determine what "completed" means based on the date
-    if dash_date == today:
-        # Today's orders: ALL must be shipped
-        completed_orders = df_active[df_active['Order Status'] == 'Shipped'].shape[0]
-        completed_label = "Completed"
-    else:
-        # D+1 and D+2 orders: All should be packed or shipped
-        completed_orders = df_active['Order Status'].isin(['Packed', 'Shipped']).sum()
-        completed_label = "Completed (Packed)"
-
-    completed_pct = (completed_orders / total_orders * 100) if total_orders else 0
-
-    fig = go.Figure(go.Pie(
-        values=[completed_pct, 100 - completed_pct],
-        labels=[completed_label, "Outstanding"],
-        marker_colors=['mediumseagreen', 'lightgray'],
-        hole=0.6,
-        textinfo='none',
-        sort=False
-    ))
-    fig.update_layout(
-        width=149,
-        height=149,
-        margin=dict(l=5, r=5, t=5, b=5),
-        showlegend=True,
-        legend=dict(
-            orientation="v",
-            yanchor="middle",
-            y=0.5,
-            xanchor="left",
-            x=1.05,
-            font=dict(size=10)
-        ),
-        annotations=[dict(text=f"{completed_pct:.1f}%", x=0.5, y=0.5, font_size=16, showarrow=False)]
-    )
-    st.plotly_chart(fig, use_container_width=True, key=f"{key_prefix}_completed_{data_hash}")
-
-def order_status_matrix(df_today, key_prefix=""):
-    # --- Build pivot table ---
-    df_status_table = df_today.groupby(["Order Type", "Order Status"]).size().unstack(fill_value=0)
-
-    df_status_table = df_status_table.reindex(
-        index=CONFIG['order_types'],
-        columns=CONFIG['status_segments'],
-        fill_value=0
-    )
-
-    df_status_table["Total"] = df_status_table.sum(axis=1)
+def daily_completed_pie(panels, key_prefix=""):
+    # Completion % is precomputed per day; today counts shipped, later days packed or shipped
+    completed_pct = panels['completed_pct']
+    completed_label = panels['completed_label']
+
+    def build():
+        fig = go.Figure(go.Pie(
+            values=[completed_pct, 100 - completed_pct],
+            labels=[completed_label, "Outstanding"],
+            marker_colors=['mediumseagreen', 'lightgray'],
+            hole=0.6,
+            textinfo='none',
+            sort=False
+        ))
+        fig.update_layout(
+            width=149,
+            height=149,
+            margin=dict(l=5, r=5, t=5, b=5),
+            showlegend=True,
+            legend=dict(
+                orientation="v",
+                yanchor="middle",
+                y=0.5,
+                xanchor="left",
+                x=1.05,
+                font=dict(size=10)
+            ),
+            annotations=[dict(text=f"{completed_pct:.1f}%", x=0.5, y=0.5, font_size=16, showarrow=False)]
+        )
+        return fig
 
-    total_row = df_status_table.sum(axis=0)
-    total_row.name = "Total"
+    fig = cached("completed_pie", (completed_label, completed_pct), build)
+    st.plotly_chart(fig, use_container_width=True, key=f"{key_prefix}_completed_{fingerprint(completed_label, completed_pct)}")
 
-    df_status_table = pd.concat([df_status_table, total_row.to_frame().T])
+def order_status_matrix(panels, key_prefix=""):
+    # --- Pivot table, precomputed per day ---
+    df_status_table = panels['status_table']
 
 
     # --- Cell highlighter ---
-    def highlight_cell(val, row_name, col_name):
-        # Don't highlight totals or completed statuses
-        if col_name in ["Shipped", "Cancelled", "Total"]:
-            return ""
-        if val <= 0:
+    def build():
+        def highlight_cell(val, row_name, col_name):
+            # Don't highlight totals or completed statuses
+            if col_name in ["Shipped", "Cancelled", "Total"]:
+                return ""
+            if val <= 0:
+                return ""
+
+            if row_name == "Ad-hoc Urgent":
+                return "background-color: #f8e5a1"
+            if row_name == "Ad-hoc Critical":
+                return "background-color: #f5a1a1"
+            if row_name == "Ad-hoc Normal":
+                return "background-color: #ADD8E6"
             return ""
 
-        if row_name == "Ad-hoc Urgent":
-            return "background-color: #f8e5a1"
-        if row_name == "Ad-hoc Critical":
-            return "background-color: #f5a1a1"
-        if row_name == "Ad-hoc Normal":
-            return "background-color: #ADD8E6"
-        return ""
-
-
-    # --- Build style dataframe ---
-    def highlight_df(df):
-        styles = pd.DataFrame("", index=df.index, columns=df.columns)
-        for r in df.index:
-            if r == "Total":
-                continue
-            for c in df.columns:
-                styles.at[r, c] = highlight_cell(df.at[r, c], r, c)
-        return styles
-
-
-    # --- Apply style ---
-    styled_df = (
-        df_status_table.style
-            .apply(highlight_df, axis=None)
-            .set_table_styles([{
-                "selector": "th",
-                "props": [
-                    ("padding", "6px 8px"),  # Reduced padding
-                    ("font-size", "11px"),  # Smaller font
-                    ("font-weight", "600"),
-                    ("font-family", "'Segoe UI', sans-serif"),
-                    ("border", "1px solid #d1d5db"),
-                    ("text-align", "center"),
-                    ("background-color", "#f3f4f6"),
-                    ("color", "#374151"),
-                    ("width", "12.5%"),  # Equal width for 8 columns (7 status + 1 total)
-                    ("min-width", "65px"),  # Reduced min-width
-                ],
-            }, {
-                "selector": "td",
-                "props": [
-                    ("padding", "5px 6px"),  # Reduced padding
-                    ("font-size", "11px"),  # Smaller font
-                    ("font-family", "'Segoe UI', sans-serif"),
-                    ("border", "1px solid #e5e7eb"),
-                    ("text-align", "center"),
-                    ("color", "#1f2937"),
-                    ("width", "12.5%"),  # Equal width for all data cells
-                    ("min-width", "65px"),  # Reduced min-width
-                ],
-            }, {
-                "selector": "th:first-child, td:first-child",  # Row header (Order Type column)
-                "props": [
-                    ("width", "14%"),  # Slightly reduced width
-                    ("min-width", "100px"),  # Reduced min-width
-                    ("text-align", "left"),
-                    ("padding-left", "10px"),  # Reduced padding
-                ],
-            }, {
-                "selector": "table",
-                "props": [
-                    ("border-collapse", "collapse"),
-                    ("width", "100%"),
-                    ("table-layout", "fixed"),  # KEY: Forces equal column widths
-                    ("margin", "0 auto"),
-                    ("box-shadow", "0 1px 3px rgba(0,0,0,0.1)"),
-                    ("border-radius", "8px"),
-                    ("overflow", "hidden"),
-                    ("font-family", "'Segoe UI', sans-serif"),
-                ],
-            }, {
-                "selector": "tbody tr:hover",
-                "props": [
-                    ("background-color", "#f9fafb"),
-                ],
-            }, {
-                "selector": "tbody tr:last-child",
-                "props": [
-                    ("font-weight", "600"),
-                    ("background-color", "#f3f4f6"),
-                ],
-            }])
-            .format("{:.0f}")
-    )
 
-    # --- Render HTML with injected font styling ---
-    html_code = styled_df.to_html()
+        # --- Build style dataframe ---
+        def highlight_df(df):
+            styles = pd.DataFrame("", index=df.index, columns=df.columns)
+            for r in df.index:
+                if r == "Total":
+                    continue
+                for c in df.columns:
+                    styles.at[r, c] = highlight_cell(df.at[r, c], r, c)
+            return styles
+
+
+        # --- Apply style ---
+        styled_df = (
+            df_status_table.style
+                .apply(highlight_df, axis=None)
+                .set_table_styles([{
+                    "selector": "th",
+                    "props": [
+                        ("padding", "6px 8px"),  # Reduced padding
+                        ("font-size", "11px"),  # Smaller font
+                        ("font-weight", "600"),
+                        ("font-family", "'Segoe UI', sans-serif"),
+                        ("border", "1px solid #d1d5db"),
+                        ("text-align", "center"),
+                        ("background-color", "#f3f4f6"),
+                        ("color", "#374151"),
+                        ("width", "12.5%"),  # Equal width for 8 columns (7 status + 1 total)
+                        ("min-width", "65px"),  # Reduced min-width
+                    ],
+                }, {
+                    "selector": "td",
+                    "props": [
+                        ("padding", "5px 6px"),  # Reduced padding
+                        ("font-size", "11px"),  # Smaller font
+                        ("font-family", "'Segoe UI', sans-serif"),
+                        ("border", "1px solid #e5e7eb"),
+                        ("text-align", "center"),
+                        ("color", "#1f2937"),
+                        ("width", "12.5%"),  # Equal width for all data cells
+                        ("min-width", "65px"),  # Reduced min-width
+                    ],
+                }, {
+                    "selector": "th:first-child, td:first-child",  # Row header (Order Type column)
+                    "props": [
+                        ("width", "14%"),  # Slightly reduced width
+                        ("min-width", "100px"),  # Reduced min-width
+                        ("text-align", "left"),
+                        ("padding-left", "10px"),  # Reduced padding
+                    ],
+                }, {
+                    "selector": "table",
+                    "props": [
+                        ("border-collapse", "collapse"),
+                        ("width", "100%"),
+                        ("table-layout", "fixed"),  # KEY: Forces equal column widths
+                        ("margin", "0 auto"),
+                        ("box-shadow", "0 1px 3px rgba(0,0,0,0.1)"),
+                        ("border-radius", "8px"),
+                        ("overflow", "hidden"),
+                        ("font-family", "'Segoe UI', sans-serif"),
+                    ],
+                }, {
+                    "selector": "tbody tr:hover",
+                    "props": [
+                        ("background-color", "#f9fafb"),
+                    ],
+                }, {
+                    "selector": "tbody tr:last-child",
+                    "props": [
+                        ("font-weight", "600"),
+                        ("background-color", "#f3f4f6"),
+                    ],
+                }])
+                .format("{:.0f}")
+        )
+
+        # --- Render HTML with injected font styling ---
+        html_code = styled_df.to_html()
+        return html_code
+
+    html_code = cached("status_matrix", df_status_table, build)
 
     with st.container():
         components.html(
@@ -526,28 +574,27 @@ def order_status_matrix(df_today, key_prefix=""):
 
 
 # Expiry date summary
-def expiry_date_summary(df, key_prefix=""):
-    recent_df = df[df['ExpDate'] >= pd.Timestamp.today() - pd.Timedelta(days=14)]
-    daily_summary = recent_df.groupby(recent_df['ExpDate'].dt.strftime("%d-%b"))['GINo'].count()
-    cancelled_summary = recent_df[recent_df['Status'] == '98-Cancelled'] \
-        .groupby(recent_df['ExpDate'].dt.strftime("%d-%b"))['GINo'].count()
-    dates = pd.date_range(end=datetime.today(), periods=14).strftime("%d-%b")
-    orders_received = [daily_summary.get(date, 0) for date in dates]
-    orders_cancelled = [cancelled_summary.get(date, 0) for date in dates]
-    fig = go.Figure(data=[
-        go.Bar(name='Orders Received', x=dates, y=orders_received, marker_color='lightgreen'),
-        go.Bar(name='Orders Cancelled', x=dates, y=orders_cancelled, marker_color='indianred')
-    ])
-    fig.update_layout(barmode='group', xaxis_title='Expiry Date', yaxis_title='Order Count')
-    st.plotly_chart(fig, use_container_width=True, key=f"{key_prefix}_expiry_{data_hash}")
+def expiry_date_summary(window, key_prefix=""):
+    daily = window.expiry()
+    dates = daily.index.strftime("%d-%b")
+    orders_received = daily['lines'].tolist()
+    orders_cancelled = daily['cancelled'].tolist()
+    def build():
+        fig = go.Figure(data=[
+            go.Bar(name='Orders Received', x=dates, y=orders_received, marker_color='lightgreen'),
+            go.Bar(name='Orders Cancelled', x=dates, y=orders_cancelled, marker_color='indianred')
+        ])
+        fig.update_layout(barmode='group', xaxis_title='Expiry Date', yaxis_title='Order Count')
+        return fig
+
+    fig = cached("expiry", (list(dates), orders_received, orders_cancelled), build)
+    st.plotly_chart(fig, use_container_width=True, key=f"{key_prefix}_expiry_{fingerprint(list(dates), orders_received, orders_cancelled)}")
 
 # Order volume summary
-def order_volume_summary(df, key_prefix=""):
-    today = pd.Timestamp.today().normalize()
-    recent_df = df[(df['ExpDate'] >= today - pd.Timedelta(days=14)) & (df['ExpDate'] <= today)]
-    daily_counts = recent_df.groupby(recent_df['ExpDate'].dt.date)['GINo'].count()
+def order_volume_summary(window, key_prefix=""):
+    daily_counts = window.volume()
     if daily_counts.empty:
-        st.info("No orders found for the past 14 days.")
+        st.info(f"No orders found for the past {window.days} days.")
         return
     peak_day_vol = daily_counts.max()
     avg_vol = daily_counts.mean()
@@ -561,28 +608,35 @@ def order_volume_summary(df, key_prefix=""):
         st.markdown(f"<div class='metric-container'><div class='metric-value'>{low_day_vol}</div><div class='metric-label'>📉 Lowest Day Volume</div></div>", unsafe_allow_html=True)
 
 # Performance metrics
-def performance_metrics(df, key_prefix=""):
-    today = pd.Timestamp.today().normalize()
-    recent_past_df = df[(df['ExpDate'] < today) & (df['ExpDate'] >= today - pd.Timedelta(days=14))]
-    total_expected = recent_past_df['ExpectedQTY'].sum()
-    total_shipped = recent_past_df['ShippedQTY'].sum()
-    total_variance = recent_past_df['VarianceQTY'].sum()
+def performance_metrics(window, key_prefix=""):
+    totals = window.past_totals()
+    total_expected = totals['ExpectedQTY']
+    total_shipped = totals['ShippedQTY']
+    total_variance = totals['VarianceQTY']
     missed = total_expected - total_shipped
     accuracy_pct = (total_shipped / total_expected * 100) if total_expected else 0
     backorder_pct = (total_variance / total_expected * 100) if total_expected else 0
     col1, col2 = st.columns(2)
     with col1:
-        fig1 = go.Figure(go.Pie(values=[backorder_pct, 100 - backorder_pct], hole=0.65, marker_colors=['#ff9999', '#e6e6e6'], textinfo='none'))
-        fig1.update_layout(showlegend=False, margin=dict(t=0, b=0, l=0, r=0), height=250,
-                           annotations=[dict(text=f"{backorder_pct:.1f}%", x=0.5, y=0.55, font_size=22, showarrow=False),
-                                        dict(text=f"{int(total_variance)} Variance", x=0.5, y=0.35, font_size=12, showarrow=False)])
-        st.plotly_chart(fig1, use_container_width=True, key=f"{key_prefix}_backorder_{data_hash}")
+        def build_backorder():
+            fig1 = go.Figure(go.Pie(values=[backorder_pct, 100 - backorder_pct], hole=0.65, marker_colors=['#ff9999', '#e6e6e6'], textinfo='none'))
+            fig1.update_layout(showlegend=False, margin=dict(t=0, b=0, l=0, r=0), height=250,
+                               annotations=[dict(text=f"{backorder_pct:.1f}%", x=0.5, y=0.55, font_size=22, showarrow=False),
+                                            dict(text=f"{int(total_variance)} Variance", x=0.5, y=0.35, font_size=12, showarrow=False)])
+            return fig1
+
+        fig1 = cached("backorder_pie", (backorder_pct, total_variance), build_backorder)
+        st.plotly_chart(fig1, use_container_width=True, key=f"{key_prefix}_backorder_{fingerprint(backorder_pct, total_variance)}")
     with col2:
-        fig2 = go.Figure(go.Pie(values=[accuracy_pct, 100 - accuracy_pct], hole=0.65, marker_colors=['#7cd992', '#e6e6e6'], textinfo='none'))
-        fig2.update_layout(showlegend=False, margin=dict(t=0, b=0, l=0, r=0), height=250,
-                           annotations=[dict(text=f"{accuracy_pct:.1f}%", x=0.5, y=0.55, font_size=22, showarrow=False),
-                                        dict(text=f"{int(missed)} Missed", x=0.5, y=0.35, font_size=12, showarrow=False)])
-        st.plotly_chart(fig2, use_container_width=True, key=f"{key_prefix}_accuracy_{data_hash}")
+        def build_accuracy():
+            fig2 = go.Figure(go.Pie(values=[accuracy_pct, 100 - accuracy_pct], hole=0.65, marker_colors=['#7cd992', '#e6e6e6'], textinfo='none'))
+            fig2.update_layout(showlegend=False, margin=dict(t=0, b=0, l=0, r=0), height=250,
+                               annotations=[dict(text=f"{accuracy_pct:.1f}%", x=0.5, y=0.55, font_size=22, showarrow=False),
+                                            dict(text=f"{int(missed)} Missed", x=0.5, y=0.35, font_size=12, showarrow=False)])
+            return fig2
+
+        fig2 = cached("accuracy_pie", (accuracy_pct, missed), build_accuracy)
+        st.plotly_chart(fig2, use_container_width=True, key=f"{key_prefix}_accuracy_{fingerprint(accuracy_pct, missed)}")
 
 
 # ---------- DATE LOGIC ----------
@@ -595,14 +649,8 @@ today = datetime.today().date()
 while len(date_list) < 3 and days_checked < 14:  # Extended to 14 days to find 3 valid days
     weekday = current_date.weekday()  # Monday = 0, Sunday = 6
 
-    # Filter to see if there are any orders for this date
-    df_day = df[df['ExpDate'].dt.date == current_date]
-    
-    # Exclude "Forward Deploy" orders for not today's order
-    if current_date != today:
-        df_day = df_day[df_day['Type'] != 'Forward Deploy']
-    
-    order_count = df_day['GINo'].count()
+    # Counts come from the date index; Forward Deploy lines only count towards today
+    order_count = aggregates.dates.count(current_date, include_forward_deploy=current_date == today)
 
     # Skip if Sunday OR if no orders exist for this day
     if weekday == 6 or order_count == 0:
@@ -618,6 +666,9 @@ while len(date_list) < 3 and days_checked < 14:  # Extended to 14 days to find 3
 # If we couldn't find 3 days with orders, just use what we found
 if len(date_list) == 0:
     st.warning("⚠️ No orders found in the next 14 days.")
+    # Early exits are timed too, so p50/p95 cover every rerun
+    end_trace(trace)
+    timing_panel(st.sidebar, trace, refresher.last_load_trace)
     st.stop()
 
 # ---------- DISPLAY ----------
@@ -635,7 +686,8 @@ with tab1:
     col_index = 0
     for i, dash_date in enumerate(date_list):
         with cols[col_index]:
-            df_day = df[df['ExpDate'].dt.date == dash_date]
+            with span("aggregate", day=str(dash_date)):
+                panels = aggregates.day(dash_date, today)
 
             # --- Date Header ---
             st.markdown(
@@ -661,7 +713,7 @@ with tab1:
                         line-height: 1.3;
                         border: 1px solid #e5e7eb;
                     '>
-                        <div style='font-weight: 600; font-size: 18px; color:#111827;'>{df_day.shape[0]}</div>
+                        <div style='font-weight: 600; font-size: 18px; color:#111827;'>{panels['lines']}</div>
                         <div style='color: #6b7280; font-size: 12px;'>📄 Order Lines</div>
                     </div>
                     """,
@@ -680,7 +732,7 @@ with tab1:
                         line-height: 1.3;
                         border: 1px solid #e5e7eb;
                     '>
-                        <div style='font-weight: 600; font-size: 18px; color:#111827;'>{df_day['GINo'].nunique()}</div>
+                        <div style='font-weight: 600; font-size: 18px; color:#111827;'>{panels['gi_count']}</div>
                         <div style='color: #6b7280; font-size: 12px;'>📦 No. of GIs</div>
                     </div>
                     """,
@@ -692,23 +744,11 @@ with tab1:
             # --- TOP ROW: Urgent/Critical stacked + Completion Pie ---
             top1, top2 = st.columns([1, 1.5])   # pie gets more space
             with top1:
-                # Determine completion criteria based on date
-                today = pd.Timestamp.today().normalize().date()
-                
                 # Critical Orders Section
-                if dash_date == today:
-                    # Today: critical orders outstanding = not shipped
-                    critical_df = df_day[(df_day['Order Type'] == 'Ad-hoc Critical') & 
-                                         (~df_day['Order Status'].isin(['Shipped', 'Cancelled']))]
-                else:
-                    # D+1 and D+2: critical orders outstanding = not packed/shipped
-                    critical_df = df_day[(df_day['Order Type'] == 'Ad-hoc Critical') & 
-                                         (~df_day['Order Status'].isin(['Packed', 'Shipped', 'Cancelled']))]
-                
-                critical_gis = critical_df['GINo'].unique().tolist() if not critical_df.empty else []
+                critical_gis = panels['critical_gis']
                 critical_text = "\n".join(map(str, critical_gis))  # Each GI on new line
                 
-                # Expandable copy section - KEY CHANGE: Added data_hash to key
+                # Expandable copy section - key changes only with its content
                 with st.expander(f"🚨 Critical Orders ({len(critical_gis)})", expanded=True):
                     col_label, col_copy = st.columns([4, 1])
                     with col_label:
@@ -727,26 +767,17 @@ with tab1:
                         "GI Numbers:",
                         value=critical_text if critical_text else "No critical orders",
                         height=100,
-                        key=f"{i}_critical_copy_text_{data_hash}",
+                        key=f"{i}_critical_copy_text_{fingerprint(critical_text)}",
                         label_visibility="collapsed"
                     )
                 
                 # Urgent Orders Section
                 st.markdown("<div style='margin-top:12px;'></div>", unsafe_allow_html=True)
                 
-                if dash_date == today:
-                    # Today: urgent orders outstanding = not shipped
-                    urgent_df = df_day[(df_day['Order Type'] == 'Ad-hoc Urgent') & 
-                                       (~df_day['Order Status'].isin(['Shipped', 'Cancelled']))]
-                else:
-                    # D+1 and D+2: urgent orders outstanding = not packed/shipped
-                    urgent_df = df_day[(df_day['Order Type'] == 'Ad-hoc Urgent') & 
-                                       (~df_day['Order Status'].isin(['Packed', 'Shipped', 'Cancelled']))]
-                
-                urgent_gis = urgent_df['GINo'].unique().tolist() if not urgent_df.empty else []
+                urgent_gis = panels['urgent_gis']
                 urgent_text = "\n".join(map(str, urgent_gis))  # Each GI on new line
                 
-                # Expandable copy section - KEY CHANGE: Added data_hash to key
+                # Expandable copy section - key changes only with its content
                 with st.expander(f"⚠️ Urgent Orders ({len(urgent_gis)})", expanded=True):
                     col_label, col_copy = st.columns([4, 1])
                     with col_label:
@@ -765,43 +796,21 @@ with tab1:
                         "GI Numbers:",
                         value=urgent_text if urgent_text else "No urgent orders",
                         height=100,
-                        key=f"{i}_urgent_copy_text_{data_hash}",
+                        key=f"{i}_urgent_copy_text_{fingerprint(urgent_text)}",
                         label_visibility="collapsed"
                     )
 
             with top2:
                 st.markdown("<h5 style='text-align:center; margin-bottom:8px;'>✅ % Completion</h5>", unsafe_allow_html=True)
-                daily_completed_pie(df_day, dash_date, key_prefix=f"day{i}")
+                daily_completed_pie(panels, key_prefix=f"day{i}")
                 
                 # Outstanding Orders Section
                 st.markdown("<div style='margin-top:12px;'></div>", unsafe_allow_html=True)
                 
-                # Determine outstanding orders based on date and order type
-                today = pd.Timestamp.today().normalize().date()
-                
-                if dash_date == today:
-                    # Today: different criteria based on order type
-                    # Critical/Urgent outstanding = not shipped
-                    critical_urgent_outstanding = df_day[
-                        (df_day['Order Type'].isin(['Ad-hoc Critical', 'Ad-hoc Urgent'])) & 
-                        (~df_day['Order Status'].isin(['Shipped', 'Cancelled']))
-                    ]
-                    # Others outstanding = not packed/shipped
-                    others_outstanding = df_day[
-                        (~df_day['Order Type'].isin(['Ad-hoc Critical', 'Ad-hoc Urgent'])) & 
-                        (~df_day['Order Status'].isin(['Packed', 'Shipped', 'Cancelled']))
-                    ]
-                    outstanding_df = pd.concat([critical_urgent_outstanding, others_outstanding])
-                else:
-                    # D+1 and D+2: outstanding = not packed/shipped (excluding cancelled)
-                    outstanding_df = df_day[
-                        (~df_day['Order Status'].isin(['Packed', 'Shipped', 'Cancelled']))
-                    ]
-                
-                outstanding_gis = outstanding_df['GINo'].unique().tolist() if not outstanding_df.empty else []
+                outstanding_gis = panels['outstanding_gis']
                 outstanding_text = "\n".join(map(str, outstanding_gis))  # Each GI on new line
                 
-                # Expandable copy section for outstanding orders - KEY CHANGE: Added data_hash to key
+                # Expandable copy section for outstanding orders - key changes only with its content
                 with st.expander(f"⏳ Outstanding Orders ({len(outstanding_gis)})", expanded=True):
                     col_label, col_copy = st.columns([4, 1])
                     with col_label:
@@ -820,14 +829,14 @@ with tab1:
                         "GI Numbers:",
                         value=outstanding_text if outstanding_text else "No outstanding orders",
                         height=100,
-                        key=f"{i}_outstanding_copy_text_{data_hash}",
+                        key=f"{i}_outstanding_copy_text_{fingerprint(outstanding_text)}",
                         label_visibility="collapsed"
                     )
 
 
             # --- MIDDLE ROW: Order Status Table ---
             st.markdown("<h5 style='margin-top:12px; margin-bottom:8px;'>📋 Order Status Table</h5>", unsafe_allow_html=True)
-            order_status_matrix(df_day, key_prefix=f"day{i}")
+            order_status_matrix(panels, key_prefix=f"day{i}")
 
 
         # vertical divider between dates
@@ -840,16 +849,31 @@ with tab1:
 
         col_index += 2
 
+lap("render_daily")
+
 with tab2:
     # ---------- ANALYTICS TAB ----------
+    # One window aggregate feeds all three charts: the last 14 days come from the
+    # current file, longer windows from the local history of daily rollups
+    window_days = st.selectbox("Window", HISTORY_WINDOWS, format_func=lambda d: f"Past {d} days",
+                               key="analytics_window")
+    with span("window", days=window_days):
+        if window_days == WINDOW_DAYS:
+            window = aggregates.window(today)
+        else:
+            window = WindowAggregate(load_window(zones, today, window_days))
     col1, col2 = st.columns(2)
     with col1:
-        st.markdown("### 📊 Order Lines (Past 14 Days)")
-        order_volume_summary(df, key_prefix="overall")
-        expiry_date_summary(df, key_prefix="overall")
+        st.markdown(f"### 📊 Order Lines (Past {window_days} Days)")
+        order_volume_summary(window, key_prefix="overall")
+        expiry_date_summary(window, key_prefix="overall")
     with col2:
         st.markdown("### 📈 Performance Metrics")
-        performance_metrics(df, key_prefix="overall")
+        performance_metrics(window, key_prefix="overall")
+
+lap("render_analytics")
+end_trace(trace)
+timing_panel(st.sidebar, trace, refresher.last_load_trace)
 
 
 
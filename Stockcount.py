@@ -1,6 +1,5 @@
+import html
 from datetime import datetime, timezone
-import io
-import re
 import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
@@ -8,9 +7,21 @@ from google.cloud import storage
 from google.oauth2 import service_account
 from streamlit_autorefresh import st_autorefresh
 import streamlit.components.v1 as components
+from gcs_store import (
+    SnapshotRefresher, active_sessions, blob_entry, entry_updated, load_sessions, read_manifest, read_snapshot,
+    session_name, snapshot_status
+)
+from ingest import COUNT_SCHEMA, apply_schema, detect_format, normalise_count_frame, read_workbook
+from render_cache import cached
+from history import load_count_progress, record_count_progress
+from stocktake import (
+    CountAggregates, LocationRollup, icc_progress, merge_sessions, parse_locations, split_sessions
+)
+from timing import begin_trace, end_trace, lap, span, timing_panel
 
 # ---------- CONFIG ----------
 st.set_page_config(layout="wide", page_title="Stock Count Dashboard", page_icon="📊")
+trace = begin_trace("stockcount")
 
 # ---------- AUTO REFRESH ----------
 refresh_count = st_autorefresh(interval=60 * 1000, limit=None, key="data_refresh")
@@ -24,99 +35,57 @@ gcs_client = storage.Client(credentials=credentials, project=st.secrets["gcp_ser
 bucket = gcs_client.bucket(BUCKET_NAME)
 
 
-# ---------- DOWNLOAD WITH VALIDATION ----------
-def download_latest_excel(bucket):
-    try:
-        blobs = list(bucket.list_blobs())
-    except Exception as e:
-        st.sidebar.error(f"❌ Could not list GCS bucket: {e}")
-        return None, None
-
-    count_blobs = [
-        b for b in blobs
-        if 'count' in b.name.lower() and b.name.lower().endswith(('.xlsx', '.xls'))
-    ]
-
-    if not count_blobs:
-        return None, None
-
-    # Skip blobs updated in the last 15 seconds (may still be uploading)
-    now_utc = datetime.now(timezone.utc)
-    stable_blobs = [
-        b for b in count_blobs
-        if (now_utc - b.updated).total_seconds() > 15
-    ]
-
-    candidate_blobs = stable_blobs if stable_blobs else count_blobs
-    latest_blob = max(candidate_blobs, key=lambda b: b.updated)
-
-    try:
-        file_bytes = latest_blob.download_as_bytes()
-    except Exception as e:
-        st.sidebar.error(f"❌ Failed to download '{latest_blob.name}': {e}")
-        return None, None
-
-    if len(file_bytes) < 200:
-        st.sidebar.error(
-            f"❌ File '{latest_blob.name}' is too small "
-            f"({len(file_bytes)} bytes) — may be empty or corrupt."
-        )
-        return None, None
-
-    return io.BytesIO(file_bytes), latest_blob.name
-
-
-# ---------- SPREADSHEETML PARSER (XML-based .xls) ----------
-def parse_spreadsheetml(raw_bytes):
+# ---------- FIND ACTIVE COUNT FILES ----------
+def find_count_sessions(bucket):
     """
-    Parse Excel XML / SpreadsheetML format .xls files.
-    Handles broken xmlns URIs with embedded whitespace/newlines —
-    common in files exported from ERP/WMS systems.
+    Return the active Count sessions (one per site counting at the same time)
+    as a manifest entry whose "sessions" maps each session to its latest file.
+    Reads the small manifest published by Upload.py and only lists the bucket
+    if it is missing. Files are downloaded later, and only when their generation changes.
+    Runs on the background refresher thread, so problems are raised, not rendered.
     """
-    from lxml import etree
-
-    content = raw_bytes.decode('utf-8', errors='replace')
-
-    # Strip anything before <Workbook
-    content = re.sub(r'^.*?(<Workbook)', r'\1', content, flags=re.DOTALL)
-
-    # Generic fix: remove whitespace inside ANY xmlns="..." URI
-    content = re.sub(r'(xmlns:\w+="[^"]*?)\s+([^"]*?")', r'\1\2', content)
-
-    # Escape bare ampersands
-    content = re.sub(r'&(?!amp;|lt;|gt;|quot;|apos;|#)', '&amp;', content)
-
-    try:
-        tree = etree.fromstring(content.encode('utf-8'))
-    except etree.XMLSyntaxError as e:
-        raise ValueError(f"Failed to parse SpreadsheetML XML: {e}")
-
-    ns = 'urn:schemas-microsoft-com:office:spreadsheet'
-    rows = tree.findall(f'.//{{{ns}}}Row')
-
-    if not rows:
-        raise ValueError("No rows found in SpreadsheetML file.")
-
-    data = []
-    for row in rows:
-        cells = row.findall(f'.//{{{ns}}}Data')
-        data.append([c.text if c.text else '' for c in cells])
-
-    if not data:
-        raise ValueError("Parsed rows but found no cell data.")
-
-    df = pd.DataFrame(data[1:], columns=data[0])
-    return df
+    manifest = read_manifest(bucket, 'count')
 
+    if manifest is None:
+        try:
+            with span("list_blobs") as s:
+                blobs = list(bucket.list_blobs())
+                s["blobs"] = len(blobs)
+        except Exception as e:
+            raise RuntimeError(f"Could not list GCS bucket: {e}")
+
+        count_blobs = [
+            b for b in blobs
+            if 'count' in b.name.lower() and b.name.lower().endswith(('.xlsx', '.xls'))
+        ]
+
+        if not count_blobs:
+            return None
+
+        # Skip blobs updated in the last 15 seconds (may still be uploading)
+        now_utc = datetime.now(timezone.utc)
+        stable_blobs = [
+            b for b in count_blobs
+            if (now_utc - b.updated).total_seconds() > 15
+        ]
+
+        # Newest file of each session
+        newest = {}
+        for b in sorted(stable_blobs if stable_blobs else count_blobs, key=lambda b: b.updated):
+            newest[session_name(b.name)] = blob_entry(b)
+        manifest = {**max(newest.values(), key=entry_updated), "sessions": newest}
+
+    sessions = active_sessions(manifest)
+    usable = {name: e for name, e in sessions.items() if (e['size'] or 0) >= 200}
+    if not usable:
+        latest = max(sessions.values(), key=entry_updated)
+        raise ValueError(
+            f"File '{latest['blob_name']}' is too small "
+            f"({latest['size'] or 0} bytes) — may be empty or corrupt."
+        )
 
-# ---------- FETCH LATEST FILE ----------
-file_stream, file_name = download_latest_excel(bucket)
-if file_stream is None:
-    st.sidebar.error("❌ No valid Count Excel files found in GCS bucket.")
-    st.stop()
+    return {**manifest, "sessions": usable}
 
-st.sidebar.success(f"📥 Using latest file: {file_name}")
-st.sidebar.info(f"🔄 Last refresh: {datetime.now().strftime('%H:%M:%S')}")
 
 # ---------- GLOBAL STYLE ----------
 st.markdown("""
@@ -217,88 +186,230 @@ components.html("""
 
 
 # ---------- LOAD DATA WITH FULL FORMAT SUPPORT ----------
-@st.cache_data(ttl=60)
-def load_data(_file_bytes, fname):
-    raw_bytes = _file_bytes
-    buf = io.BytesIO(raw_bytes)
-
-    # Detect file format from magic bytes
-    is_xlsx = raw_bytes[:4] == b'PK\x03\x04'
-    is_biff  = raw_bytes[:8] == b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
-    is_xml   = (
-        b'<Workbook' in raw_bytes[:500]
-        or b'spreadsheet' in raw_bytes[:500].lower()
-    )
+def load_data(raw_bytes, fname):
+    # Format is detected from magic bytes: xlsx, BIFF .xls or SpreadsheetML .xls
+    with span("detect_format") as s:
+        s["format"] = detect_format(raw_bytes, fname)
+    try:
+        with span("parse") as s:
+            df = read_workbook(raw_bytes, fname)
+            s["rows"] = len(df)
+    except Exception as e:
+        raise ValueError(
+            f"Could not read '{fname}'. The file may be corrupt or unsupported. "
+            f"Last error: {e}"
+        )
 
-    df = None
-    last_error = None
+    with span("normalise"):
+        return normalise_count_frame(df)
 
-    if is_xlsx or fname.lower().endswith('.xlsx'):
-        try:
-            df = pd.read_excel(buf, engine='openpyxl')
-        except Exception as e:
-            last_error = e
 
-    elif is_biff:
-        try:
-            df = pd.read_excel(buf, engine='xlrd')
-        except Exception as e:
-            last_error = e
+def read_entry(entry):
+    # Prefer the Parquet snapshot written by Upload.py; fall back to the Excel file.
+    snapshot = entry.get('snapshot')
+    if snapshot:
+        df = read_snapshot(bucket, snapshot['blob_name'], snapshot['generation'])
+        if df is not None:
+            return apply_schema(df, COUNT_SCHEMA)
+    try:
+        with span("download") as s:
+            file_bytes = bucket.blob(entry['blob_name'], generation=entry['generation']).download_as_bytes()
+            s["bytes"] = len(file_bytes)
+    except Exception as e:
+        raise RuntimeError(f"Failed to download '{entry['blob_name']}': {e}")
+    return apply_schema(load_data(file_bytes, entry['blob_name']), COUNT_SCHEMA)
 
-    elif is_xml:
-        try:
-            df = parse_spreadsheetml(raw_bytes)
-        except Exception as e:
-            last_error = e
 
-    else:
-        # Last-resort: try all engines
-        for engine in ['openpyxl', 'xlrd']:
-            buf.seek(0)
-            try:
-                df = pd.read_excel(buf, engine=engine)
-                break
-            except Exception as e:
-                last_error = e
-
-    if df is None:
-        raise ValueError(
-            f"Could not read '{fname}'. The file may be corrupt or unsupported. "
-            f"Last error: {last_error}"
-        )
+def load_entry(entry):
+    # Runs on the background refresher thread, only when GCS reports a new generation.
+    # Location is split into Zone/Aisle/Bay/Level once here rather than on every rerun.
+    df = parse_locations(read_entry(entry))
+    # Append this file's per-ICC counters so count rates and ETAs build up over time
+    with span("history") as s:
+        s["rows"] = record_count_progress(icc_progress(df), entry)
+    return df
 
-    df.columns = df.columns.str.strip()
-    df.dropna(axis=1, how="all", inplace=True)
-    df.dropna(how="all", inplace=True)
 
-    # OnHand and Variance: blanks treated as 0
-    for col in ['OnHand', 'Variance']:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+ALL_SESSIONS = "All sessions"
 
-    # Count: preserve NaN to distinguish blank (not counted) from 0 (counted as zero)
-    if 'Count' in df.columns:
-        df['Count'] = pd.to_numeric(df['Count'], errors='coerce')
 
-    if 'Lot1' in df.columns:
-        df['ExpiryDate'] = pd.to_datetime(df['Lot1'], errors='coerce')
+@st.cache_resource
+def get_refresher():
+    # One background poller per server process, shared by every wallboard session
+    loaded = {}  # session -> (entry key, frame) of the last load; unchanged sessions are not reloaded
 
-    # Counted: blank Count = not yet counted, any number including 0 = counted
-    df['Counted'] = df['Count'].notna()
+    def load_all(manifest):
+        # Changed sessions are downloaded and parsed concurrently, then merged with a Session column
+        frames = load_sessions(manifest['sessions'], load_entry, loaded)
+        loaded.clear()
+        loaded.update(frames)
+        with span("merge_sessions") as s:
+            s["sessions"] = len(frames)
+            return merge_sessions({name: frame for name, (_, frame) in frames.items()})
 
-    return df
+    def derive(frame, previous):
+        # Aggregates for all sessions and for each one, built once per snapshot
+        # so the site selector switches instantly
+        frames = split_sessions(frame)
+        views = {ALL_SESSIONS: frame, **(frames if len(frames) > 1 else {})}
+        # load_entry has already recorded this file's samples, so the rates include it
+        return {name: CountAggregates(view, load_count_progress) for name, view in views.items()}
+
+    return SnapshotRefresher(lambda: find_count_sessions(bucket), load_all, derive=derive, name="stockcount")
+
+
+# ---------- ICC PROGRESS TABLE ----------
+ICC_PAGE_SIZE = 50  # ICC numbers per page of the progress table
+
+ICC_TABLE_STYLE = """
+<style>
+    body { margin: 0; font-family: 'Segoe UI', sans-serif; }
+    table { border-collapse: collapse; width: 100%; }
+    tbody tr:hover { background-color: #f9fafb !important; }
+    td { vertical-align: middle; }
+</style>
+"""
+
+
+def icc_table_html(summary):
+    # Whole columns of markup are built with vectorised string operations, then joined once
+    pct = summary['Completion_%']
+    done = pct == 100
+    half = pct >= 50
+    bar_color = pd.Series('#ef4444', index=pct.index).mask(half, '#f97316').mask(done, '#22c55e')
+    row_bg = pd.Series('white', index=pct.index).mask(done, '#f0fdf4')
+    status_icon = pd.Series('🔴', index=pct.index).mask(half, '🟡').mask(done, '✅')
+
+    def thousands(col):
+        return summary[col].astype(int).map('{:,}'.format)
+
+    rows = (
+        '<tr style="background-color:' + row_bg + '; border-bottom: 1px solid #e5e7eb;">'
+        + '<td style="padding:8px 10px; font-weight:600; font-size:12px;">' + status_icon + ' ' + summary['Number'].astype(str) + '</td>'
+        + '<td style="padding:8px 10px; text-align:center; font-size:12px;">' + thousands('Total') + '</td>'
+        + '<td style="padding:8px 10px; text-align:center; font-size:12px; color:#16a34a; font-weight:600;">' + thousands('Counted') + '</td>'
+        + '<td style="padding:8px 10px; text-align:center; font-size:12px; color:#dc2626; font-weight:600;">' + thousands('Remaining') + '</td>'
+        + '<td style="padding:8px 20px; min-width:160px;">'
+        + '<div style="background:#e5e7eb; border-radius:4px; height:14px; width:100%;">'
+        + '<div style="background:' + bar_color + '; width:' + pct.astype(str) + '%; height:14px; border-radius:4px;"></div></div>'
+        + '<div style="font-size:11px; color:#6b7280; margin-top:2px;">' + pct.map('{:.1f}'.format) + '%</div>'
+        + '</td></tr>'
+    )
+    return f"{ICC_TABLE_STYLE}<table><tbody>{''.join(rows.tolist())}</tbody></table>"
+
+
+# ---------- VARIANCE GRID ----------
+VAR_PAGE_SIZE = 100  # variance lines per page of the grid
+
+VAR_DISPLAY_COLUMNS = ['Number', 'LineID', 'SKUCode', 'Description', 'Location', 'OnHand', 'Count', 'Variance',
+                       'ExpiryDate', 'Remarks']
+# Formats for numeric columns; missing values render blank
+VAR_FORMATS = {'OnHand': '{:,.0f}', 'Count': '{:,.0f}', 'Variance': '{:+,.0f}'}
+
+VAR_GRID_STYLE = """
+<style>
+    body { margin: 0; font-family: 'Segoe UI', sans-serif; }
+    table { border-collapse: collapse; width: 100%; font-family: 'Segoe UI', sans-serif; }
+    th { background-color: #f3f4f6; font-weight: 600; font-size: 12px; padding: 6px 10px; border: 1px solid #d1d5db; }
+    td { font-size: 12px; padding: 5px 10px; border: 1px solid #e5e7eb; }
+    td.gain { background-color: #dcfce7; }
+    td.loss { background-color: #fee2e2; }
+</style>
+"""
+
+
+# Variance Type choice -> VarianceIndex sign
+VAR_TYPES = {"All": None, "Gain (+)": 'gain', "Loss (−)": 'loss'}
 
 
-# ---------- READ & PARSE ----------
-file_stream.seek(0)
-raw_bytes = file_stream.read()
+def reset_var_page():
+    st.session_state['var_page'] = 1
 
-try:
-    df = load_data(raw_bytes, file_name)
-except ValueError as e:
-    st.error(f"❌ Failed to load Excel file: {e}")
+
+def _grid_text(series, column):
+    if column in VAR_FORMATS:
+        text = series.astype(float).map(VAR_FORMATS[column].format, na_action='ignore')
+    elif column == 'ExpiryDate' and pd.api.types.is_datetime64_any_dtype(series):
+        text = series.dt.strftime('%d-%b-%Y')
+    else:
+        text = series.astype(object).where(series.notna()).map(str, na_action='ignore').map(html.escape, na_action='ignore')
+    return text.fillna('').astype(object)
+
+
+def variance_grid_html(page):
+    columns = [c for c in VAR_DISPLAY_COLUMNS if c in page.columns]
+    header = "".join(f"<th>{c}</th>" for c in columns)
+    cells = pd.Series('', index=page.index, dtype=object)
+    for col in columns:
+        td = '<td class="' + page['VarClass'].astype(object) + '">' if col == 'Variance' else '<td>'
+        cells = cells + td + _grid_text(page[col], col) + '</td>'
+    rows = '<tr>' + cells + '</tr>'
+    return f"{VAR_GRID_STYLE}<table><thead><tr>{header}</tr></thead><tbody>{''.join(rows.tolist())}</tbody></table>"
+
+
+# ---------- LOCATION DRILL-DOWN ----------
+PROGRESS_COLUMNS = {'Lines': "Lines", 'Counted': "Counted", 'Remaining': "Remaining", 'Completion_%': "Completion %"}
+VARIANCE_COLUMNS = {'VarianceLines': "Variance Lines", 'Gain': "Gain (Qty)", 'Loss': "Loss (Qty)", 'Net': "Net (Qty)"}
+
+
+def location_drilldown(rollup, key, columns):
+    # Zone -> Aisle selectors; the table lists the next level down of the deepest choice
+    path = []
+    selectors = st.columns(len(LocationRollup.DRILL_LEVELS) - 1)
+    for level, col in zip(LocationRollup.DRILL_LEVELS, selectors):
+        choice = col.selectbox(level, ["All"] + rollup.children(path).index.tolist(), key=f"{key}_{level.lower()}")
+        if choice == "All":
+            break
+        path.append(choice)
+    table = rollup.children(path)[list(columns)].rename(columns=columns)
+    st.dataframe(table.reset_index(), hide_index=True, use_container_width=True, height=280)
+
+
+# ---------- FETCH LATEST SNAPSHOT ----------
+refresher = get_refresher()
+snapshot = refresher.current()
+if snapshot is None:
+    if refresher.last_error:
+        st.error(f"❌ Failed to load Excel file: {refresher.last_error}")
+    else:
+        st.sidebar.error("❌ No valid Count Excel files found in GCS bucket.")
+    # Early exits are timed too, so p50/p95 cover every rerun
+    end_trace(trace)
+    timing_panel(st.sidebar, trace, refresher.last_load_trace)
     st.stop()
 
+sessions = snapshot.entry['sessions']
+if len(sessions) == 1:
+    st.sidebar.success(f"📥 Using latest file: {snapshot.entry['blob_name']}")
+else:
+    st.sidebar.success(
+        f"📥 Tracking {len(sessions)} count sessions:\n\n"
+        + "\n".join(f"- **{name}**: {entry['blob_name']}" for name, entry in sorted(sessions.items()))
+    )
+st.sidebar.info(f"🔄 Last refresh: {datetime.now().strftime('%H:%M:%S')}")
+st.sidebar.caption(snapshot_status(refresher))
+if refresher.last_error:
+    st.sidebar.warning(f"⚠️ Background refresh failed, showing last good data: {refresher.last_error}")
+
+# ---------- SESSION SELECTOR ----------
+session_options = list(snapshot.aggregates)
+if st.session_state.get('count_session') not in session_options:
+    st.session_state['count_session'] = ALL_SESSIONS  # the session finished or was renamed
+if len(session_options) > 1:
+    sel_session = st.sidebar.selectbox("📍 Count Session", session_options, key='count_session')
+else:
+    sel_session = ALL_SESSIONS
+view = snapshot.aggregates[sel_session]
+
+# Shared, in-memory frame: filter into new frames, never modify in place
+df = view.frame
+# Everything derived from df is cached per (snapshot, session)
+view_key = (snapshot.key, sel_session)
+lap("fetch")
+
+# Totals for every zone, aisle and bay, built once per snapshot and session
+location_rollup = view.location_rollup
+
 # ---------- OVERALL COMPLETION METRICS ----------
 total_lines = len(df)
 total_counted = int(df['Counted'].sum())
@@ -335,45 +446,37 @@ with tab1:
 
     with col_donut:
         st.markdown("#### 📊 Overall Completion")
-        fig_overall = go.Figure(go.Pie(
-            values=[overall_pct, 100 - overall_pct],
-            labels=["Counted", "Remaining"],
-            marker_colors=['#22c55e', '#e5e7eb'],
-            hole=0.65,
-            textinfo='none',
-            sort=False
-        ))
-        fig_overall.update_layout(
-            height=280,
-            margin=dict(l=10, r=10, t=10, b=10),
-            showlegend=True,
-            legend=dict(orientation="h", yanchor="bottom", y=-0.15, xanchor="center", x=0.5),
-            annotations=[
-                dict(text=f"{overall_pct:.1f}%", x=0.5, y=0.58, font_size=26, showarrow=False, font_color="#111", font=dict(weight='bold')),
-                dict(text=f"{total_counted}/{total_lines}", x=0.5, y=0.4, font_size=13, showarrow=False, font_color="#6b7280")
-            ]
-        )
+        def build_donut():
+            fig_overall = go.Figure(go.Pie(
+                values=[overall_pct, 100 - overall_pct],
+                labels=["Counted", "Remaining"],
+                marker_colors=['#22c55e', '#e5e7eb'],
+                hole=0.65,
+                textinfo='none',
+                sort=False
+            ))
+            fig_overall.update_layout(
+                height=280,
+                margin=dict(l=10, r=10, t=10, b=10),
+                showlegend=True,
+                legend=dict(orientation="h", yanchor="bottom", y=-0.15, xanchor="center", x=0.5),
+                annotations=[
+                    dict(text=f"{overall_pct:.1f}%", x=0.5, y=0.58, font_size=26, showarrow=False, font_color="#111", font=dict(weight='bold')),
+                    dict(text=f"{total_counted}/{total_lines}", x=0.5, y=0.4, font_size=13, showarrow=False, font_color="#6b7280")
+                ]
+            )
+            return fig_overall
+
+        fig_overall = cached("overall_donut", (overall_pct, total_counted, total_lines), build_donut)
         st.plotly_chart(fig_overall, use_container_width=True, key="overall_donut")
 
     with col_table:
         st.markdown("#### 📋 Progress by ICC Number")
 
-        icc_summary = df.groupby('Number').agg(
-            Total=('Counted', 'count'),
-            Counted=('Counted', 'sum'),
-        ).reset_index()
-        icc_summary['Remaining'] = icc_summary['Total'] - icc_summary['Counted']
-        icc_summary['Completion_%'] = (icc_summary['Counted'] / icc_summary['Total'] * 100).round(1)
-
         if 'icc_sort_col' not in st.session_state:
             st.session_state['icc_sort_col'] = 'Number'
             st.session_state['icc_sort_asc'] = True
 
-        icc_summary = icc_summary.sort_values(
-            by=st.session_state['icc_sort_col'],
-            ascending=st.session_state['icc_sort_asc']
-        ).reset_index(drop=True)
-
         def sort_arrow(col_key):
             if st.session_state['icc_sort_col'] == col_key:
                 return ' ▲' if st.session_state['icc_sort_asc'] else ' ▼'
@@ -388,6 +491,7 @@ with tab1:
                 else:
                     st.session_state['icc_sort_col'] = col_key
                     st.session_state['icc_sort_asc'] = True
+                st.session_state['icc_page'] = 1
 
         make_sort_button(h0, "ICC Number",   "Number")
         make_sort_button(h1, "Total",        "Total")
@@ -395,41 +499,80 @@ with tab1:
         make_sort_button(h3, "Remaining",    "Remaining")
         make_sort_button(h4, "Completion %", "Completion_%")
 
-        rows_html = ""
-        for _, row in icc_summary.iterrows():
-            pct = row['Completion_%']
-            bar_color = '#22c55e' if pct == 100 else ('#f97316' if pct >= 50 else '#ef4444')
-            row_bg = '#f0fdf4' if pct == 100 else 'white'
-
-            bar_html = f"""
-                <div style="background:#e5e7eb; border-radius:4px; height:14px; width:100%;">
-                    <div style="background:{bar_color}; width:{pct}%; height:14px; border-radius:4px;"></div>
-                </div>
-                <div style="font-size:11px; color:#6b7280; margin-top:2px;">{pct:.1f}%</div>
-            """
-            status_icon = "✅" if pct == 100 else ("🟡" if pct >= 50 else "🔴")
-
-            rows_html += f"""
-                <tr style="background-color:{row_bg}; border-bottom: 1px solid #e5e7eb;">
-                    <td style="padding:8px 10px; font-weight:600; font-size:12px;">{status_icon} {row['Number']}</td>
-                    <td style="padding:8px 10px; text-align:center; font-size:12px;">{int(row['Total']):,}</td>
-                    <td style="padding:8px 10px; text-align:center; font-size:12px; color:#16a34a; font-weight:600;">{int(row['Counted']):,}</td>
-                    <td style="padding:8px 10px; text-align:center; font-size:12px; color:#dc2626; font-weight:600;">{int(row['Remaining']):,}</td>
-                    <td style="padding:8px 20px; min-width:160px;">{bar_html}</td>
-                </tr>
-            """
-
-        table_html = f"""
-        <style>
-            body {{ margin: 0; font-family: 'Segoe UI', sans-serif; }}
-            table {{ border-collapse: collapse; width: 100%; }}
-            tbody tr:hover {{ background-color: #f9fafb !important; }}
-            td {{ vertical-align: middle; }}
-        </style>
-        <table><tbody>{rows_html}</tbody></table>
-        """
+        # The summary is built once per snapshot; sort orders and page HTML are cached and shared by every session
+        sort_col, sort_asc = st.session_state['icc_sort_col'], st.session_state['icc_sort_asc']
+        icc_summary = cached(
+            "icc_sorted", (view_key, sort_col, sort_asc),
+            lambda: view.icc_summary.sort_values(by=sort_col, ascending=sort_asc).reset_index(drop=True)
+        )
+
+        pages = max(1, -(-len(icc_summary) // ICC_PAGE_SIZE))
+        if st.session_state.get('icc_page', 1) > pages:
+            st.session_state['icc_page'] = pages
+        page = st.session_state.get('icc_page', 1)
+        start = (page - 1) * ICC_PAGE_SIZE
+
+        table_html = cached(
+            "icc_table", (view_key, sort_col, sort_asc, page),
+            lambda: icc_table_html(icc_summary.iloc[start:start + ICC_PAGE_SIZE])
+        )
         components.html(table_html, height=500, scrolling=True)
 
+        if pages > 1:
+            p1, p2 = st.columns([1, 3])
+            with p1:
+                st.number_input("Page", min_value=1, max_value=pages, step=1, key="icc_page")
+            with p2:
+                st.caption(f"ICC numbers {start + 1:,}–{min(start + ICC_PAGE_SIZE, len(icc_summary)):,} of {len(icc_summary):,}")
+
+    # ---------- COUNT RATE & ETA ----------
+    st.markdown("<div style='height:16px'></div>", unsafe_allow_html=True)
+    col_trend, col_rates = st.columns([1, 2])
+
+    # Samples, rates and the trend only change with a new count file, so they are built with the snapshot
+    rates, trend = view.rates, view.trend
+
+    with col_trend:
+        st.markdown("#### 📈 Progress Over Time")
+        if len(trend) < 2:
+            st.info("Progress over time appears once a second count file has been uploaded.")
+        else:
+            def build_trend():
+                fig_trend = go.Figure(go.Scatter(
+                    x=trend.index, y=trend.values, mode='lines+markers',
+                    line=dict(color='#22c55e', width=3)
+                ))
+                fig_trend.update_layout(
+                    height=280,
+                    margin=dict(l=10, r=10, t=10, b=10),
+                    yaxis=dict(title="% Counted", range=[0, 100], gridcolor='#f0f0f0'),
+                    plot_bgcolor='white'
+                )
+                return fig_trend
+
+            fig_trend = cached("progress_trend", view_key, build_trend)
+            st.plotly_chart(fig_trend, use_container_width=True, key="progress_trend")
+
+    with col_rates:
+        st.markdown("#### ⏱️ Count Rate & ETA")
+        st.dataframe(
+            rates,
+            hide_index=True,
+            use_container_width=True,
+            height=280,
+            column_config={
+                'Number': "ICC Number",
+                'Counted': st.column_config.NumberColumn("Counted", format="%d"),
+                'Remaining': st.column_config.NumberColumn("Remaining", format="%d"),
+                'Lines/hr': st.column_config.NumberColumn("Lines / hr", format="%.1f"),
+                'ETA': st.column_config.DatetimeColumn("Projected Finish", format="DD MMM HH:mm"),
+            },
+        )
+
+    st.markdown("#### 📍 Progress by Location")
+    location_drilldown(location_rollup, "progress_location", PROGRESS_COLUMNS)
+
+lap("render_progress")
 
 # ===================== TAB 2: VARIANCE DETAILS =====================
 with tab2:
@@ -445,107 +588,93 @@ with tab2:
 
     st.markdown("<div style='height:16px'></div>", unsafe_allow_html=True)
 
-    col_chart, col_space = st.columns([1.5, 2])
+    col_chart, col_location = st.columns([1.5, 2])
     with col_chart:
         st.markdown("#### ⚠️ Variance Breakdown")
-        fig_var = go.Figure(go.Bar(
-            x=["Gain (+)", "Loss (−)"],
-            y=[variance_lines_pos, variance_lines_neg],
-            marker_color=['#3b82f6', '#ef4444'],
-            text=[variance_lines_pos, variance_lines_neg],
-            textposition='outside'
-        ))
-        fig_var.update_layout(
-            height=240,
-            margin=dict(l=10, r=10, t=10, b=10),
-            yaxis_title="No. of Lines",
-            showlegend=False,
-            plot_bgcolor='white',
-            yaxis=dict(gridcolor='#f0f0f0')
-        )
+        def build_var_bar():
+            fig_var = go.Figure(go.Bar(
+                x=["Gain (+)", "Loss (−)"],
+                y=[variance_lines_pos, variance_lines_neg],
+                marker_color=['#3b82f6', '#ef4444'],
+                text=[variance_lines_pos, variance_lines_neg],
+                textposition='outside'
+            ))
+            fig_var.update_layout(
+                height=240,
+                margin=dict(l=10, r=10, t=10, b=10),
+                yaxis_title="No. of Lines",
+                showlegend=False,
+                plot_bgcolor='white',
+                yaxis=dict(gridcolor='#f0f0f0')
+            )
+            return fig_var
+
+        fig_var = cached("variance_bar", (variance_lines_pos, variance_lines_neg), build_var_bar)
         st.plotly_chart(fig_var, use_container_width=True, key="var_bar")
 
+    with col_location:
+        st.markdown("#### 📍 Variance by Location")
+        location_drilldown(location_rollup, "variance_location", VARIANCE_COLUMNS)
+
     st.markdown("<div style='height:8px'></div>", unsafe_allow_html=True)
     st.markdown("#### 📋 Variance Issue Summary")
 
-    df_var = df[df['Variance'] != 0].copy()
+    # Variance lines, filter positions, option lists and partial sums are built once per snapshot
+    var_index = view.variance_index
+    df_var = var_index.lines
 
     if df_var.empty:
         st.success("🎉 No variance lines found! All counts match system quantities.")
     else:
-        df_var['Zone'] = df_var['Location'].astype(str).str[:1]
-
         f1, f2, f3 = st.columns(3)
         with f1:
-            var_type = st.selectbox("Variance Type", ["All", "Gain (+)", "Loss (−)"])
+            var_type = st.selectbox("Variance Type", list(VAR_TYPES), on_change=reset_var_page)
         with f2:
-            count_nums = ["All"] + sorted(df_var['Number'].unique().tolist())
-            sel_count = st.selectbox("Count Number", count_nums)
+            sel_count = st.selectbox("Count Number", ["All"] + var_index.count_numbers, on_change=reset_var_page)
         with f3:
-            zones_avail = ["All"] + sorted(df_var['Zone'].unique().tolist())
-            sel_zone = st.selectbox("Zone", zones_avail)
-
-        filtered = df_var.copy()
-        if var_type == "Gain (+)":
-            filtered = filtered[filtered['Variance'] > 0]
-        elif var_type == "Loss (−)":
-            filtered = filtered[filtered['Variance'] < 0]
-        if sel_count != "All":
-            filtered = filtered[filtered['Number'] == sel_count]
-        if sel_zone != "All":
-            filtered = filtered[filtered['Zone'] == sel_zone]
-
-        display_cols = ['Number', 'LineID', 'SKUCode', 'Description', 'Location', 'OnHand', 'Count', 'Variance']
-        if 'ExpiryDate' in filtered.columns:
-            display_cols.append('ExpiryDate')
-        if 'Remarks' in filtered.columns:
-            display_cols.append('Remarks')
-
-        display_df = filtered[[c for c in display_cols if c in filtered.columns]].copy()
-        display_df['Count'] = display_df['Count'].apply(
-            lambda x: '' if pd.isna(x) else f"{int(x):,}"
-        )
+            sel_zone = st.selectbox("Zone", ["All"] + var_index.zones, on_change=reset_var_page)
 
-        def highlight_var_row(row):
-            color = '#dcfce7' if row['Variance'] > 0 else '#fee2e2'
-            return [f'background-color: {color}' if col == 'Variance' else '' for col in row.index]
-
-        fmt = {'OnHand': '{:,.0f}', 'Variance': '{:+,.0f}'}
-        if 'ExpiryDate' in display_df.columns:
-            fmt['ExpiryDate'] = lambda x: x.strftime('%d-%b-%Y') if pd.notna(x) else ''
-
-        styled_var = display_df.style \
-            .apply(highlight_var_row, axis=1) \
-            .format(fmt) \
-            .set_table_styles([
-                {"selector": "th", "props": [
-                    ("background-color", "#f3f4f6"), ("font-weight", "600"),
-                    ("font-size", "12px"), ("padding", "6px 10px"),
-                    ("border", "1px solid #d1d5db")
-                ]},
-                {"selector": "td", "props": [
-                    ("font-size", "12px"), ("padding", "5px 10px"),
-                    ("border", "1px solid #e5e7eb")
-                ]},
-                {"selector": "table", "props": [
-                    ("border-collapse", "collapse"), ("width", "100%"),
-                    ("font-family", "'Segoe UI', sans-serif")
-                ]}
-            ])
-
-        components.html(
-            f"<style>body{{margin:0;font-family:'Segoe UI',sans-serif;}}</style>{styled_var.to_html()}",
-            height=450,
-            scrolling=True
+        selection = {
+            'sign': VAR_TYPES[var_type],
+            'number': None if sel_count == "All" else sel_count,
+            'zone': None if sel_zone == "All" else sel_zone,
+        }
+        filters = (view_key, var_type, sel_count, sel_zone)
+        filtered = var_index.select(**selection)
+        totals = var_index.totals(**selection)
+
+        # Only the current page is formatted and rendered
+        pages = max(1, -(-len(filtered) // VAR_PAGE_SIZE))
+        if st.session_state.get('var_page', 1) > pages:
+            st.session_state['var_page'] = pages
+        page = st.session_state.get('var_page', 1)
+        start = (page - 1) * VAR_PAGE_SIZE
+
+        grid_html = cached(
+            "variance_grid", filters + (page,),
+            lambda: variance_grid_html(filtered.iloc[start:start + VAR_PAGE_SIZE])
         )
+        components.html(grid_html, height=450, scrolling=True)
+
+        p1, p2 = st.columns([1, 3])
+        with p1:
+            if pages > 1:
+                st.number_input("Page", min_value=1, max_value=pages, step=1, key="var_page")
+        with p2:
+            shown = f"{start + 1:,}–{min(start + VAR_PAGE_SIZE, len(filtered)):,}" if len(filtered) else "0"
+            st.caption(f"Showing lines {shown} of {len(filtered):,} filtered ({len(df_var):,} variance lines in total)")
 
         st.markdown("---")
         s1, s2, s3, s4 = st.columns(4)
         with s1:
-            st.metric("Filtered Lines", len(filtered))
+            st.metric("Filtered Lines", totals['lines'])
         with s2:
-            st.metric("Total Gain (Qty)", f"{int(filtered[filtered['Variance'] > 0]['Variance'].sum()):+,}")
+            st.metric("Total Gain (Qty)", f"{totals['gain']:+,}")
         with s3:
-            st.metric("Total Loss (Qty)", f"{int(filtered[filtered['Variance'] < 0]['Variance'].sum()):+,}")
+            st.metric("Total Loss (Qty)", f"{totals['loss']:+,}")
         with s4:
-            st.metric("Net Variance (Qty)", f"{int(filtered['Variance'].sum()):+,}")
+            st.metric("Net Variance (Qty)", f"{totals['net']:+,}")
+
+lap("render_variance")
+end_trace(trace)
+timing_panel(st.sidebar, trace, refresher.last_load_trace)
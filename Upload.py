@@ -1,10 +1,18 @@
+import hashlib
 import streamlit as st
-import pandas as pd
-import io
-import re
 from google.cloud import storage
 from google.oauth2 import service_account
 import pytz
+from gcs_store import (
+    MANIFEST_KEYWORDS, UploadInterrupted, entry_updated, is_manifest, is_snapshot_of, read_manifest,
+    resumable_upload, session_name, write_manifest, write_partitioned_snapshot, write_snapshot
+)
+from ingest import (
+    GI_HEADER_ROWS, detect_format, normalise_count_frame, normalise_gi_frame, partition_by_zone, read_workbook
+)
+from timing import begin_trace, end_trace, span, timing_panel
+
+trace = begin_trace("upload")
 
 # --- GCP Authentication ---
 credentials = service_account.Credentials.from_service_account_info(
@@ -23,116 +31,54 @@ st.title("📁 Upload Excel Files to Dashboard")
 
 # --- Last Upload Tracker ---
 def get_last_upload_info(bucket):
-    """Get the most recently uploaded Excel file from the bucket."""
-    blobs = [
-        b for b in bucket.list_blobs()
-        if b.name.lower().endswith(('.xlsx', '.xls'))
-    ]
+    """
+    Get the most recently uploaded Excel file from the bucket.
+    Reads the per-dashboard manifests; lists the bucket only if none exist yet.
+    """
+    sg_tz = pytz.timezone('Asia/Singapore')
+    entries = [read_manifest(bucket, keyword) for keyword in MANIFEST_KEYWORDS]
+    entries = [e for e in entries if e and entry_updated(e)]
+    if entries:
+        latest = max(entries, key=entry_updated)
+        return latest['blob_name'], entry_updated(latest).astimezone(sg_tz)
+
+    with span("list_blobs"):
+        blobs = [
+            b for b in bucket.list_blobs()
+            if b.name.lower().endswith(('.xlsx', '.xls'))
+        ]
     if not blobs:
         return None, None
     latest_blob = max(blobs, key=lambda b: b.updated)
-    sg_tz = pytz.timezone('Asia/Singapore')
     upload_time = latest_blob.updated.astimezone(sg_tz)
     return latest_blob.name, upload_time
 
 
-# --- SpreadsheetML Parser (XML-based .xls) ---
-def parse_spreadsheetml(raw_bytes):
-    """Parse Excel XML / SpreadsheetML format files saved with .xls extension."""
-    from lxml import etree
-
-    content = raw_bytes.decode('utf-8', errors='replace')
-
-    # Strip anything before <Workbook
-    content = re.sub(r'^.*?(<Workbook)', r'\1', content, flags=re.DOTALL)
-
-    # Fix broken xmlns URIs that contain newlines or whitespace
-    content = re.sub(
-        r'xmlns:x="urn:schemas-[\s\r\n]+microsoft-com:office:excel"',
-        'xmlns:x="urn:schemas-microsoft-com:office:excel"',
-        content,
-        flags=re.DOTALL
-    )
-
-    # Escape bare ampersands
-    content = re.sub(r'&(?!amp;|lt;|gt;|quot;|apos;|#)', '&amp;', content)
-
-    try:
-        tree = etree.fromstring(content.encode('utf-8'))
-    except etree.XMLSyntaxError as e:
-        raise ValueError(f"Failed to parse SpreadsheetML XML: {e}")
-
-    ns = 'urn:schemas-microsoft-com:office:spreadsheet'
-    rows = tree.findall(f'.//{{{ns}}}Row')
-
-    if not rows:
-        raise ValueError("No rows found in SpreadsheetML file.")
-
-    data = []
-    for row in rows:
-        cells = row.findall(f'.//{{{ns}}}Data')
-        data.append([c.text if c.text else '' for c in cells])
-
-    if not data:
-        raise ValueError("Parsed rows but found no cell data.")
-
-    df = pd.DataFrame(data[1:], columns=data[0])
-    return df
-
-
 # --- Read Excel File (auto-detect format) ---
-def read_excel_file(uploaded_file, original_file_name):
+def read_excel_file(uploaded_file, original_file_name, skiprows=0):
     """
     Detect and read Excel files in any of these formats:
       - .xlsx  (ZIP/OpenXML)      → openpyxl
       - .xls   binary BIFF        → xlrd
       - .xls   SpreadsheetML XML  → lxml parser
+    `skiprows` skips report header rows above the column names.
     """
     raw_bytes = uploaded_file.read()
     uploaded_file.seek(0)
 
-    is_xlsx = raw_bytes[:4] == b'PK\x03\x04'
-    is_biff = raw_bytes[:8] == b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
-    is_xml  = (
-        b'<Workbook' in raw_bytes[:500]
-        or b'spreadsheet' in raw_bytes[:500].lower()
-    )
-
-    if is_xlsx or original_file_name.lower().endswith('.xlsx'):
-        buf = io.BytesIO(raw_bytes)
-        df = pd.read_excel(buf, engine='openpyxl')
+    with span("detect_format") as s:
+        fmt = detect_format(raw_bytes, original_file_name)
+        s["format"] = fmt
+    with span("parse") as s:
+        df = read_workbook(raw_bytes, original_file_name, skiprows=skiprows)
+        s["bytes"] = len(raw_bytes)
+        s["rows"] = len(df)
+    if fmt == 'xlsx':
         content_type = (
             'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
         )
-
-    elif is_biff:
-        buf = io.BytesIO(raw_bytes)
-        df = pd.read_excel(buf, engine='xlrd')
-        content_type = 'application/vnd.ms-excel'
-
-    elif is_xml:
-        df = parse_spreadsheetml(raw_bytes)
-        content_type = 'application/vnd.ms-excel'
-
     else:
-        # Last-resort fallback — try both engines
-        last_error = None
-        df = None
-        for engine in ['openpyxl', 'xlrd']:
-            try:
-                buf = io.BytesIO(raw_bytes)
-                df = pd.read_excel(buf, engine=engine)
-                content_type = 'application/vnd.ms-excel'
-                break
-            except Exception as e:
-                last_error = e
-                continue
-
-        if df is None:
-            raise ValueError(
-                f"Unrecognised file format. Please upload a valid .xls or .xlsx file. "
-                f"Last error: {last_error}"
-            )
+        content_type = 'application/vnd.ms-excel'
 
     return df, content_type
 
@@ -181,7 +127,9 @@ st.header("Upload Excel File (.xls or .xlsx)")
 st.caption(
     "📌 The file will be automatically routed to the correct dashboard based on its name:\n\n"
     "- Files containing **'Count'** → Stock Count Dashboard\n"
-    "- Files containing **'GI'** → Outbound Dashboard"
+    "- Files containing **'GI'** → Outbound Dashboard\n\n"
+    "Stock counts running at the same time (e.g. one per site) are tracked separately by file name; "
+    "dates and times at the end of the name are ignored, so a re-upload replaces its site's file."
 )
 
 uploaded_file = st.file_uploader(
@@ -201,29 +149,101 @@ if uploaded_file is not None:
             f"⚠️ Could not detect dashboard from filename **'{original_file_name}'**.\n\n"
             "Please rename the file to include **'Count'** or **'GI'** and re-upload."
         )
+        # Early exits are timed too, so p50/p95 cover every rerun
+        end_trace(trace)
+        timing_panel(st.sidebar, trace)
         st.stop()
 
     try:
-        df, content_type = read_excel_file(uploaded_file, original_file_name)
+        # GI analysis exports have a report header above the column names
+        skiprows = GI_HEADER_ROWS if cleanup_keyword == 'gi' else 0
+        df, content_type = read_excel_file(uploaded_file, original_file_name, skiprows=skiprows)
 
         st.subheader("📊 Preview of uploaded data:")
         st.dataframe(df.head())
         st.caption(f"Total rows: {len(df):,} | Columns: {len(df.columns)}")
 
         # --- Upload new file to GCS (keep original filename) ---
-        uploaded_file.seek(0)
+        # Chunked and resumable: an interrupted upload continues from its last chunk on the next run.
+        # The session is keyed on the content, so a re-exported file never continues an old upload.
+        upload_key = f"upload_session:{original_file_name}:{hashlib.md5(uploaded_file.getvalue()).hexdigest()}"
         blob = bucket.blob(original_file_name)
-        blob.upload_from_file(uploaded_file, content_type=content_type)
-        st.success(f"✅ Uploaded **'{original_file_name}'** to Google Cloud Storage.")
+        progress_bar = st.progress(0.0, text="⬆️ Uploading...")
+
+        def show_progress(sent, total, seconds):
+            rate = sent / 1024 / 1024 / seconds if seconds > 0 else 0
+            progress_bar.progress(
+                sent / total if total else 1.0,
+                text=f"⬆️ {sent / 1024 / 1024:,.1f} / {total / 1024 / 1024:,.1f} MB · {rate:,.1f} MB/s",
+            )
+
+        def upload(session_url):
+            return resumable_upload(
+                blob, uploaded_file, uploaded_file.size, content_type,
+                session_url=session_url, progress=show_progress,
+            )
+
+        try:
+            with span("gcs_upload") as s:
+                stored_url = st.session_state.get(upload_key)
+                try:
+                    stats = upload(stored_url)
+                except UploadInterrupted:
+                    raise
+                except Exception:
+                    st.session_state.pop(upload_key, None)
+                    if stored_url is None:
+                        raise
+                    # The stored session expired or was rejected; start over with a new one
+                    stats = upload(None)
+                s.update(bytes=blob.size, mb_per_s=stats["mb_per_s"], chunks=stats["chunks"], retries=stats["retries"])
+        except UploadInterrupted as e:
+            st.session_state[upload_key] = e.session_url
+            raise RuntimeError(f"{e}. Re-run the page to resume from {e.offset / 1024 / 1024:,.1f} MB")
+        st.session_state.pop(upload_key, None)
+        st.success(
+            f"✅ Uploaded **'{original_file_name}'** to Google Cloud Storage "
+            f"({stats['mb_per_s'] or 0:,.1f} MB/s, {stats['chunks']} chunk(s), {stats['retries']} retried)."
+        )
+
+        # --- Write Parquet snapshot so dashboards skip Excel parsing ---
+        snapshot = None
+        try:
+            normalise = normalise_gi_frame if cleanup_keyword == 'gi' else normalise_count_frame
+            with span("normalise"):
+                normalised = normalise(df.copy())
+            with span("snapshot") as s:
+                if cleanup_keyword == 'gi':
+                    # One partition per StorageZone; each zone dashboard reads only its own
+                    snapshot = write_partitioned_snapshot(bucket, original_file_name, partition_by_zone(normalised))
+                    s["partitions"] = len(snapshot["partitions"])
+                else:
+                    snapshot = write_snapshot(bucket, original_file_name, normalised)
+                s["bytes"] = snapshot["size"]
+            st.success("✅ Wrote columnar snapshot for the dashboards.")
+        except Exception as e:
+            st.warning(f"⚠️ Could not write snapshot, dashboards will read the Excel file: {e}")
+
+        # --- Publish manifest so dashboards find this file without listing ---
+        session = session_name(original_file_name) if cleanup_keyword == 'count' else None
+        with span("manifest"):
+            manifest = write_manifest(bucket, cleanup_keyword, blob, row_count=len(df), snapshot=snapshot, session=session)
+        if session:
+            st.info(f"📍 Count session: **{session}** ({len(manifest['sessions'])} active)")
 
         # --- Cleanup: only delete old files of the same dashboard type ---
         st.info(f"🧹 Cleaning up old **{dashboard}** files...")
-        blobs = list(bucket.list_blobs())
+        with span("list_blobs"):
+            blobs = list(bucket.list_blobs())
         deleted_count = 0
+        # Files of other active count sessions are still on a dashboard
+        keep = [e['blob_name'] for e in manifest.get('sessions', {}).values()] or [original_file_name]
 
         for b in blobs:
-            if b.name == original_file_name:
-                continue  # never delete the file we just uploaded
+            if any(b.name == name or is_snapshot_of(b.name, name) for name in keep):
+                continue  # never delete the file we just uploaded, a live session's file, or their snapshots
+            if is_manifest(b.name):
+                continue  # manifests point at the latest files
             if cleanup_keyword in b.name.lower():
                 b.delete()
                 deleted_count += 1
@@ -233,7 +253,12 @@ if uploaded_file is not None:
         else:
             st.info("ℹ️ No old files to clean up.")
 
+        end_trace(trace)
         st.rerun()
 
     except Exception as e:
         st.error(f"❌ Failed to read or upload Excel file: {e}")
+
+
+end_trace(trace)
+timing_panel(st.sidebar, trace)
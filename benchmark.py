@@ -0,0 +1,564 @@
+"""
+Benchmark the ingest paths on synthetic GI analysis and stock count files.
+
+    python benchmark.py generate --rows 10000 100000 1000000 --out bench_data
+    python benchmark.py run --data bench_data
+    python benchmark.py check
+
+`generate` writes GI analysis exports (6 report header rows, WMS columns,
+status codes from CONFIG['status_map']) and stock count exports as .xlsx,
+BIFF .xls and SpreadsheetML .xls with the whitespace-in-xmlns and bare '&'
+defects seen in real WMS exports.
+
+`run` times every loader that applies to each file, each in a fresh
+subprocess so peak RSS is measured per run, and reports wall time, peak RSS
+and rows/sec. `memory` compares the frames' memory before and after the
+typed schema in ingest.py. The loaders are the functions the app itself calls:
+  - upload         Upload.py read_excel_file  (ingest.read_workbook)
+  - spreadsheetml  ingest.parse_spreadsheetml (SpreadsheetML files only)
+  - gi_dashboard   App.py / ColdroomDash.py load_data
+  - stockcount     Stockcount.py load_data
+
+`check` runs consistency checks on synthetic data that the dashboards rely
+on but that need no GCS or Streamlit, and exits non-zero if one fails. The
+resumable_upload check drives gcs_store.resumable_upload against a local
+stand-in for the GCS resumable upload endpoint that drops chunks halfway.
+
+BIFF output needs xlwt (pip install xlwt). BIFF8 sheets hold at most 65,536
+rows, so larger BIFF files are skipped.
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from ingest import (
+    COUNT_SCHEMA, GI_HEADER_ROWS, GI_SCHEMA, apply_schema, memory_report, normalise_count_frame,
+    normalise_gi_frame, parse_spreadsheetml, read_gi_workbook, read_workbook
+)
+from gcs_store import CHUNK_ALIGNMENT, UploadInterrupted, resumable_upload, session_name
+from stocktake import VarianceIndex, parse_locations, variance_lines
+
+INDEX_FILE = "index.json"
+CHUNK_ROWS = 50_000
+BIFF_MAX_ROWS = 65_536
+
+# Keys of CONFIG['status_map'] / CONFIG['priority_map'] in the dashboards
+GI_STATUSES = ['10-Open', '15-Processing', '20-Partially Allocated', '25-Fully Allocated',
+               '35-Pick in Progress', '45-Picked', '65-Packed', '75-Shipped', '98-Cancelled']
+GI_STATUS_WEIGHTS = [0.10, 0.04, 0.03, 0.06, 0.07, 0.08, 0.12, 0.46, 0.04]
+GI_PRIORITIES = ['1-Normal', '2-ADHOC Normal', '3-ADHOC Urgent', '4-ADHOC Critical']
+GI_PRIORITY_WEIGHTS = [0.70, 0.15, 0.10, 0.05]
+GI_ZONES = ['Aircon', 'Cold Room', 'Freezer', 'Controlled Drug Room', 'Strong Room', 'Ambient']
+GI_TYPES = ['Goods Issue', 'Back Order', 'Disposal', 'Forward Deploy', 'Return to Vendor']
+AIRCON_ZONES = ['aircon', 'controlled drug room', 'strong room']
+VALID_TYPES = ["Back Order", "Disposal", "Goods Issue", "Forward Deploy"]
+
+GI_EXPORT_COLUMNS = [
+    'GINo', 'LineNo', 'Owner', 'SKUCode', 'Description', 'Lot1', 'ExpectedQTY', 'ShippedQTY',
+    'VarianceQTY', 'Priority', 'Status', 'StorageZone', 'Type', 'ExpDate', 'CreatedOn',
+    'ShippedOn', 'Remarks',
+]
+COUNT_EXPORT_COLUMNS = [
+    'Number', 'LineID', 'Zone', 'Location', 'SKUCode', 'Description', 'Lot1',
+    'OnHand', 'Count', 'Variance', 'Remarks',
+]
+# Bare '&' is left unescaped in SpreadsheetML, as the WMS does
+DESCRIPTIONS = ['Gauze & Swabs 10x10cm', 'Insulin Pen 100U/mL', 'Paracetamol 500mg Tab',
+                'Saline 0.9% 500mL', 'Vaccine (Influenza) 0.5mL', 'Syringe 5mL Luer Lock',
+                'Morphine Sulphate 10mg/mL', 'Gloves Nitrile M']
+
+
+# ---------- SYNTHETIC DATA ----------
+def gi_rows(n, seed=0):
+    """Yield n GI analysis rows; ExpDate spans two weeks back and one week ahead of today."""
+    rng = np.random.default_rng(seed)
+    today = datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
+    gi_no = 5_000_000
+    line_no = 0
+    for start in range(0, n, CHUNK_ROWS):
+        size = min(CHUNK_ROWS, n - start)
+        status = rng.choice(GI_STATUSES, size, p=GI_STATUS_WEIGHTS)
+        priority = rng.choice(GI_PRIORITIES, size, p=GI_PRIORITY_WEIGHTS)
+        zone = rng.choice(GI_ZONES, size)
+        gi_type = rng.choice(GI_TYPES, size, p=[0.70, 0.10, 0.05, 0.10, 0.05])
+        offset = rng.integers(-14, 8, size)
+        expected = rng.integers(1, 500, size)
+        new_gi = rng.random(size) < 0.2  # about five lines per GI
+        sku = rng.integers(100_000, 999_999, size)
+        desc = rng.choice(DESCRIPTIONS, size)
+        for i in range(size):
+            if new_gi[i] or line_no == 0:
+                gi_no += 1
+                line_no = 0
+            line_no += 1
+            exp_date = today + timedelta(days=int(offset[i]))
+            shipped = status[i] == '75-Shipped'
+            shipped_qty = int(expected[i]) if shipped else 0
+            yield [
+                gi_no, line_no, 'SSW', f"SKU{sku[i]}", desc[i],
+                (exp_date + timedelta(days=400)).strftime('%d/%b/%Y'),
+                int(expected[i]), shipped_qty, int(expected[i]) - shipped_qty,
+                priority[i], status[i], zone[i], gi_type[i],
+                exp_date.strftime('%d/%b/%Y'),
+                (exp_date - timedelta(days=3)).strftime('%d/%b/%Y'),
+                exp_date.strftime('%d/%b/%Y') if shipped else None,
+                None,
+            ]
+
+
+def count_rows(n, seed=0):
+    """Yield n stock count rows; about 60% counted, a few with variance."""
+    rng = np.random.default_rng(seed)
+    line_id = 0
+    for start in range(0, n, CHUNK_ROWS):
+        size = min(CHUNK_ROWS, n - start)
+        number = rng.integers(1, 40, size)
+        zone = rng.choice(GI_ZONES, size)
+        aisle = rng.integers(1, 30, size)
+        bay = rng.integers(1, 20, size)
+        level = rng.integers(1, 6, size)
+        sku = rng.integers(100_000, 999_999, size)
+        desc = rng.choice(DESCRIPTIONS, size)
+        on_hand = rng.integers(0, 1000, size)
+        counted = rng.random(size) < 0.6
+        variance = np.where(rng.random(size) < 0.05, rng.integers(-20, 21, size), 0)
+        expiry = rng.integers(30, 900, size)
+        today = datetime.today()
+        for i in range(size):
+            line_id += 1
+            count = int(on_hand[i] + variance[i]) if counted[i] else None
+            yield [
+                f"ICC{number[i]:04d}", line_id, zone[i],
+                f"{zone[i][:2].upper()}-{aisle[i]:02d}-{bay[i]:02d}-{level[i]}",
+                f"SKU{sku[i]}", desc[i],
+                (today + timedelta(days=int(expiry[i]))).strftime('%Y-%m-%d'),
+                int(on_hand[i]), count, int(variance[i]) if counted[i] else None, None,
+            ]
+
+
+def gi_report_header(n):
+    """The 6 report rows the WMS prints above the GI analysis column names."""
+    now = datetime.now()
+    return [
+        ["GI Analysis Report"],
+        ["Warehouse: SSW"],
+        ["Owner: All"],
+        [f"Period: {(now - timedelta(days=14)).strftime('%d/%b/%Y')} - {(now + timedelta(days=7)).strftime('%d/%b/%Y')}"],
+        [f"Generated: {now.strftime('%d/%b/%Y %H:%M:%S')}"],
+        [f"Lines: {n}"],
+    ]
+
+
+# ---------- WRITERS ----------
+def write_xlsx(path, preamble, columns, rows):
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    for row in preamble:
+        ws.append(row)
+    ws.append(columns)
+    for row in rows:
+        ws.append(row)
+    wb.save(path)
+
+
+def write_biff(path, preamble, columns, rows):
+    import xlwt
+
+    wb = xlwt.Workbook()
+    ws = wb.add_sheet("Sheet1")
+    for r, row in enumerate(preamble + [columns]):
+        for c, value in enumerate(row):
+            ws.write(r, c, value)
+    offset = len(preamble) + 1
+    for r, row in enumerate(rows, start=offset):
+        for c, value in enumerate(row):
+            if value is not None:
+                ws.write(r, c, value)
+    wb.save(path)
+
+
+def _xml_cell(value):
+    if value is None:
+        return '<Cell/>'
+    if isinstance(value, (int, np.integer)):
+        return f'<Cell><Data ss:Type="Number">{value}</Data></Cell>'
+    return f'<Cell><Data ss:Type="String">{value}</Data></Cell>'
+
+
+def write_spreadsheetml(path, preamble, columns, rows):
+    """SpreadsheetML with whitespace inside the xmlns URIs and bare '&' in text, as exported by the WMS."""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(
+            '<?xml version="1.0"?>\n<?mso-application progid="Excel.Sheet"?>\n'
+            '<Workbook xmlns="urn:schemas-microsoft-com:office: spreadsheet"\n'
+            ' xmlns:o="urn:schemas-microsoft-com:office:office"\n'
+            ' xmlns:x="urn:schemas-microsoft-com:office:excel"\n'
+            ' xmlns:ss="urn:schemas-microsoft-com:office:\n spreadsheet"\n'
+            ' xmlns:html="http://www.w3.org/TR/ REC-html40">\n'
+            '<Worksheet ss:Name="Sheet1">\n<Table>\n'
+        )
+        for row in preamble + [columns]:
+            f.write('<Row>' + ''.join(_xml_cell(v) for v in row) + '</Row>\n')
+        for row in rows:
+            f.write('<Row>' + ''.join(_xml_cell(v) for v in row) + '</Row>\n')
+        f.write('</Table>\n</Worksheet>\n</Workbook>\n')
+
+
+WRITERS = {
+    'xlsx': ('.xlsx', write_xlsx),
+    'biff': ('_biff.xls', write_biff),
+    'xml': ('_xml.xls', write_spreadsheetml),
+}
+
+
+def generate(out_dir, sizes, formats):
+    os.makedirs(out_dir, exist_ok=True)
+    index = []
+    for kind, stem, columns, make_rows in (
+        ('gi', 'GIAnalysis', GI_EXPORT_COLUMNS, gi_rows),
+        ('count', 'StockCount', COUNT_EXPORT_COLUMNS, count_rows),
+    ):
+        for n in sizes:
+            preamble = gi_report_header(n) if kind == 'gi' else []
+            for fmt in formats:
+                suffix, writer = WRITERS[fmt]
+                if fmt == 'biff' and n + len(preamble) + 1 > BIFF_MAX_ROWS:
+                    print(f"skip {stem} {n:,} rows as BIFF: over the {BIFF_MAX_ROWS:,}-row sheet limit")
+                    continue
+                path = os.path.join(out_dir, f"{stem}_{n}{suffix}")
+                start = time.perf_counter()
+                writer(path, preamble, columns, make_rows(n))
+                print(f"wrote {path} ({os.path.getsize(path) / 1e6:.1f} MB) in {time.perf_counter() - start:.1f}s")
+                index.append({'path': os.path.basename(path), 'kind': kind, 'format': fmt, 'rows': n})
+    with open(os.path.join(out_dir, INDEX_FILE), 'w') as f:
+        json.dump(index, f, indent=2)
+
+
+# ---------- LOADERS ----------
+def _load_upload(raw, name, kind):
+    return read_workbook(raw, name, skiprows=GI_HEADER_ROWS if kind == 'gi' else 0)
+
+
+def _load_spreadsheetml(raw, name, kind):
+    return parse_spreadsheetml(raw, skiprows=GI_HEADER_ROWS if kind == 'gi' else 0)
+
+
+def _load_gi_dashboard(raw, name, kind):
+    return normalise_gi_frame(read_gi_workbook(io.BytesIO(raw), zones=AIRCON_ZONES, types=VALID_TYPES))
+
+
+def _load_stockcount(raw, name, kind):
+    return normalise_count_frame(read_workbook(raw, name))
+
+
+# loader name -> (function, applies to (kind, format))
+LOADERS = {
+    'upload': (_load_upload, lambda kind, fmt: True),
+    'spreadsheetml': (_load_spreadsheetml, lambda kind, fmt: fmt == 'xml'),
+    'gi_dashboard': (_load_gi_dashboard, lambda kind, fmt: kind == 'gi'),
+    'stockcount': (_load_stockcount, lambda kind, fmt: kind == 'count'),
+}
+
+
+def _peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+def measure(loader, path, kind):
+    """Run one loader on one file in this process and print the result as JSON."""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    rss_before = _peak_rss_mb()
+    start = time.perf_counter()
+    df = LOADERS[loader][0](raw, os.path.basename(path), kind)
+    wall = time.perf_counter() - start
+    print(json.dumps({
+        'wall_s': wall,
+        'peak_rss_mb': _peak_rss_mb(),
+        'rss_growth_mb': _peak_rss_mb() - rss_before,
+        'rows_out': len(df),
+    }))
+
+
+def run(data_dir, loaders, timeout, json_out=None):
+    with open(os.path.join(data_dir, INDEX_FILE)) as f:
+        index = json.load(f)
+
+    results = []
+    header = f"{'file':<32} {'loader':<14} {'wall s':>8} {'peak RSS MB':>12} {'Δ RSS MB':>9} {'rows/s':>11} {'rows out':>9}"
+    print(header)
+    print('-' * len(header))
+    for item in index:
+        path = os.path.join(data_dir, item['path'])
+        for name in loaders:
+            if not LOADERS[name][1](item['kind'], item['format']):
+                continue
+            try:
+                proc = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), 'measure', name, path, item['kind']],
+                    capture_output=True, text=True, timeout=timeout,
+                )
+                if proc.returncode != 0:
+                    raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+                result = json.loads(proc.stdout.strip().splitlines()[-1])
+            except Exception as e:
+                print(f"{item['path']:<32} {name:<14} failed: {e}")
+                continue
+            result.update(item, loader=name, rows_per_s=item['rows'] / result['wall_s'])
+            results.append(result)
+            print(f"{item['path']:<32} {name:<14} {result['wall_s']:>8.2f} {result['peak_rss_mb']:>12.0f} "
+                  f"{result['rss_growth_mb']:>9.0f} {result['rows_per_s']:>11,.0f} {result['rows_out']:>9,}")
+
+    if json_out:
+        with open(json_out, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+def memory(data_dir):
+    """Memory of each xlsx file's loaded frame with and without the typed schema."""
+    with open(os.path.join(data_dir, INDEX_FILE)) as f:
+        index = json.load(f)
+    for item in index:
+        if item['format'] != 'xlsx':
+            continue
+        with open(os.path.join(data_dir, item['path']), 'rb') as f:
+            raw = f.read()
+        if item['kind'] == 'gi':
+            before = normalise_gi_frame(read_workbook(raw, item['path'], skiprows=GI_HEADER_ROWS))
+            schema = GI_SCHEMA
+        else:
+            before = normalise_count_frame(read_workbook(raw, item['path']))
+            schema = COUNT_SCHEMA
+        after = apply_schema(before.copy(), schema)
+        print(f"\n{item['path']} ({len(before):,} rows)")
+        print(memory_report(before, after).to_string(index=False, float_format=lambda v: f"{v:,.2f}"))
+
+
+# ---------- CHECKS ----------
+def check_variance_index(rows=20_000):
+    """VarianceIndex.totals() agrees with select() for every filter combination, blank Number/Zone included."""
+    raw = list(count_rows(rows, seed=1))
+    for i, row in enumerate(raw):
+        if i % 53 == 0:
+            row[0] = None  # Number
+        if i % 61 == 0:
+            row[3] = None  # Location, so Zone is blank too
+    df = parse_locations(apply_schema(normalise_count_frame(pd.DataFrame(raw, columns=COUNT_EXPORT_COLUMNS)), COUNT_SCHEMA))
+    index = VarianceIndex(variance_lines(df))
+    failures = []
+    for filters in itertools.product([None, 'gain', 'loss'], [None] + index.count_numbers, [None] + index.zones):
+        selected = index.select(*filters)
+        totals = index.totals(*filters)
+        if totals['lines'] != len(selected) or totals['net'] != int(selected['Variance'].sum()):
+            failures.append(f"{filters}: totals {totals}, selected {len(selected)} lines")
+    return failures
+
+
+# Upload file name -> expected count session. Files of different sites must not share a session,
+# or one site's upload would replace (and clean up) the other's file.
+SESSION_NAMES = {
+    'StockCount_Site1_20261017.xlsx': 'StockCount_Site1',
+    'StockCount_Site2_20261017.xlsx': 'StockCount_Site2',
+    'Count WH1 17-10-2026.xls': 'Count WH1',
+    'Count WH2 17-10-2026 0930.xls': 'Count WH2',
+    'Count_B2.xlsx': 'Count_B2',
+    'Count_B12_2026.xlsx': 'Count_B12_2026',
+    'StockCount Jurong 2026-10-17 0930.xls': 'StockCount Jurong',
+    'Count_Tuas_17.10.26_093015.xlsx': 'Count_Tuas',
+    'StockCount.xlsx': 'StockCount',
+}
+
+
+def check_session_names():
+    """session_name strips only a trailing date/time stamp, so site numbers keep concurrent sites apart."""
+    return [
+        f"{name!r}: session {session_name(name)!r}, expected {expected!r}"
+        for name, expected in SESSION_NAMES.items() if session_name(name) != expected
+    ]
+
+
+class _FakeUploadHandler(BaseHTTPRequestHandler):
+    """
+    The resumable upload protocol as GCS speaks it: 308 with a Range header
+    until the last byte, then 200. While `server.failures` is positive, a
+    chunk is cut at an aligned half (that half is kept) and answered with 503.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, total):
+        received = len(self.server.received)
+        if status == 308 and received == total:
+            status = 200
+        self.send_response(status)
+        if status == 308 and received:
+            self.send_header("Range", f"bytes=0-{received - 1}")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        spec = self.headers["Content-Range"].split()[1]  # "<first>-<last>/<total>" or "*/<total>"
+        total = int(spec.split("/")[1])
+        if self.path != "/upload":
+            return self._reply(404, total)  # an expired or unknown session
+        if body:
+            first = int(spec.split("-")[0])
+            if first != len(self.server.received):
+                return self._reply(400, total)
+            if self.server.failures > 0:
+                self.server.failures -= 1
+                self.server.received += body[:len(body) // 2 // CHUNK_ALIGNMENT * CHUNK_ALIGNMENT]
+                return self._reply(503, total)
+            self.server.received += body
+        self._reply(308, total)
+
+
+class _FakeBlob:
+    def __init__(self, session_url):
+        self.session_url = session_url
+
+    def create_resumable_upload_session(self, content_type, size):
+        return self.session_url
+
+    def reload(self):
+        pass
+
+
+def check_resumable_upload(size=5 * 1024 * 1024 + 12_345, chunk_size=1024 * 1024):
+    """Chunks, retries after a dropped chunk, and resuming an upload that gave up, against a local stand-in."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _FakeUploadHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    blob = _FakeBlob(f"http://127.0.0.1:{server.server_port}/upload")
+    payload = np.random.default_rng(0).bytes(size)
+    failures = []
+    try:
+        # Three dropped chunks are retried from the offset the server reports
+        server.received, server.failures = bytearray(), 3
+        seen = []
+        stats = resumable_upload(blob, io.BytesIO(payload), size, 'application/octet-stream', chunk_size=chunk_size,
+                                 progress=lambda sent, total, seconds: seen.append(sent), backoff=0)
+        if bytes(server.received) != payload:
+            failures.append("retried upload: stored bytes differ from the file")
+        if stats['retries'] != 3 or stats['bytes'] != size or seen[-1] != size:
+            failures.append(f"retried upload: stats {stats}, last progress {seen[-1:]}")
+
+        # An upload that gives up can be continued with its session URL
+        server.received, server.failures = bytearray(), 100
+        try:
+            resumable_upload(blob, io.BytesIO(payload), size, 'application/octet-stream', chunk_size=chunk_size,
+                             retries=2, backoff=0)
+            failures.append("interrupted upload: no UploadInterrupted raised")
+        except UploadInterrupted as e:
+            server.failures = 0
+            committed = len(server.received)
+            stats = resumable_upload(blob, io.BytesIO(payload), size, 'application/octet-stream',
+                                     chunk_size=chunk_size, session_url=e.session_url, backoff=0)
+            if bytes(server.received) != payload or stats['bytes'] != size - committed:
+                failures.append(f"resumed upload: stats {stats} after {committed:,} bytes committed")
+
+        # A dead session URL is an error, not an interruption, so Upload.py starts a new session
+        try:
+            resumable_upload(blob, io.BytesIO(payload), size, 'application/octet-stream',
+                             session_url=f"http://127.0.0.1:{server.server_port}/expired", backoff=0)
+            failures.append("expired session: upload succeeded")
+        except UploadInterrupted:
+            failures.append("expired session: raised UploadInterrupted, so the dead URL would be kept")
+        except RuntimeError:
+            pass
+
+        # An empty file is one status request
+        server.received, server.failures = bytearray(), 0
+        stats = resumable_upload(blob, io.BytesIO(b''), 0, 'application/octet-stream', backoff=0)
+        if stats['chunks'] != 1 or server.received:
+            failures.append(f"empty upload: stats {stats}")
+    finally:
+        server.shutdown()
+        server.server_close()
+    return failures
+
+
+# check name -> function returning a list of failure messages
+CHECKS = {
+    'variance_index': check_variance_index,
+    'session_names': check_session_names,
+    'resumable_upload': check_resumable_upload,
+}
+
+
+def check(names):
+    failed = False
+    for name in names:
+        try:
+            failures = CHECKS[name]()
+        except Exception as e:
+            failures = [f"raised {type(e).__name__}: {e}"]
+        print(f"{name:<16} {'ok' if not failures else f'{len(failures)} failure(s)'}")
+        for message in failures[:10]:
+            print(f"  {message}")
+        failed = failed or bool(failures)
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the GI and stock count ingest paths.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    gen = sub.add_parser('generate', help="write synthetic GI and count files")
+    gen.add_argument('--out', default='bench_data')
+    gen.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    gen.add_argument('--formats', nargs='+', choices=list(WRITERS), default=list(WRITERS))
+
+    bench = sub.add_parser('run', help="time every loader on every generated file")
+    bench.add_argument('--data', default='bench_data')
+    bench.add_argument('--loaders', nargs='+', choices=list(LOADERS), default=list(LOADERS))
+    bench.add_argument('--timeout', type=int, default=3600, help="seconds per run")
+    bench.add_argument('--json', help="also write the results to this file")
+
+    mem = sub.add_parser('memory', help="compare frame memory with and without the typed schema")
+    mem.add_argument('--data', default='bench_data')
+
+    chk = sub.add_parser('check', help="run consistency checks on synthetic data")
+    chk.add_argument('checks', nargs='*', metavar='CHECK', help=f"any of {', '.join(CHECKS)} (default: all)")
+
+    one = sub.add_parser('measure', help=argparse.SUPPRESS)
+    one.add_argument('loader', choices=list(LOADERS))
+    one.add_argument('path')
+    one.add_argument('kind', choices=['gi', 'count'])
+
+    args = parser.parse_args()
+    if args.command == 'generate':
+        generate(args.out, args.rows, args.formats)
+    elif args.command == 'run':
+        run(args.data, args.loaders, args.timeout, args.json)
+    elif args.command == 'memory':
+        memory(args.data)
+    elif args.command == 'check':
+        unknown = sorted(set(args.checks) - set(CHECKS))
+        if unknown:
+            parser.error(f"unknown check(s): {', '.join(unknown)}")
+        sys.exit(check(args.checks or list(CHECKS)))
+    else:
+        measure(args.loader, args.path, args.kind)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,517 @@
+"""
+Shared helpers for the GCS bucket used by the upload page and the dashboards.
+
+Upload.py publishes a small JSON manifest per dashboard type after every
+upload ("manifests/gi.json", "manifests/count.json"). Dashboards resolve the
+latest file with one small GET of that manifest instead of listing the bucket.
+
+Next to each upload, Upload.py also writes a normalised Parquet snapshot
+("snapshots/<file name>.parquet") which dashboards load instead of re-parsing
+the Excel file. GI snapshots are partitioned by StorageZone
+("snapshots/<file name>/zone=<zone>.parquet"), so each zone dashboard
+downloads only its own zones.
+
+Stock counts can run at several sites at once. Each count upload belongs to a
+session (its file name without trailing dates), and the count manifest lists
+the latest file of every active session under "sessions".
+
+Dashboards keep the parsed data in a SnapshotRefresher: a background thread
+polls for new generations and swaps in the new frame, so reruns never wait
+on GCS.
+
+Uploads go through a GCS resumable upload session in chunks (see
+resumable_upload), so a dropped connection costs one chunk, not the file.
+The storage client honours STORAGE_EMULATOR_HOST, so all of this also runs
+against a local stand-in such as fake-gcs-server.
+"""
+import io
+import json
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+
+import pandas as pd
+import requests
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+from timing import attach_trace, begin_trace, current_trace, end_trace, count, span
+
+MANIFEST_PREFIX = "manifests/"
+MANIFEST_KEYWORDS = ('gi', 'count')
+MANIFEST_ATTEMPTS = 5  # retries when another upload rewrites the manifest at the same time
+SNAPSHOT_PREFIX = "snapshots/"
+REFRESH_INTERVAL = 30  # seconds between background polls
+SESSION_TTL_DAYS = 7  # count sessions not re-uploaded for this long are treated as finished
+SESSION_WORKERS = 4  # sessions downloaded and parsed in parallel
+
+CHUNK_ALIGNMENT = 256 * 1024  # GCS needs every chunk but the last to be a multiple of 256 KiB
+UPLOAD_CHUNK_SIZE = int(float(os.environ.get("DASHBOARD_UPLOAD_CHUNK_MB", "8")) * 1024 * 1024)
+UPLOAD_RETRIES = 5  # attempts per chunk before the upload is left to be resumed
+UPLOAD_BACKOFF = 1.0  # seconds before the first retry, doubling per retry up to 30
+UPLOAD_TIMEOUT = 120  # seconds per chunk request
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
+
+def manifest_blob_name(keyword):
+    return f"{MANIFEST_PREFIX}{keyword}.json"
+
+
+def is_manifest(blob_name):
+    return blob_name.startswith(MANIFEST_PREFIX)
+
+
+def blob_entry(blob, row_count=None):
+    """Describe a blob the same way a manifest does."""
+    return {
+        "blob_name": blob.name,
+        "generation": blob.generation,
+        "md5_hash": blob.md5_hash,
+        "size": blob.size,
+        "updated": blob.updated.isoformat() if blob.updated else None,
+        "row_count": row_count,
+    }
+
+
+def write_manifest(bucket, keyword, blob, row_count, snapshot=None, session=None):
+    """
+    Publish `blob` (and its Parquet snapshot, if any) as the latest file for
+    the `keyword` dashboard and return the manifest. With a `session`, the
+    file also replaces that session's file among the manifest's active
+    sessions; concurrent uploads are merged, not lost.
+    """
+    entry = blob_entry(blob, row_count=row_count)
+    entry["snapshot"] = snapshot
+    if session is None:
+        _upload_manifest(bucket.blob(manifest_blob_name(keyword)), entry)
+        return entry
+
+    entry["session"] = session
+    for _ in range(MANIFEST_ATTEMPTS):
+        current = bucket.get_blob(manifest_blob_name(keyword))
+        try:
+            previous = json.loads(current.download_as_bytes(if_generation_match=current.generation)) if current else None
+        except (NotFound, PreconditionFailed):
+            continue
+        except ValueError:
+            previous = None
+        sessions = active_sessions(previous)
+        sessions[session] = entry
+        manifest = {**entry, "sessions": sessions}
+        try:
+            _upload_manifest(bucket.blob(manifest_blob_name(keyword)), manifest,
+                             if_generation_match=current.generation if current else 0)
+            return manifest
+        except PreconditionFailed:
+            continue
+    raise RuntimeError(f"Manifest '{manifest_blob_name(keyword)}' kept changing during the upload, please retry.")
+
+
+def _upload_manifest(blob, manifest, **preconditions):
+    blob.cache_control = "no-cache"
+    blob.upload_from_string(json.dumps(manifest), content_type="application/json", **preconditions)
+
+
+def read_manifest(bucket, keyword):
+    """Return the manifest entry for `keyword`, or None if none was published yet."""
+    try:
+        with span("read_manifest") as s:
+            raw = bucket.blob(manifest_blob_name(keyword)).download_as_bytes()
+            s["bytes"] = len(raw)
+    except NotFound:
+        return None
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return None
+
+
+def entry_updated(entry):
+    """Upload time of a manifest entry as an aware datetime."""
+    return datetime.fromisoformat(entry["updated"]) if entry.get("updated") else None
+
+
+# --- Count sessions ---
+# A trailing upload date (20261017, 2026-10-17, 17-10-2026, 17.10.26), optionally followed by a
+# time (0930, 093015), after a separator. Other digits, such as site numbers, stay in the session.
+_SESSION_DATE = r'\d{8}|\d{4}[-_.]\d{1,2}[-_.]\d{1,2}|\d{1,2}[-_.]\d{1,2}[-_.]\d{2,4}'
+SESSION_STAMP = re.compile(rf'[_\s-]+(?:{_SESSION_DATE})(?:[_\s-]+\d{{4}}(?:\d{{2}})?)?$')
+
+
+def session_name(blob_name):
+    """Session of an uploaded file: its name without extension and trailing date/time stamp."""
+    stem = os.path.splitext(os.path.basename(blob_name))[0]
+    return SESSION_STAMP.sub('', stem) or stem
+
+
+def active_sessions(manifest):
+    """
+    {session: entry} of the sessions a manifest lists (a manifest written
+    without sessions is one session), minus those not re-uploaded within
+    SESSION_TTL_DAYS. The newest session is always kept.
+    """
+    if not manifest:
+        return {}
+    sessions = manifest.get("sessions") or {manifest.get("session") or session_name(manifest["blob_name"]): manifest}
+    cutoff = datetime.now(timezone.utc) - timedelta(days=SESSION_TTL_DAYS)
+    active = {name: e for name, e in sessions.items() if entry_updated(e) is None or entry_updated(e) >= cutoff}
+    if not active:
+        newest = max(sessions, key=lambda name: entry_updated(sessions[name]))
+        active = {newest: sessions[newest]}
+    return active
+
+
+# --- Parquet snapshots ---
+def snapshot_blob_name(blob_name):
+    return f"{SNAPSHOT_PREFIX}{blob_name}.parquet"
+
+
+def partition_blob_name(blob_name, zone):
+    return f"{SNAPSHOT_PREFIX}{blob_name}/zone={quote(zone, safe='')}.parquet"
+
+
+def is_snapshot_of(snapshot_name, blob_name):
+    """True for the snapshot of `blob_name` and for each of its zone partitions."""
+    return snapshot_name == snapshot_blob_name(blob_name) or snapshot_name.startswith(f"{SNAPSHOT_PREFIX}{blob_name}/")
+
+
+def _arrow_safe(df):
+    """Stringify object columns holding mixed types, which Parquet cannot store."""
+    df = df.copy()
+    df.columns = df.columns.map(str)
+    for col in df.columns:
+        if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True).startswith('mixed'):
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+
+def _upload_parquet(bucket, name, df):
+    buf = io.BytesIO()
+    _arrow_safe(df).to_parquet(buf, index=False)
+    blob = bucket.blob(name)
+    blob.upload_from_string(buf.getvalue(), content_type="application/vnd.apache.parquet")
+    return {
+        "blob_name": blob.name,
+        "generation": blob.generation,
+        "size": blob.size,
+    }
+
+
+# --- Resumable upload ---
+class UploadInterrupted(RuntimeError):
+    """A chunked upload gave up; pass `session_url` to resumable_upload to continue from `offset`."""
+
+    def __init__(self, message, session_url, offset):
+        super().__init__(message)
+        self.session_url = session_url
+        self.offset = offset
+
+
+class _RetryableResponse(Exception):
+    pass
+
+
+def _upload_state(response, size):
+    """(done, bytes GCS has committed) from a resumable upload response."""
+    if response.status_code in RETRY_STATUSES:
+        raise _RetryableResponse(f"HTTP {response.status_code}")
+    if response.status_code in (200, 201):
+        return True, size
+    if response.status_code == 308:
+        committed = response.headers.get("Range")  # "bytes=0-<last byte>", absent before the first byte
+        return False, int(committed.rsplit("-", 1)[1]) + 1 if committed else 0
+    raise RuntimeError(f"Upload rejected with HTTP {response.status_code}: {response.text[:200]}")
+
+
+def resumable_upload(blob, fileobj, size, content_type, chunk_size=UPLOAD_CHUNK_SIZE, session_url=None,
+                     progress=None, retries=UPLOAD_RETRIES, backoff=UPLOAD_BACKOFF, http=None):
+    """
+    Upload `size` bytes of `fileobj` to `blob` in `chunk_size` chunks over a
+    resumable upload session, then reload the blob's metadata. A failed chunk
+    is retried with exponential backoff from the offset GCS reports it has;
+    after `retries` failures in a row UploadInterrupted is raised, and passing
+    its `session_url` back continues the same upload.
+
+    `progress(committed, size, seconds)` is called after every chunk, and
+    `http` is the requests session the chunks are sent with. Returns the
+    bytes sent by this call, seconds, MB/s, chunks, retries and session_url.
+    """
+    chunk_size = max(CHUNK_ALIGNMENT, chunk_size // CHUNK_ALIGNMENT * CHUNK_ALIGNMENT)
+    http = http or requests.Session()
+    status_headers = {"Content-Range": f"bytes */{size}"}
+    done, offset, resumed = False, 0, session_url is not None
+    if not resumed:
+        session_url = blob.create_resumable_upload_session(content_type=content_type, size=size)
+
+    start = time.perf_counter()
+    chunks = failures = attempt = 0
+    first_offset = None if resumed else 0  # bytes already committed when this call started
+    while not done:
+        try:
+            if resumed:
+                # Ask how much an earlier attempt committed before sending anything
+                done, offset = _upload_state(http.put(session_url, headers=status_headers, timeout=UPLOAD_TIMEOUT), size)
+                first_offset = offset if first_offset is None else first_offset
+                resumed = False
+                continue
+            fileobj.seek(offset)
+            chunk = fileobj.read(chunk_size)
+            headers = {"Content-Range": f"bytes {offset}-{offset + len(chunk) - 1}/{size}"} if chunk else status_headers
+            done, offset = _upload_state(http.put(session_url, data=chunk, headers=headers, timeout=UPLOAD_TIMEOUT), size)
+            chunks += 1
+            attempt = 0
+        except (requests.ConnectionError, requests.Timeout, _RetryableResponse) as e:
+            failures += 1
+            attempt += 1
+            if attempt > retries:
+                raise UploadInterrupted(
+                    f"Upload stopped at {offset:,} of {size:,} bytes after {retries} retries: {e}", session_url, offset
+                ) from e
+            time.sleep(min(backoff * 2 ** (attempt - 1), 30))
+            resumed = True  # the chunk may have partly arrived
+            continue
+        if progress is not None:
+            progress(offset, size, time.perf_counter() - start)
+
+    seconds = time.perf_counter() - start
+    sent = size - (first_offset or 0)
+    blob.reload()
+    return {
+        "bytes": sent,
+        "seconds": round(seconds, 2),
+        "mb_per_s": round(sent / 1024 / 1024 / seconds, 2) if seconds > 0 else None,
+        "chunks": chunks,
+        "retries": failures,
+        "session_url": session_url,
+    }
+
+
+def write_snapshot(bucket, blob_name, df):
+    """Upload `df` as the Parquet snapshot of `blob_name` and return its manifest entry."""
+    return _upload_parquet(bucket, snapshot_blob_name(blob_name), df)
+
+
+def write_partitioned_snapshot(bucket, blob_name, partitions):
+    """
+    Upload one Parquet snapshot per zone of `partitions` ({zone: frame}) and
+    return the manifest entry listing them. Its generation is the newest
+    partition's, so it changes whenever any partition is rewritten.
+    """
+    parts = {}
+    for zone, df in partitions.items():
+        parts[zone] = _upload_parquet(bucket, partition_blob_name(blob_name, zone), df)
+        parts[zone]["rows"] = len(df)
+    return {
+        "generation": max((p["generation"] for p in parts.values()), default=None),
+        "size": sum(p["size"] or 0 for p in parts.values()),
+        "partitions": parts,
+    }
+
+
+def read_snapshot(bucket, snapshot_name, generation=None):
+    """Load a Parquet snapshot, or return None if it no longer exists."""
+    try:
+        with span("download") as s:
+            raw = bucket.blob(snapshot_name, generation=generation).download_as_bytes()
+            s["bytes"] = len(raw)
+    except NotFound:
+        return None
+    with span("parse") as s:
+        df = pd.read_parquet(io.BytesIO(raw))
+        s["rows"] = len(df)
+    return df
+
+
+def read_partitions(bucket, snapshot, zones):
+    """
+    Load the partitions of a partitioned snapshot for `zones` as {zone: frame}.
+    Zones without rows have no partition; if none of `zones` has one, the
+    smallest partition is returned as an empty frame with the right columns.
+    Returns None if any partition no longer exists.
+    """
+    parts = snapshot["partitions"]
+    wanted = [z for z in zones if z in parts]
+    if not wanted and parts:
+        smallest = min(parts, key=lambda z: parts[z].get("rows") or 0)
+        df = read_snapshot(bucket, parts[smallest]["blob_name"], parts[smallest]["generation"])
+        return None if df is None else {smallest: df.iloc[:0]}
+    frames = {}
+    for zone in wanted:
+        df = read_snapshot(bucket, parts[zone]["blob_name"], parts[zone]["generation"])
+        if df is None:
+            return None
+        frames[zone] = df
+    return frames
+
+
+# --- Shared workbook parse ---
+_parsed = {}
+_parse_lock = threading.Lock()
+
+
+def shared_parse(entry, parse):
+    """
+    `parse(entry)` once per file generation in this process, shared by every
+    dashboard that needs the same file. Only the latest generation is kept.
+    Callers must treat the result as read-only.
+    """
+    key = (entry["blob_name"], entry["generation"])
+    with _parse_lock:
+        if key not in _parsed:
+            result = parse(entry)
+            _parsed.clear()
+            _parsed[key] = result
+        return _parsed[key]
+
+
+def load_sessions(sessions, load, loaded=None, max_workers=SESSION_WORKERS):
+    """
+    Load every session of `sessions` ({session: entry}) with `load(entry)`,
+    concurrently on a thread pool, as {session: (entry_key, result)}.
+    Sessions whose key is unchanged in `loaded` (a previous return value)
+    are reused. Workers record their spans on the caller's trace; the first
+    failing session's error is raised.
+    """
+    loaded = loaded or {}
+    reused = {name: loaded[name] for name, e in sessions.items() if name in loaded and loaded[name][0] == entry_key(e)}
+    pending = {name: e for name, e in sessions.items() if name not in reused}
+    trace = current_trace()
+
+    def run(entry):
+        attach_trace(trace)
+        try:
+            return load(entry)
+        finally:
+            attach_trace(None)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending))), thread_name_prefix="session-load") as pool:
+        futures = {name: pool.submit(run, e) for name, e in pending.items()}
+    results = dict(reused)
+    for name, future in futures.items():
+        results[name] = (entry_key(sessions[name]), future.result())
+    count("sessions_reused", len(reused))
+    count("sessions_loaded", len(futures))
+    return results
+
+
+# --- Background snapshot refresher ---
+Snapshot = namedtuple('Snapshot', ['key', 'entry', 'frame', 'aggregates', 'loaded_at'])
+
+
+def entry_key(entry):
+    """
+    Identity of a manifest entry: (name, generation, size) of the file plus
+    its content hash and snapshot generation. GCS gives every overwrite a new
+    generation, so the key changes exactly when the content does. An entry
+    with sessions is identified by its sessions' keys.
+    """
+    if entry.get("sessions"):
+        return tuple(sorted((name, entry_key(e)) for name, e in entry["sessions"].items()))
+    snapshot = entry.get("snapshot") or {}
+    return (
+        entry["blob_name"], entry["generation"], entry.get("size"),
+        entry.get("md5_hash"), snapshot.get("generation"),
+    )
+
+
+class SnapshotRefresher:
+    """
+    Keep the latest parsed file in memory, refreshed off the request path.
+
+    A daemon thread calls `resolve()` every `interval` seconds to get the
+    latest manifest entry, and `load(entry)` only when that entry's
+    generation changed. The new Snapshot replaces the old one in a single
+    reference assignment, so readers always see a complete snapshot.
+    Frames are shared between sessions and must be treated as read-only.
+
+    `derive(frame, previous_aggregates)`, if given, builds the snapshot's
+    aggregates on the same thread, with the previous snapshot's aggregates
+    so it can update them incrementally.
+
+    Every poll is timed as a "<name>:refresh" trace; `last_load_trace` is
+    the most recent poll that loaded a new file. `hits` counts polls that
+    kept the loaded snapshot, `misses` polls that loaded a new one.
+    """
+
+    def __init__(self, resolve, load, derive=None, interval=REFRESH_INTERVAL, name="dashboard"):
+        self._resolve = resolve
+        self._load = load
+        self._derive = derive
+        self.interval = interval
+        self.name = name
+        self.snapshot = None
+        self.last_error = None
+        self.last_poll = None
+        self.last_load_trace = None
+        self.hits = 0
+        self.misses = 0
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="snapshot-refresher", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self.refresh()
+            time.sleep(self.interval)
+
+    def refresh(self):
+        trace = begin_trace(f"{self.name}:refresh")
+        try:
+            with span("resolve"):
+                entry = self._resolve()
+            if entry is not None and self.snapshot is not None and entry_key(entry) == self.snapshot.key:
+                self.hits += 1
+                count("snapshot_hits")
+            elif entry is not None:
+                self.misses += 1
+                count("snapshot_misses")
+                with span("load") as s:
+                    frame = self._load(entry)
+                    s["rows"] = len(frame)
+                aggregates = None
+                if self._derive is not None:
+                    previous = self.snapshot.aggregates if self.snapshot else None
+                    with span("derive"):
+                        aggregates = self._derive(frame, previous)
+                self.snapshot = Snapshot(entry_key(entry), entry, frame, aggregates, time.time())
+                self.last_load_trace = trace
+            self.last_error = None
+        except Exception as e:
+            self.last_error = e
+        finally:
+            end_trace(trace)
+            self.last_poll = time.time()
+            self._ready.set()
+
+    def current(self, timeout=120):
+        """Latest snapshot, waiting for the first poll if it has not finished yet."""
+        self._ready.wait(timeout)
+        return self.snapshot
+
+
+def describe_age(seconds):
+    seconds = int(max(seconds, 0))
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60}s"
+    return f"{seconds // 3600}h {seconds % 3600 // 60}m"
+
+
+def snapshot_status(refresher):
+    """One-line sidebar caption: how old the data is and when it was last checked."""
+    snapshot = refresher.current()
+    now = time.time()
+    uploaded = entry_updated(snapshot.entry)
+    parts = []
+    if uploaded:
+        parts.append(f"uploaded {describe_age((datetime.now(timezone.utc) - uploaded).total_seconds())} ago")
+    parts.append(f"loaded {describe_age(now - snapshot.loaded_at)} ago")
+    if refresher.last_poll:
+        parts.append(f"checked {describe_age(now - refresher.last_poll)} ago")
+    parts.append(f"{refresher.hits} unchanged / {refresher.misses} loaded")
+    return "🕒 Snapshot " + " · ".join(parts)
@@ -0,0 +1,178 @@
+"""
+Local SQLite history, so the dashboards can reach back further than the
+newest file (Upload.py deletes the older ones).
+
+Outbound: whenever a GI dashboard loads a new snapshot it rolls the frame up
+to one row per (day, StorageZone) and upserts the rows. The newest file is
+authoritative for the days it contains; days it no longer contains keep the
+values from the last file that had them. Long Analytics windows are summed
+from these rollups instead of from workbooks.
+
+Stock count: every new count file appends one (upload time, Number, Total,
+Counted) row per ICC Number, from which Stockcount.py derives count rates,
+ETAs and progress over time.
+"""
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timezone
+from itertools import product
+
+import pandas as pd
+
+HISTORY_DB = os.environ.get("DASHBOARD_HISTORY_DB", os.path.join("data", "history.sqlite"))
+HISTORY_WINDOWS = (14, 90, 365)  # days selectable in the Analytics tab
+
+# Rollup column -> WindowAggregate table column
+ROLLUP_COLUMNS = {
+    'rows': 'rows',
+    'lines': 'lines',
+    'cancelled': 'cancelled',
+    'expected': 'ExpectedQTY',
+    'shipped': 'ShippedQTY',
+    'variance': 'VarianceQTY',
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS daily_rollup (
+    day TEXT NOT NULL,
+    zone TEXT NOT NULL,
+    rows INTEGER NOT NULL,
+    lines INTEGER NOT NULL,
+    cancelled INTEGER NOT NULL,
+    expected REAL NOT NULL,
+    shipped REAL NOT NULL,
+    variance REAL NOT NULL,
+    recorded_at TEXT NOT NULL,
+    PRIMARY KEY (day, zone)
+);
+CREATE TABLE IF NOT EXISTS icc_progress (
+    taken_at TEXT NOT NULL,
+    blob_name TEXT NOT NULL,
+    generation INTEGER,
+    number TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    counted INTEGER NOT NULL,
+    PRIMARY KEY (blob_name, generation, number)
+);
+CREATE INDEX IF NOT EXISTS icc_progress_taken_at ON icc_progress (taken_at);
+"""
+PROGRESS_RETENTION_DAYS = 30  # count progress samples older than this are dropped
+
+
+def _connect(path=None):
+    path = path or HISTORY_DB
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def daily_rollups(df):
+    """One row per (day, zone) of a sort_by_day frame: rows, lines, cancelled lines and quantity sums."""
+    has_gi = df['GINo'].notna()
+    keyed = pd.DataFrame({
+        'day': df['ExpDay'],
+        'zone': df['StorageZone'].astype(str).str.strip().str.lower(),
+        'rows': 1,
+        'lines': has_gi.astype(int),
+        'cancelled': (has_gi & (df['Status'] == '98-Cancelled')).astype(int),
+        'expected': df['ExpectedQTY'].astype(float).fillna(0),
+        'shipped': df['ShippedQTY'].astype(float).fillna(0),
+        'variance': df['VarianceQTY'].astype(float).fillna(0),
+    }).dropna(subset=['day'])
+    return keyed.groupby(['day', 'zone'], sort=True).sum().reset_index()
+
+
+def record_rollups(df, zones, path=None):
+    """
+    Upsert the daily rollups of `df`, the frame of a dashboard showing `zones`.
+    Every (day, zone) of those zones on the frame's days is replaced, so rows
+    the newest file dropped disappear too. Returns the rows written.
+    """
+    rollups = daily_rollups(df)
+    days = rollups['day'].dt.strftime('%Y-%m-%d')
+    replaced = set(zones) | set(rollups['zone'])
+    recorded_at = datetime.now(timezone.utc).isoformat()
+    rows = [
+        (day, zone, int(r), int(n), int(c), float(e), float(s), float(v), recorded_at)
+        for day, zone, r, n, c, e, s, v in zip(
+            days, rollups['zone'], rollups['rows'], rollups['lines'], rollups['cancelled'],
+            rollups['expected'], rollups['shipped'], rollups['variance'],
+        )
+    ]
+    try:
+        with closing(_connect(path)) as conn, conn:
+            conn.executemany(
+                "DELETE FROM daily_rollup WHERE day = ? AND zone = ?",
+                list(product(sorted(set(days)), sorted(replaced))),
+            )
+            conn.executemany("INSERT INTO daily_rollup VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    except (sqlite3.Error, OSError):
+        return 0  # history must never break the dashboard
+    return len(rows)
+
+
+def load_window(zones, today, days, path=None):
+    """
+    Per-day totals over `zones` for the `days` days before `today` and today,
+    in the shape of WindowAggregate.table; days without rollups are zero.
+    """
+    start = pd.Timestamp(today) - pd.Timedelta(days=days)
+    index = pd.date_range(start, periods=days + 1)
+    sums = ", ".join(f"SUM({col})" for col in ROLLUP_COLUMNS)
+    query = (
+        f"SELECT day, {sums} FROM daily_rollup "
+        f"WHERE day BETWEEN ? AND ? AND zone IN ({', '.join('?' * len(zones))}) GROUP BY day"
+    )
+    try:
+        with closing(_connect(path)) as conn:
+            rows = conn.execute(query, (f"{index[0]:%Y-%m-%d}", f"{index[-1]:%Y-%m-%d}", *zones)).fetchall()
+    except (sqlite3.Error, OSError):
+        rows = []
+    table = pd.DataFrame(rows, columns=['day', *ROLLUP_COLUMNS.values()])
+    table.index = pd.to_datetime(table.pop('day'))
+    table = table.reindex(index, fill_value=0)
+    return table.astype({'rows': int, 'lines': int, 'cancelled': int}).astype(
+        {col: float for col in ('ExpectedQTY', 'ShippedQTY', 'VarianceQTY')}
+    )
+
+
+# ---------- COUNT PROGRESS ----------
+def record_count_progress(summary, entry, path=None):
+    """
+    Append the per-ICC (Total, Counted) of one count file, stamped with its
+    upload time. A file already recorded (same name and generation) is
+    skipped, so every process can record what it loads. Returns the rows written.
+    """
+    taken_at = entry.get("updated") or datetime.now(timezone.utc).isoformat()
+    cutoff = (datetime.now(timezone.utc) - pd.Timedelta(days=PROGRESS_RETENTION_DAYS)).isoformat()
+    rows = [
+        (taken_at, entry["blob_name"], entry.get("generation"), str(number), int(total), int(counted))
+        for number, total, counted in zip(summary['Number'], summary['Total'], summary['Counted'])
+    ]
+    try:
+        with closing(_connect(path)) as conn, conn:
+            conn.execute("DELETE FROM icc_progress WHERE taken_at < ?", (cutoff,))
+            written = conn.executemany("INSERT OR IGNORE INTO icc_progress VALUES (?, ?, ?, ?, ?, ?)", rows).rowcount
+    except (sqlite3.Error, OSError):
+        return 0
+    return written
+
+
+def load_count_progress(numbers, path=None):
+    """Every recorded sample for `numbers` as a frame of taken_at (UTC), Number, Total, Counted, oldest first."""
+    numbers = [str(n) for n in numbers]
+    query = (
+        "SELECT taken_at, number, total, counted FROM icc_progress "
+        f"WHERE number IN ({', '.join('?' * len(numbers))}) ORDER BY taken_at"
+    )
+    try:
+        with closing(_connect(path)) as conn:
+            rows = conn.execute(query, numbers).fetchall() if numbers else []
+    except (sqlite3.Error, OSError):
+        rows = []
+    progress = pd.DataFrame(rows, columns=['taken_at', 'Number', 'Total', 'Counted'])
+    progress['taken_at'] = pd.to_datetime(progress['taken_at'], utc=True, format='ISO8601')
+    return progress
@@ -0,0 +1,410 @@
+"""
+Parsing and normalisation shared by the upload page and the dashboards.
+
+Upload.py applies these to every upload before writing the Parquet snapshot,
+and the dashboards apply the same steps when they fall back to the Excel file,
+so both paths produce identical frames.
+"""
+import codecs
+import io
+import re
+
+import pandas as pd
+
+# GI analysis exports carry a 6-row report header above the column names
+GI_HEADER_ROWS = 6
+GI_DATE_COLUMNS = ['ExpDate', 'CreatedOn', 'ShippedOn']
+# Line number column, under the names different WMS exports use for it
+GI_LINE_COLUMNS = ['LineNo', 'LineID', 'Line']
+# Columns the outbound dashboards actually use; everything else is skipped on load
+GI_COLUMNS = [
+    'GINo', 'ExpDate', 'Priority', 'Status', 'StorageZone', 'Type',
+    'CreatedOn', 'ShippedOn', 'ExpectedQTY', 'ShippedQTY', 'VarianceQTY',
+] + GI_LINE_COLUMNS
+
+SPREADSHEETML_NS = 'urn:schemas-microsoft-com:office:spreadsheet'
+_SS = f'{{{SPREADSHEETML_NS}}}'
+_XMLNS_WHITESPACE = re.compile(r'(xmlns(?::\w+)?="[^"]*?)\s+([^"]*")')
+_BARE_AMPERSAND = re.compile(r'&(?!amp;|lt;|gt;|quot;|apos;|#)')
+_CHUNK_SIZE = 1 << 20
+
+# Declared dtypes for loaded frames, applied by apply_schema:
+#   category  low-cardinality labels (statuses, types, zones)
+#   string    Arrow-backed strings for codes and free text
+#   integer   quantities, as int32/int64 (nullable Int32/Int64 if blanks)
+#   id        integer when every value is a whole number, else string
+GI_SCHEMA = {
+    'GINo': 'id', 'LineNo': 'id', 'LineID': 'id', 'Line': 'id',
+    'Priority': 'category', 'Status': 'category', 'StorageZone': 'category', 'Type': 'category',
+    'Order Type': 'category', 'Order Status': 'category',
+    'ExpectedQTY': 'integer', 'ShippedQTY': 'integer', 'VarianceQTY': 'integer',
+}
+COUNT_SCHEMA = {
+    'Number': 'category', 'Zone': 'category', 'LineID': 'id',
+    'Location': 'string', 'SKUCode': 'string', 'Description': 'string', 'Remarks': 'string',
+    'OnHand': 'integer', 'Count': 'integer', 'Variance': 'integer',
+}
+
+XLSX_MAGIC = b'PK\x03\x04'
+BIFF_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+
+def detect_format(raw_bytes, file_name=''):
+    """'xlsx', 'biff' or 'xml' from the file's magic bytes (and .xlsx extension), else None."""
+    if raw_bytes[:4] == XLSX_MAGIC or file_name.lower().endswith('.xlsx'):
+        return 'xlsx'
+    if raw_bytes[:8] == BIFF_MAGIC:
+        return 'biff'
+    if b'<Workbook' in raw_bytes[:500] or b'spreadsheet' in raw_bytes[:500].lower():
+        return 'xml'
+    return None
+
+
+def read_workbook(raw_bytes, file_name='', skiprows=0):
+    """
+    Read the first sheet of an Excel file in any of these formats:
+      - .xlsx  (ZIP/OpenXML)      → openpyxl
+      - .xls   binary BIFF        → xlrd
+      - .xls   SpreadsheetML XML  → lxml parser
+    `skiprows` skips report header rows above the column names.
+    """
+    fmt = detect_format(raw_bytes, file_name)
+    if fmt == 'xlsx':
+        return pd.read_excel(io.BytesIO(raw_bytes), skiprows=skiprows, engine='openpyxl')
+    if fmt == 'biff':
+        return pd.read_excel(io.BytesIO(raw_bytes), skiprows=skiprows, engine='xlrd')
+    if fmt == 'xml':
+        return parse_spreadsheetml(raw_bytes, skiprows=skiprows)
+
+    # Last-resort fallback — try both engines
+    last_error = None
+    for engine in ['openpyxl', 'xlrd']:
+        try:
+            return pd.read_excel(io.BytesIO(raw_bytes), skiprows=skiprows, engine=engine)
+        except Exception as e:
+            last_error = e
+    raise ValueError(
+        f"Unrecognised file format. Please upload a valid .xls or .xlsx file. "
+        f"Last error: {last_error}"
+    )
+
+
+def normalise_gi_frame(df):
+    """Clean a raw GI analysis sheet: strip headers, drop empty rows/columns, parse dates."""
+    df.columns = df.columns.str.strip()
+    df.dropna(axis=1, how="all", inplace=True)
+    df.dropna(how="all", inplace=True)
+
+    for col in GI_DATE_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], format='%d/%b/%Y', errors='coerce')
+
+    return df[df['ExpDate'].notna()].copy()
+
+
+def read_gi_workbook(file, zones=None, types=None, columns=GI_COLUMNS):
+    """
+    Stream the first sheet of a GI analysis workbook with openpyxl in read-only
+    mode, keeping only `columns`. Rows whose StorageZone (case-insensitive) is
+    not in `zones`, or whose Type is not in `types`, are dropped while streaming
+    and never materialised. The result matches pd.read_excel(skiprows=6) for
+    the kept rows and columns.
+
+    openpyxl only reads .xlsx; .xls exports are read in full by read_workbook
+    and filtered afterwards.
+    """
+    from openpyxl import load_workbook
+
+    magic = file.read(4)
+    file.seek(0)
+    if magic != XLSX_MAGIC:
+        df = read_workbook(file.read(), skiprows=GI_HEADER_ROWS)
+        df.columns = df.columns.astype(str).str.strip()
+        df = df[[c for c in columns if c in df.columns]]
+        return filter_gi_frame(df, zones, types)
+
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        ws.reset_dimensions()
+        rows = ws.iter_rows(min_row=GI_HEADER_ROWS + 1, values_only=True)
+
+        # Blank rows above the column names are skipped, as read_excel does
+        header = next((row for row in rows if any(v is not None for v in row)), None)
+        if header is None:
+            raise ValueError("No column header found in GI analysis sheet.")
+        names = [str(h).strip() if h is not None else '' for h in header]
+
+        wanted = [c for c in columns if c in names]
+        positions = [names.index(c) for c in wanted]
+        buffers = [[] for _ in wanted]
+
+        filters = []
+        if zones is not None:
+            filters.append((names.index('StorageZone'), {z.lower() for z in zones}, str.lower))
+        if types is not None:
+            filters.append((names.index('Type'), set(types), None))
+
+        for row in rows:
+            keep = True
+            for pos, allowed, fold in filters:
+                value = str(row[pos] if pos < len(row) else None).strip()
+                if (fold(value) if fold else value) not in allowed:
+                    keep = False
+                    break
+            if not keep:
+                continue
+            for buf, pos in zip(buffers, positions):
+                buf.append(row[pos] if pos < len(row) else None)
+    finally:
+        wb.close()
+
+    return pd.DataFrame(dict(zip(wanted, buffers)), columns=wanted)
+
+
+def zone_key(zone):
+    """StorageZone as dashboards match it: stripped and lower-cased."""
+    return str(zone).strip().lower()
+
+
+def filter_gi_frame(df, zones=None, types=None):
+    """Vectorised form of the StorageZone/Type filters in read_gi_workbook."""
+    if zones is not None:
+        df = df[df['StorageZone'].astype(str).str.strip().str.lower().isin([zone_key(z) for z in zones])]
+    if types is not None:
+        df = df[df['Type'].astype(str).str.strip().isin(types)]
+    return df.copy()
+
+
+SOURCE_ROW = '_source_row'  # row number in the uploaded file, kept on partitions to restore file order
+
+
+def partition_by_zone(df):
+    """Split a GI frame into {zone_key: frame}, one per StorageZone, each tagged with its file row numbers."""
+    keys = df['StorageZone'].map(zone_key)
+    df = df.assign(**{SOURCE_ROW: range(len(df))})
+    return {zone: part.reset_index(drop=True) for zone, part in df.groupby(keys, sort=True)}
+
+
+def select_partitions(partitions, zones):
+    """
+    Concatenate the partitions for `zones` into a new frame in file order;
+    empty (same columns) if none match.
+    """
+    parts = [partitions[zone_key(z)] for z in zones if zone_key(z) in partitions]
+    if not parts:
+        df = next(iter(partitions.values())).iloc[:0].copy() if partitions else pd.DataFrame()
+    else:
+        df = pd.concat(parts, ignore_index=True)
+    if SOURCE_ROW in df.columns:  # snapshots written before partitions carried row numbers lack it
+        df = df.sort_values(SOURCE_ROW, kind='stable', ignore_index=True).drop(columns=SOURCE_ROW)
+    return df
+
+
+def normalise_count_frame(df):
+    """Clean a raw stock count sheet and derive the Counted flag."""
+    df.columns = df.columns.str.strip()
+    df.dropna(axis=1, how="all", inplace=True)
+    df.dropna(how="all", inplace=True)
+
+    # OnHand and Variance: blanks treated as 0
+    for col in ['OnHand', 'Variance']:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+
+    # Count: preserve NaN to distinguish blank (not counted) from 0 (counted as zero)
+    if 'Count' in df.columns:
+        df['Count'] = pd.to_numeric(df['Count'], errors='coerce')
+
+    if 'Lot1' in df.columns:
+        df['ExpiryDate'] = pd.to_datetime(df['Lot1'], errors='coerce')
+
+    # Counted: blank Count = not yet counted, any number including 0 = counted
+    df['Counted'] = df['Count'].notna()
+
+    return df
+
+
+# ---------- SCHEMA ----------
+def _integer(s):
+    """Whole-number column as int32/int64, nullable if it has blanks; fractional values stay float."""
+    s = pd.to_numeric(s, errors='coerce')
+    values = s.dropna()
+    if not (values == values.round()).all():
+        return s
+    # At least 32-bit, so sums and differences of quantities cannot wrap
+    bits = 32 if values.empty or values.abs().max() < 2 ** 31 else 64
+    return s.astype(f"Int{bits}" if len(values) < len(s) else f"int{bits}")
+
+
+def _id(s):
+    # Codes with leading zeros ("00123") are kept as text
+    if s.dropna().astype(str).str.match(r'0\d').any():
+        return s.astype('string[pyarrow]')
+    numeric = pd.to_numeric(s, errors='coerce')
+    if numeric.notna().sum() == s.notna().sum():
+        converted = _integer(numeric)
+        if converted.dtype != 'float64':
+            return converted
+    return s.astype('string[pyarrow]')
+
+
+_CONVERTERS = {
+    'category': lambda s: s.astype('category'),
+    'string': lambda s: s.astype('string[pyarrow]'),
+    'integer': _integer,
+    'id': _id,
+}
+
+
+def apply_schema(df, schema):
+    """Convert the columns named in `schema` in place; columns the file lacks are skipped."""
+    for col, kind in schema.items():
+        if col in df.columns:
+            df[col] = _CONVERTERS[kind](df[col])
+    return df
+
+
+def memory_report(before, after):
+    """Per-column dtype and deep memory (MB) of two layouts of the same frame, with a total row."""
+    rows = []
+    for col in after.columns:
+        old = before[col] if col in before.columns else None
+        rows.append({
+            'column': col,
+            'before_dtype': str(old.dtype) if old is not None else '',
+            'after_dtype': str(after[col].dtype),
+            'before_mb': old.memory_usage(deep=True, index=False) / 1e6 if old is not None else 0.0,
+            'after_mb': after[col].memory_usage(deep=True, index=False) / 1e6,
+        })
+    report = pd.DataFrame(rows)
+    total = {
+        'column': 'TOTAL', 'before_dtype': '', 'after_dtype': '',
+        'before_mb': report['before_mb'].sum(), 'after_mb': report['after_mb'].sum(),
+    }
+    report = pd.concat([report, pd.DataFrame([total])], ignore_index=True)
+    report['saved_%'] = (1 - report['after_mb'] / report['before_mb'].where(report['before_mb'] > 0)) * 100
+    return report
+
+
+# ---------- SPREADSHEETML PARSER (XML-based .xls) ----------
+def _repaired_chunks(stream, chunk_size=_CHUNK_SIZE):
+    """
+    Yield a SpreadsheetML document as repaired text, one chunk at a time.
+    Drops anything before <Workbook, removes whitespace inside xmlns URIs
+    (common in files exported from ERP/WMS systems) and escapes bare ampersands.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    pending = ''
+    in_body = False
+
+    while True:
+        block = stream.read(chunk_size)
+        final = not block
+        text = pending + decoder.decode(block, final=final)
+        pending = ''
+
+        if not in_body:
+            # Namespace declarations all live in the <Workbook ...> start tag,
+            # so only that tag needs the xmlns repair.
+            start = text.find('<Workbook')
+            end = text.find('>', start) if start != -1 else -1
+            if end == -1:
+                if final:
+                    raise ValueError("Failed to parse SpreadsheetML XML: no <Workbook> element found.")
+                pending = text[start:] if start != -1 else text[-len('<Workbook'):]
+                continue
+            start_tag = text[start:end + 1]
+            while True:
+                fixed = _XMLNS_WHITESPACE.sub(r'\1\2', start_tag)
+                if fixed == start_tag:
+                    break
+                start_tag = fixed
+            text = start_tag + text[end + 1:]
+            in_body = True
+
+        if not final:
+            # Hold back a trailing '&' until we can see whether it starts an entity
+            cut = text.rfind('&', max(0, len(text) - 6))
+            if cut != -1:
+                pending = text[cut:]
+                text = text[:cut]
+
+        yield _BARE_AMPERSAND.sub('&amp;', text)
+        if final:
+            return
+
+
+def _row_values(row):
+    """Map column position -> cell text for one <Row>, honouring ss:Index and ss:MergeAcross."""
+    values = {}
+    col = 0
+    for cell in row.iterchildren(f'{_SS}Cell'):
+        index = cell.get(f'{_SS}Index')
+        if index:
+            col = int(index) - 1
+        data = cell.find(f'{_SS}Data')
+        values[col] = ''.join(data.itertext()) if data is not None else ''
+        col += 1 + int(cell.get(f'{_SS}MergeAcross', 0))
+    return values
+
+
+def parse_spreadsheetml(raw, skiprows=0):
+    """
+    Parse Excel XML / SpreadsheetML format .xls files.
+
+    Streams the document through lxml's pull parser, clearing each <Row> once
+    its cells are copied into per-column buffers, so peak memory stays close
+    to the size of the resulting DataFrame. Reads the first worksheet; the
+    first row after `skiprows` holds the column names.
+    """
+    from lxml import etree
+
+    stream = io.BytesIO(raw) if isinstance(raw, (bytes, bytearray)) else raw
+    parser = etree.XMLPullParser(
+        events=('end',), tag=(f'{_SS}Row', f'{_SS}Worksheet'), huge_tree=True
+    )
+
+    header = None
+    columns = []
+    rows_seen = 0
+    done = False
+
+    try:
+        for chunk in _repaired_chunks(stream):
+            parser.feed(chunk)
+            for _, elem in parser.read_events():
+                if elem.tag == f'{_SS}Worksheet':
+                    done = header is not None
+                elif rows_seen < skiprows:
+                    rows_seen += 1
+                else:
+                    values = _row_values(elem)
+                    if header is None:
+                        # Blank rows above the column names are skipped
+                        if any(values.values()):
+                            header = [values.get(i, '') for i in range(max(values) + 1)]
+                            columns = [[] for _ in header]
+                    else:
+                        for i, buf in enumerate(columns):
+                            buf.append(values.get(i, ''))
+
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+
+                if done:
+                    break
+            if done:
+                break
+        if not done:
+            parser.close()
+    except etree.XMLSyntaxError as e:
+        raise ValueError(f"Failed to parse SpreadsheetML XML: {e}")
+
+    if not header:
+        raise ValueError("No rows found in SpreadsheetML file.")
+
+    df = pd.DataFrame(dict(enumerate(columns)))
+    df.columns = header
+    return df
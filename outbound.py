@@ -0,0 +1,352 @@
+"""
+Aggregates behind the outbound (GI) dashboards, shared by App.py and ColdroomDash.py.
+
+Each snapshot is summarised once into a per-day order cube, (day, Order
+Type, Order Status) -> lines and distinct GIs, and every Daily Dashboard
+panel is read off the cube. Each new snapshot is diffed against the
+previous one on (GINo, line) and only the days the delta touched are
+rebuilt, so a refresh costs in proportion to the rows that changed.
+"""
+import hashlib
+import re
+
+import numpy as np
+import pandas as pd
+
+from ingest import GI_LINE_COLUMNS, zone_key
+
+# StorageZones shown by each zone dashboard; `?zone=` in the URL picks a group
+# or a comma-separated list of zones
+ZONE_GROUPS = {
+    'aircon': ['aircon', 'controlled drug room', 'strong room'],
+    'coldroom': ['cold room', 'freezer'],
+}
+ZONE_GROUP_TITLES = {'aircon': 'Aircon', 'coldroom': 'Coldroom'}
+RUSH_TYPES = ['Ad-hoc Critical', 'Ad-hoc Urgent']
+# Statuses that count as done: today's orders must ship, later days only need packing
+DONE_TODAY = ['Shipped', 'Cancelled']
+DONE_LATER = ['Packed', 'Shipped', 'Cancelled']
+
+
+def resolve_zones(param, default):
+    """Zones for a `?zone=` value: a ZONE_GROUPS name or comma-separated zones; `default` group if unset."""
+    if not param or not param.strip():
+        return tuple(ZONE_GROUPS[default])
+    if zone_key(param) in ZONE_GROUPS:
+        return tuple(ZONE_GROUPS[zone_key(param)])
+    return tuple(zone_key(z) for z in param.split(',') if z.strip())
+
+
+def zone_group(param, default):
+    """
+    Name of what a `?zone=` value shows, for page titles, refresher keys and
+    trace names: its ZONE_GROUPS name, `default` if unset, else its zones
+    joined by '+'. Only [a-z0-9_+] is kept, since the name ends up in the
+    timing file names and Prometheus labels.
+    """
+    if not param or not param.strip():
+        return default
+    if zone_key(param) in ZONE_GROUPS:
+        return zone_key(param)
+    return '+'.join(re.sub(r'[^a-z0-9]+', '_', z).strip('_') for z in resolve_zones(param, default))
+
+
+def zone_group_title(group):
+    """Display name of a zone_group, e.g. 'Aircon' or 'Cold Room + Freezer'."""
+    return ZONE_GROUP_TITLES.get(group) or ' + '.join(z.replace('_', ' ').title() for z in group.split('+'))
+
+
+# ---------- SNAPSHOT DELTA ----------
+def row_keys(df):
+    """(GINo, line, occurrence) key per row; occurrence disambiguates repeated keys."""
+    line = next((c for c in GI_LINE_COLUMNS if c in df.columns), None)
+    parts = [df['GINo']] + ([df[line]] if line else [])
+    occurrence = df.groupby(parts, sort=False, dropna=False).cumcount()
+    return pd.MultiIndex.from_arrays(parts + [occurrence])
+
+
+def _as_objects(s):
+    """Values as an object array with every kind of blank (NaN, NaT, NA) as None, so blanks compare equal."""
+    return s.astype(object).where(s.notna(), None).to_numpy()
+
+
+def diff_frames(old, new):
+    """
+    Compare two snapshots keyed on GINo and line. Returns the inserted and
+    removed rows, the changed rows (as they are in `new`), and the set of
+    ExpDate days those rows fall on, before or after the change.
+    """
+    old = old.set_axis(row_keys(old))
+    new = new.set_axis(row_keys(new))
+
+    inserted = new.loc[new.index.difference(old.index)]
+    removed = old.loc[old.index.difference(new.index)]
+
+    common = new.index.intersection(old.index)
+    columns = [c for c in new.columns if c in old.columns]
+    before = old.loc[common, columns]
+    after = new.loc[common, columns]
+    changed_mask = np.zeros(len(common), dtype=bool)
+    for col in columns:
+        a = _as_objects(before[col])
+        b = _as_objects(after[col])
+        changed_mask |= (a != b)
+    changed = after[changed_mask]
+
+    touched = set()
+    for rows in (inserted, removed, changed, before[changed_mask]):
+        touched.update(rows['ExpDate'].dt.date.dropna())
+
+    return {
+        'inserted': inserted,
+        'removed': removed,
+        'changed': changed,
+        'touched_dates': touched,
+    }
+
+
+# ---------- DATE INDEX ----------
+def sort_by_day(df):
+    """
+    Add the normalised ExpDay column and order rows by it. The sort is stable,
+    so rows keep their file order within a day, and each day's rows are one
+    contiguous range.
+    """
+    df['ExpDay'] = df['ExpDate'].dt.normalize()
+    return df.sort_values('ExpDay', kind='stable', ignore_index=True)
+
+
+class DateIndex:
+    """
+    Row range and line counts per day of a frame sorted by sort_by_day, built
+    in one pass. Lines are rows with a GINo, as the dashboards always counted
+    them. Counts are kept with and without Forward Deploy lines, which only
+    count towards today.
+    """
+
+    def __init__(self, df):
+        days = df['ExpDay'].to_numpy()
+        uniq, starts, counts = np.unique(days, return_index=True, return_counts=True)
+        has_gi = df['GINo'].notna().to_numpy()
+        lines = np.concatenate([[0], np.cumsum(has_gi)])
+        not_fd = np.concatenate([[0], np.cumsum(has_gi & (df['Type'] != 'Forward Deploy').to_numpy())])
+        self.ranges = {}
+        self.counts = {}
+        for day, start, count in zip(pd.to_datetime(uniq).date, starts, counts):
+            stop = start + count
+            self.ranges[day] = (int(start), int(stop))
+            self.counts[day] = (int(lines[stop] - lines[start]), int(not_fd[stop] - not_fd[start]))
+
+    def count(self, day, include_forward_deploy=True):
+        lines, not_fd = self.counts.get(day, (0, 0))
+        return lines if include_forward_deploy else not_fd
+
+    def rows(self, days):
+        """Positions of every row on any of `days`."""
+        ranges = [np.arange(*self.ranges[d]) for d in days if d in self.ranges]
+        return np.concatenate(ranges) if ranges else np.array([], dtype=int)
+
+    def day_slice(self, df, day):
+        start, stop = self.ranges.get(day, (0, 0))
+        return df.iloc[start:stop]
+
+
+# ---------- PER-DAY ORDER CUBE ----------
+def build_cube(df, rows=None):
+    """
+    One groupby over (day, Order Type, Order Status) giving, per cell, the
+    line count and the distinct GIs with the row each first appears on.
+    Returns {day: {'cells': {(order_type, status): (lines, gis, first_rows)},
+    'gi_count': distinct GIs that day}}. `rows` limits the build to those positions.
+    """
+    keyed = pd.DataFrame({
+        'date': df['ExpDay'],
+        'otype': df['Order Type'],
+        'status': df['Order Status'],
+        'GINo': df['GINo'],
+        'row': np.arange(len(df)),
+    })
+    if rows is not None:
+        keyed = keyed.iloc[rows]
+
+    cell_keys = ['date', 'otype', 'status']
+    lines = keyed.groupby(cell_keys, sort=False, observed=True).size()
+    # First occurrence of each GI in each cell, in file order
+    firsts = keyed.drop_duplicates(cell_keys + ['GINo'])
+    gi_lists = firsts.groupby(cell_keys, sort=False, observed=True).agg(gis=('GINo', list), rows=('row', list))
+    gi_counts = keyed.groupby('date', sort=False)['GINo'].nunique()
+
+    cube = {day.date(): {'cells': {}, 'gi_count': int(n)} for day, n in gi_counts.items()}
+    for (day, otype, status), row in gi_lists.iterrows():
+        cube[day.date()]['cells'][(otype, status)] = (int(lines[(day, otype, status)]), row['gis'], row['rows'])
+    return cube
+
+
+def _cell_gis(day_cube, match):
+    """Distinct GIs across the cells where match(order_type, status), in file order."""
+    pairs = []
+    for (otype, status), (_, gis, rows) in day_cube['cells'].items():
+        if match(otype, status):
+            pairs.extend(zip(rows, gis))
+    pairs.sort(key=lambda pair: pair[0])
+    return list(dict.fromkeys(gi for _, gi in pairs))
+
+
+def day_panels(day_cube, is_today, config):
+    """Everything the Daily Dashboard shows for one day, read off that day's cube cells."""
+    done = DONE_TODAY if is_today else DONE_LATER
+
+    critical_gis = _cell_gis(day_cube, lambda o, s: o == 'Ad-hoc Critical' and s not in done)
+    urgent_gis = _cell_gis(day_cube, lambda o, s: o == 'Ad-hoc Urgent' and s not in done)
+
+    if is_today:
+        # Critical/Urgent outstanding = not shipped; others outstanding = not packed/shipped
+        outstanding_gis = list(dict.fromkeys(
+            _cell_gis(day_cube, lambda o, s: o in RUSH_TYPES and s not in DONE_TODAY)
+            + _cell_gis(day_cube, lambda o, s: o not in RUSH_TYPES and s not in DONE_LATER)
+        ))
+    else:
+        outstanding_gis = _cell_gis(day_cube, lambda o, s: s not in DONE_LATER)
+
+    status_lines = {}
+    for (otype, status), (lines, _, _) in day_cube['cells'].items():
+        status_lines[status] = status_lines.get(status, 0) + lines
+    active = sum(n for status, n in status_lines.items() if status != 'Cancelled')
+    completed_statuses = ['Shipped'] if is_today else ['Packed', 'Shipped']
+    completed = sum(status_lines.get(status, 0) for status in completed_statuses)
+    completed_pct = (completed / active * 100) if active else 0
+
+    status_table = pd.DataFrame(0, index=config['order_types'], columns=config['status_segments'])
+    for (otype, status), (lines, _, _) in day_cube['cells'].items():
+        if otype in status_table.index and status in status_table.columns:
+            status_table.at[otype, status] = lines
+    status_table["Total"] = status_table.sum(axis=1)
+    total_row = status_table.sum(axis=0)
+    total_row.name = "Total"
+    status_table = pd.concat([status_table, total_row.to_frame().T])
+
+    return {
+        'lines': sum(status_lines.values()),
+        'gi_count': day_cube['gi_count'],
+        'critical_gis': critical_gis,
+        'urgent_gis': urgent_gis,
+        'outstanding_gis': outstanding_gis,
+        'completed_pct': completed_pct,
+        'completed_label': "Completed" if is_today else "Completed (Packed)",
+        'status_table': status_table,
+    }
+
+
+EMPTY_DAY = {'cells': {}, 'gi_count': 0}
+
+
+# ---------- ANALYTICS WINDOW ----------
+WINDOW_DAYS = 14
+
+
+def window_table(df, today, days=WINDOW_DAYS):
+    """
+    Per-day totals for the `days` days before `today` and today itself. The
+    rows are one searchsorted slice of the ExpDay-sorted frame, binned on
+    integer day offsets from the window start.
+    """
+    start = pd.Timestamp(today) - pd.Timedelta(days=days)
+    stop = pd.Timestamp(today) + pd.Timedelta(days=1)
+    lo, hi = df['ExpDay'].searchsorted([start, stop])
+    window = df.iloc[lo:hi]
+    offsets = ((window['ExpDay'] - start) // pd.Timedelta(days=1)).to_numpy()
+
+    def per_day(weights=None):
+        if weights is not None:
+            weights = np.asarray(weights, dtype=float)
+        return np.bincount(offsets, weights=weights, minlength=days + 1)
+
+    has_gi = window['GINo'].notna().to_numpy()
+    return pd.DataFrame({
+        'rows': per_day().astype(int),
+        'lines': per_day(has_gi).astype(int),
+        'cancelled': per_day(has_gi & (window['Status'] == '98-Cancelled').to_numpy()).astype(int),
+        **{col: per_day(window[col].fillna(0)) for col in ('ExpectedQTY', 'ShippedQTY', 'VarianceQTY')},
+    }, index=pd.date_range(start, periods=days + 1))
+
+
+class WindowAggregate:
+    """
+    The per-day totals feeding every Analytics chart: one row per day, the
+    `days` days before today followed by today. Built from the current
+    snapshot (window_table) or from the local history (history.load_window).
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.days = len(table) - 1
+
+    def expiry(self):
+        """Lines received and cancelled on each of the last `days` days, today included."""
+        return self.table.iloc[1:][['lines', 'cancelled']]
+
+    def volume(self):
+        """Lines per day with orders over the window, today included."""
+        table = self.table
+        return table.loc[table['rows'] > 0, 'lines']
+
+    def past_totals(self):
+        """Expected, shipped and variance quantities summed over the window before today."""
+        return self.table.iloc[:-1][['ExpectedQTY', 'ShippedQTY', 'VarianceQTY']].sum()
+
+
+class DailyAggregates:
+    """
+    The date index and per-day order cube for one snapshot. Panels are read
+    off the cube, so rendering a day costs O(cells), not O(rows).
+    """
+
+    def __init__(self, df, config, cube, dates, delta=None):
+        self.df = df
+        self.config = config
+        self.cube = cube
+        self.dates = dates
+        self.delta = delta
+        self._window = None
+
+    def day(self, dash_date, today):
+        return day_panels(self.cube.get(dash_date, EMPTY_DAY), dash_date == today, self.config)
+
+    def window(self, today):
+        """The Analytics window ending `today`, built once per snapshot and day."""
+        cached = self._window
+        if cached is None or cached[0] != today:
+            cached = (today, WindowAggregate(window_table(self.df, today)))
+            self._window = cached
+        return cached[1]
+
+
+def ingest_snapshot(df, previous, config):
+    """Build the cube for a new snapshot, reusing every day of `previous` the delta did not touch."""
+    dates = DateIndex(df)
+    if previous is None:
+        return DailyAggregates(df, config, build_cube(df), dates)
+    delta = diff_frames(previous.df, df)
+    touched = delta['touched_dates']
+    cube = {day: cells for day, cells in previous.cube.items() if day not in touched}
+    cube.update(build_cube(df, rows=dates.rows(touched)))
+    return DailyAggregates(df, config, cube, dates, delta=delta)
+
+
+def describe_delta(delta):
+    """Sidebar caption for the rows that changed since the previous snapshot."""
+    return (
+        f"Δ since last file: +{len(delta['inserted'])} new, "
+        f"−{len(delta['removed'])} removed, {len(delta['changed'])} changed lines "
+        f"across {len(delta['touched_dates'])} day(s)"
+    )
+
+
+# ---------- RENDER KEYS ----------
+def fingerprint(*parts):
+    """
+    Short hash of a panel's inputs, for element keys. The key only changes
+    when what the panel shows changes, so Streamlit keeps unchanged charts
+    and text areas mounted across autorefreshes.
+    """
+    return hashlib.md5(repr(parts).encode()).hexdigest()[:8]
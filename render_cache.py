@@ -0,0 +1,71 @@
+"""
+Process-wide LRU cache of built Plotly figures and HTML fragments, shared by
+every session of a dashboard.
+
+Panels pass the exact inputs they render from; a rerun whose inputs did not
+change reuses the figure or HTML instead of rebuilding it:
+
+    fig = cached("completed_pie", (label, pct), lambda: build_pie(label, pct))
+
+Cached values are shared between sessions and must be treated as read-only.
+Hits and misses are counted on the current timing trace.
+"""
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from timing import count
+
+CACHE_SIZE = 256  # figures and fragments kept per process
+
+
+def _freeze(value):
+    """Hashable, exact form of a panel input: frames and lists become nested tuples."""
+    if isinstance(value, pd.DataFrame):
+        return (tuple(value.index), tuple(value.columns), tuple(map(tuple, value.to_numpy().tolist())))
+    if isinstance(value, pd.Series):
+        return (tuple(value.index), tuple(value.tolist()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+
+class RenderCache:
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, kind, inputs, build):
+        """The value built for (`kind`, `inputs`), calling `build()` only on a miss."""
+        key = (kind, _freeze(inputs))
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                count("render_cache_hits")
+                return self._entries[key]
+        value = build()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            self.misses += 1
+        count("render_cache_misses")
+        return value
+
+
+_cache = RenderCache()
+
+
+def cached(kind, inputs, build):
+    return _cache.get(kind, inputs, build)
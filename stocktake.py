@@ -0,0 +1,249 @@
+"""
+Aggregates behind the stock count dashboard (Stockcount.py).
+
+The Variance Details filters are served from a VarianceIndex built once per
+snapshot: row positions per filter value, sorted option lists and partial
+sums per (sign, count number, zone) cell, so any filter combination is an
+intersection of position arrays and its totals a sum over a few cells.
+
+Count rates and ETAs come from the per-ICC (Total, Counted) samples that
+history.py keeps for every count file.
+
+Location codes are parsed once per snapshot into Zone/Aisle/Bay/Level, and a
+LocationRollup keeps the totals of every node of that hierarchy so both tabs
+can drill down zone -> aisle -> bay without a groupby per rerun.
+
+Concurrent count sessions (one file per site) are merged into one frame with
+a Session column and split back once per snapshot for the site selector.
+Each view (all sessions, or one) gets its CountAggregates on the refresher
+thread, so reruns only read them.
+"""
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+_NO_ROWS = np.array([], dtype=np.intp)
+RATE_WINDOW = pd.Timedelta(hours=2)  # count rate is measured over this trailing window
+DISPLAY_TZ = 'Asia/Singapore'
+
+# Location code -> hierarchy, e.g. "ST-25-17-3" is zone S, aisle 25, bay 17, level 3.
+# Codes that do not match keep their first character as Zone, as the dashboard always did.
+LOCATION_PATTERN = r'^(?P<Zone>[A-Za-z])[A-Za-z]*-?(?P<Aisle>\d+)?-?(?P<Bay>\d+)?-?(?P<Level>\w+)?'
+LOCATION_LEVELS = ['Zone', 'Aisle', 'Bay', 'Level']
+
+
+# ---------- COUNT SESSIONS ----------
+def merge_sessions(frames):
+    """One frame of every session's lines ({session: frame}), with a categorical Session column."""
+    names = sorted(frames)
+    merged = pd.concat([frames[name].assign(Session=name) for name in names], ignore_index=True)
+    # Categories differ between files, so concat falls back to plain columns; restore them
+    categorical = {col for f in frames.values() for col in f.columns if isinstance(f[col].dtype, pd.CategoricalDtype)}
+    for col in categorical | {'Session'}:
+        merged[col] = merged[col].astype('category')
+    return merged
+
+
+def split_sessions(df):
+    """{session: that session's lines} of a merged frame, in session order."""
+    if df['Session'].nunique() == 1:
+        return {df['Session'].iloc[0]: df}
+    return {
+        name: df.iloc[rows].reset_index(drop=True)
+        for name, rows in df.groupby('Session', observed=True, sort=True).indices.items()
+    }
+
+
+class CountAggregates:
+    """
+    The per-snapshot aggregates Stockcount.py renders from for one view of the
+    count. `load_progress(numbers)` returns the recorded samples of those ICC
+    Numbers (history.load_count_progress), for the count rates and trend.
+    """
+
+    def __init__(self, df, load_progress):
+        self.frame = df
+        self.icc_summary = icc_progress(df)
+        self.variance_index = VarianceIndex(variance_lines(df))
+        self.location_rollup = LocationRollup(df)
+        progress = load_progress(self.icc_summary['Number'])
+        self.rates = count_rates(progress)
+        self.trend = overall_progress(progress)
+
+
+# ---------- ICC PROGRESS ----------
+def icc_progress(df):
+    """Total, Counted, Remaining and Completion_% per ICC Number."""
+    summary = df.groupby('Number', observed=True).agg(
+        Total=('Counted', 'count'),
+        Counted=('Counted', 'sum'),
+    ).reset_index()
+    summary['Remaining'] = summary['Total'] - summary['Counted']
+    summary['Completion_%'] = (summary['Counted'] / summary['Total'] * 100).round(1)
+    return summary
+
+
+def count_rates(progress, window=RATE_WINDOW):
+    """
+    Per ICC Number, from its samples in `progress` (history.load_count_progress):
+    lines counted per hour between its latest sample and the last sample at
+    least `window` older (or its first sample), and the projected finish time.
+    Numbers with no measurable progress get no rate and no ETA.
+    """
+    columns = ['Number', 'Counted', 'Remaining', 'Lines/hr', 'ETA']
+    if progress.empty:
+        return pd.DataFrame(columns=columns)
+    progress = progress.sort_values('taken_at', kind='stable')
+    latest = progress.groupby('Number').tail(1)
+    first = progress.groupby('Number').head(1).set_index('Number')
+
+    targets = latest.assign(target=latest['taken_at'] - window).sort_values('target')
+    baseline = pd.merge_asof(
+        targets, progress.rename(columns={'taken_at': 'base_at', 'Counted': 'base_counted'})[['Number', 'base_at', 'base_counted']],
+        left_on='target', right_on='base_at', by='Number', direction='backward',
+    ).set_index('Number')
+    missing = baseline['base_at'].isna()
+    baseline.loc[missing, 'base_at'] = first.loc[baseline.index[missing], 'taken_at']
+    baseline.loc[missing, 'base_counted'] = first.loc[baseline.index[missing], 'Counted']
+
+    hours = (baseline['taken_at'] - baseline['base_at']).dt.total_seconds() / 3600
+    gained = baseline['Counted'] - baseline['base_counted']
+    rate = (gained / hours).where((hours > 0) & (gained > 0))
+    remaining = baseline['Total'] - baseline['Counted']
+    eta = baseline['taken_at'] + pd.to_timedelta(remaining / rate, unit='h')
+
+    rates = pd.DataFrame({
+        'Number': baseline.index,
+        'Counted': baseline['Counted'].to_numpy(),
+        'Remaining': remaining.to_numpy(),
+        'Lines/hr': rate.round(1).to_numpy(),
+        'ETA': eta.dt.tz_convert(DISPLAY_TZ).where(remaining > 0).to_numpy(),
+    })
+    return rates.sort_values('Number', ignore_index=True)[columns]
+
+
+def overall_progress(progress):
+    """
+    Overall completion % at each sampled upload time, for the progress-over-time
+    chart. Each ICC Number counts with its latest sample by then, so files of
+    concurrent sessions uploaded at different times combine.
+    """
+    if progress.empty:
+        return pd.Series(dtype=float, index=pd.DatetimeIndex([], tz='UTC').tz_convert(DISPLAY_TZ))
+    latest = progress.pivot_table(index='taken_at', columns='Number', values=['Total', 'Counted'], aggfunc='last').ffill()
+    pct = (latest['Counted'].sum(axis=1) / latest['Total'].sum(axis=1) * 100).round(1)
+    pct.index = pct.index.tz_convert(DISPLAY_TZ)
+    return pct
+
+
+# ---------- LOCATION HIERARCHY ----------
+def parse_locations(df, pattern=LOCATION_PATTERN):
+    """Add categorical Zone/Aisle/Bay/Level columns parsed from Location in one vectorised pass."""
+    location = df['Location'].astype(str)
+    parts = location.str.extract(pattern)
+    for level in LOCATION_LEVELS:
+        values = parts[level] if level in parts else pd.Series(np.nan, index=df.index)
+        values = values.fillna(location.str[:1] if level == 'Zone' else '')
+        df[level] = values.astype('category')
+    return df
+
+
+class LocationRollup:
+    """
+    Lines, counted lines, variance lines and gain/loss quantities for every
+    zone, (zone, aisle) and (zone, aisle, bay) of a snapshot. `children(path)`
+    returns the rows one level below `path` with a dict lookup.
+    """
+
+    DRILL_LEVELS = ['Zone', 'Aisle', 'Bay']
+    METRICS = ['Lines', 'Counted', 'VarianceLines', 'Gain', 'Loss']
+
+    def __init__(self, df):
+        keyed = pd.DataFrame({
+            **{level: df[level].astype(str) for level in self.DRILL_LEVELS},
+            'Lines': 1,
+            'Counted': df['Counted'].astype(int),
+            'VarianceLines': (df['Variance'] != 0).astype(int),
+            'Gain': df['Variance'].clip(lower=0),
+            'Loss': df['Variance'].clip(upper=0),
+        })
+        self._children = {}
+        for depth in range(1, len(self.DRILL_LEVELS) + 1):
+            totals = keyed.groupby(self.DRILL_LEVELS[:depth], sort=True)[self.METRICS].sum()
+            totals['Remaining'] = totals['Lines'] - totals['Counted']
+            totals['Completion_%'] = (totals['Counted'] / totals['Lines'] * 100).round(1)
+            totals['Net'] = totals['Gain'] + totals['Loss']
+            if depth == 1:
+                self._children[()] = totals
+                continue
+            parents = list(range(depth - 1))
+            for parent, rows in totals.groupby(level=parents, sort=False):
+                self._children[parent] = rows.droplevel(parents)
+
+    def children(self, path=()):
+        """Totals per child of `path` (a tuple of zone, aisle), indexed by the next level down."""
+        path = tuple(path)[:len(self.DRILL_LEVELS) - 1]
+        rows = self._children.get(path)
+        if rows is None:
+            rows = self._children[()].iloc[:0]
+        return rows.rename_axis(self.DRILL_LEVELS[len(path)])
+
+
+# ---------- VARIANCE LINES ----------
+def variance_lines(df):
+    """Lines with a variance, with the CSS class (gain/loss) of their Variance cell."""
+    df_var = df[df['Variance'] != 0].copy()
+    df_var['VarClass'] = np.where(df_var['Variance'] > 0, 'gain', 'loss')
+    return df_var.reset_index(drop=True)
+
+
+def _positions(series):
+    """{value: sorted row positions} for every value of `series`."""
+    groups = series.groupby(series, observed=True, dropna=False).indices
+    return {value: np.asarray(rows, dtype=np.intp) for value, rows in groups.items()}
+
+
+# ---------- FILTER INDEX ----------
+class VarianceIndex:
+    """
+    Variance lines of one snapshot with everything the filters need. Filters
+    are `sign` ('gain'/'loss'), `number` (ICC Number) and `zone`; None means All.
+    Lines with a blank Number or Zone are only selected (and totalled) under All.
+    """
+
+    FILTER_COLUMNS = {'sign': 'VarClass', 'number': 'Number', 'zone': 'Zone'}
+
+    def __init__(self, df_var):
+        self.lines = df_var
+        self.count_numbers = sorted(df_var['Number'].dropna().unique().tolist())
+        self.zones = sorted(df_var['Zone'].dropna().unique().tolist())
+        self._positions = {name: _positions(df_var[col]) for name, col in self.FILTER_COLUMNS.items()}
+        self._cells = (
+            df_var.groupby(list(self.FILTER_COLUMNS.values()), observed=True, dropna=False)['Variance']
+            .agg(lines='size', qty='sum')
+            .reset_index()
+        )
+
+    def positions(self, sign=None, number=None, zone=None):
+        """Row positions matching the filters, in file order."""
+        chosen = {'sign': sign, 'number': number, 'zone': zone}
+        arrays = [self._positions[name].get(value, _NO_ROWS) for name, value in chosen.items() if value is not None]
+        if not arrays:
+            return np.arange(len(self.lines))
+        return reduce(lambda a, b: np.intersect1d(a, b, assume_unique=True), arrays)
+
+    def select(self, sign=None, number=None, zone=None):
+        return self.lines.iloc[self.positions(sign, number, zone)]
+
+    def totals(self, sign=None, number=None, zone=None):
+        """Filtered line count and gain, loss and net quantities, summed from the per-cell partial sums."""
+        cells = self._cells
+        mask = pd.Series(True, index=cells.index)
+        for name, value in (('sign', sign), ('number', number), ('zone', zone)):
+            if value is not None:
+                mask &= cells[self.FILTER_COLUMNS[name]] == value
+        cells = cells[mask]
+        gain = int(cells.loc[cells['VarClass'] == 'gain', 'qty'].sum())
+        loss = int(cells.loc[cells['VarClass'] == 'loss', 'qty'].sum())
+        return {'lines': int(cells['lines'].sum()), 'gain': gain, 'loss': loss, 'net': gain + loss}
@@ -0,0 +1,242 @@
+"""
+Lightweight per-stage timing for the dashboards and the upload page.
+
+Each script starts a Trace per rerun; the background SnapshotRefresher starts
+one per poll. Inside a trace, `span(stage)` times a block and `lap(stage)`
+closes the stage running since the previous lap, so long script sections
+can be timed without re-indenting them. Laps partition the trace; spans may
+fall inside a lap and give its detail:
+
+    trace = begin_trace("aircon")
+    with span("download") as s:
+        raw = blob.download_as_bytes()
+        s["bytes"] = len(raw)
+    lap("render")
+    end_trace(trace)
+
+Finished traces are appended as JSON lines to <TIMING_DIR>/timing.jsonl
+(rotated to timing.jsonl.1..3 past TIMING_LOG_MAX_BYTES) and summarised (p50/p95 over the last few hundred traces) in a Prometheus
+textfile, <TIMING_DIR>/<trace name>.prom, for node_exporter's textfile
+collector.
+"""
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+TIMING_DIR = os.environ.get("DASHBOARD_TIMING_DIR", "logs")
+TIMING_LOG = "timing.jsonl"
+TIMING_LOG_MAX_BYTES = int(os.environ.get("DASHBOARD_TIMING_LOG_MB", "5")) * 1024 * 1024
+TIMING_LOG_BACKUPS = 3  # timing.jsonl.1 .. .3 are kept, as RotatingFileHandler does
+HISTORY_SIZE = 500  # traces kept per name for the p50/p95 summary
+QUANTILES = (0.5, 0.95)
+
+_local = threading.local()
+_lock = threading.Lock()
+_history = defaultdict(lambda: deque(maxlen=HISTORY_SIZE))
+
+
+class Trace:
+    """Stage durations (and byte/row counts) for one rerun or one background poll."""
+
+    def __init__(self, name):
+        self.name = name
+        self.started_at = datetime.now(timezone.utc)
+        self.spans = []
+        self.counts = defaultdict(int)
+        self.total_ms = None
+        self._start = time.perf_counter()
+        self._last_lap = self._start
+
+    def record(self, stage, ms, **fields):
+        entry = {"stage": stage, "ms": round(ms, 2), **fields}
+        self.spans.append(entry)
+        return entry
+
+    def lap(self, stage, **fields):
+        now = time.perf_counter()
+        entry = self.record(stage, (now - self._last_lap) * 1000, **fields)
+        self._last_lap = now
+        return entry
+
+    def to_dict(self):
+        return {
+            "trace": self.name,
+            "started_at": self.started_at.isoformat(),
+            "total_ms": self.total_ms,
+            "spans": self.spans,
+            "counts": dict(self.counts),
+        }
+
+
+def begin_trace(name):
+    """Start a trace and make it current for this thread."""
+    trace = Trace(name)
+    _local.trace = trace
+    return trace
+
+
+def current_trace():
+    return getattr(_local, "trace", None)
+
+
+@contextmanager
+def span(stage, **fields):
+    """
+    Time a block as `stage` of the current trace. Yields a dict the block can
+    add counts to (e.g. s["bytes"] = len(raw)). Timing still happens without
+    a current trace; the result is just not recorded.
+    """
+    start = time.perf_counter()
+    extra = dict(fields)
+    try:
+        yield extra
+    finally:
+        trace = current_trace()
+        if trace is not None:
+            ms = (time.perf_counter() - start) * 1000
+            trace.record(stage, ms, **extra)
+
+
+def lap(stage, **fields):
+    """Close the stage that ran since the previous lap of the current trace."""
+    trace = current_trace()
+    if trace is not None:
+        trace.lap(stage, **fields)
+
+
+def attach_trace(trace):
+    """Make `trace` current for this thread too, e.g. a pool worker doing part of its work."""
+    _local.trace = trace
+
+
+def count(name, n=1):
+    """Add `n` to the `name` counter of the current trace (e.g. cache hits)."""
+    trace = current_trace()
+    if trace is not None:
+        trace.counts[name] += n
+
+
+def end_trace(trace):
+    """Finish `trace`: log it, add it to the p50/p95 history and rewrite the textfile."""
+    if trace.total_ms is not None:
+        return trace
+    trace.total_ms = round((time.perf_counter() - trace._start) * 1000, 2)
+    if current_trace() is trace:
+        _local.trace = None
+    with _lock:
+        _history[trace.name].append(trace)
+        try:
+            os.makedirs(TIMING_DIR, exist_ok=True)
+            path = os.path.join(TIMING_DIR, TIMING_LOG)
+            _rotate(path)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(trace.to_dict(), default=str) + "\n")
+            _write_textfile(trace.name)
+        except OSError:
+            pass  # timing must never break the dashboard
+    return trace
+
+
+def _rotate(path):
+    """Roll `path` over to path.1 (shifting older backups) once it passes TIMING_LOG_MAX_BYTES; called with _lock held."""
+    if not os.path.exists(path) or os.path.getsize(path) < TIMING_LOG_MAX_BYTES:
+        return
+    for n in range(TIMING_LOG_BACKUPS - 1, 0, -1):
+        if os.path.exists(f"{path}.{n}"):
+            os.replace(f"{path}.{n}", f"{path}.{n + 1}")
+    os.replace(path, f"{path}.1")
+
+
+# ---------- SUMMARIES ----------
+def _quantile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def summary(name):
+    """{stage: (p50_ms, p95_ms, count)} over recent traces of `name`; stage "total" is the whole trace."""
+    with _lock:
+        traces = list(_history[name])
+    by_stage = defaultdict(list)
+    for trace in traces:
+        by_stage["total"].append(trace.total_ms)
+        for s in trace.spans:
+            by_stage[s["stage"]].append(s["ms"])
+    return {
+        stage: (_quantile(ms, 0.5), _quantile(ms, 0.95), len(ms))
+        for stage, ms in by_stage.items()
+    }
+
+
+def _write_textfile(name):
+    """Prometheus textfile with p50/p95 per stage; called with _lock held."""
+    traces = list(_history[name])
+    totals = [t.total_ms / 1000 for t in traces]
+    stages = defaultdict(list)
+    for trace in traces:
+        for s in trace.spans:
+            stages[s["stage"]].append(s["ms"] / 1000)
+
+    lines = [
+        "# HELP dashboard_trace_seconds Wall time of a dashboard rerun or background poll.",
+        "# TYPE dashboard_trace_seconds summary",
+    ]
+    for q in QUANTILES:
+        lines.append(f'dashboard_trace_seconds{{trace="{name}",quantile="{q}"}} {_quantile(totals, q):.6f}')
+    lines.append(f'dashboard_trace_seconds_sum{{trace="{name}"}} {sum(totals):.6f}')
+    lines.append(f'dashboard_trace_seconds_count{{trace="{name}"}} {len(totals)}')
+    lines += [
+        "# HELP dashboard_stage_seconds Wall time of one stage within a trace.",
+        "# TYPE dashboard_stage_seconds summary",
+    ]
+    for stage, values in sorted(stages.items()):
+        for q in QUANTILES:
+            lines.append(
+                f'dashboard_stage_seconds{{trace="{name}",stage="{stage}",quantile="{q}"}} {_quantile(values, q):.6f}'
+            )
+        lines.append(f'dashboard_stage_seconds_sum{{trace="{name}",stage="{stage}"}} {sum(values):.6f}')
+        lines.append(f'dashboard_stage_seconds_count{{trace="{name}",stage="{stage}"}} {len(values)}')
+
+    path = os.path.join(TIMING_DIR, f"{name.replace(':', '_')}.prom")
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp, path)  # node_exporter must never read a half-written file
+
+
+# ---------- SIDEBAR PANEL ----------
+def _format_spans(spans):
+    rows = []
+    for s in spans:
+        extra = ", ".join(
+            describe_bytes(v) if k == "bytes" else f"{k}={v}" for k, v in s.items() if k not in ("stage", "ms")
+        )
+        rows.append(f"{s['stage']:<16}{s['ms']:>9.1f} ms" + (f"  ({extra})" if extra else ""))
+    return "\n".join(rows)
+
+
+def describe_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+
+
+def timing_panel(sidebar, trace, background=None):
+    """Collapsible sidebar panel: this rerun's stages, the last background load and p50/p95."""
+    lines = [f"This rerun: {trace.total_ms:.0f} ms", _format_spans(trace.spans)]
+    if trace.counts:
+        lines.append(", ".join(f"{name}={n}" for name, n in sorted(trace.counts.items())))
+    if background is not None and background.total_ms is not None:
+        lines += ["", f"Last data load: {background.total_ms:.0f} ms", _format_spans(background.spans)]
+    rows = summary(trace.name)
+    if rows:
+        lines += ["", f"{'stage':<16}{'p50 ms':>9}{'p95 ms':>9}{'n':>6}"]
+        lines += [f"{stage:<16}{p50:>9.1f}{p95:>9.1f}{n:>6}" for stage, (p50, p95, n) in sorted(rows.items())]
+    sidebar.expander("⏱️ Timing", expanded=False).text("\n".join(lines))